@@ -1,55 +1,668 @@
+import base64
+import gzip
 import json
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Import time of the module, mostly boto3 and creating its clients, is reported on cold start
+IMPORT_STARTED = time.perf_counter()
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+import async_inference
+import batching
+import invocation
+import local_model
+import metrics
+import prediction_cache
+import routing
+import shadow
+import validation
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-sm_runtime = boto3.client("sagemaker-runtime")
+# Multi-line csv payloads larger than the chunk size are split and invoked concurrently
+BATCH_CHUNK_ROWS = int(os.environ.get("BATCH_CHUNK_ROWS", "1000"))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "4"))
+
+# Responses are read in chunks up to the maximum size, and gzip encoded if the client accepts it
+MAX_RESPONSE_BYTES = int(os.environ.get("MAX_RESPONSE_BYTES", str(5 * 1024 * 1024)))
+READ_CHUNK_BYTES = int(os.environ.get("READ_CHUNK_BYTES", str(64 * 1024)))
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+
+# Invocations are retried until the deadline taken from the lambda remaining time, and can be
+# hedged with a duplicate request once slower than the percentile of recent latencies
+INVOKE_MAX_ATTEMPTS = int(os.environ.get("INVOKE_MAX_ATTEMPTS", "3"))
+INVOKE_READ_TIMEOUT = int(os.environ.get("INVOKE_READ_TIMEOUT", "60"))
+DEADLINE_MARGIN_MS = int(os.environ.get("DEADLINE_MARGIN_MS", "500"))
+HEDGE_PERCENTILE = os.environ.get("HEDGE_PERCENTILE")
+
+# Retries are limited to a ratio of requests, and requests are shed with a 503 while the
+# failure rate of endpoint calls has opened the circuit breaker
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+BREAKER_FAILURE_RATE = float(os.environ.get("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "20"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "5"))
+
+# Requests can be routed over several endpoints and variants configured as a json list of
+# targets, otherwise all requests go to the endpoint name
+ROUTING_TARGETS = os.environ.get("ROUTING_TARGETS", "")
+
+# A fraction of requests can be mirrored to a candidate endpoint in the background
+SHADOW_ENDPOINT_NAME = os.environ.get("SHADOW_ENDPOINT_NAME", "")
+SHADOW_FRACTION = float(os.environ.get("SHADOW_FRACTION", "0"))
+
+# Csv rows can be scored in process with the training job model artifact, requires xgboost
+LOCAL_MODEL_DATA_URL = os.environ.get("LOCAL_MODEL_DATA_URL", "")
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "")
+
+# Bodies over the threshold, or requests that prefer to respond async, are staged to s3 and sent to
+# the asynchronous endpoint.  The s3 endpoint url can point at a local stand-in for testing.
+ASYNC_ENDPOINT_NAME = os.environ.get("ASYNC_ENDPOINT_NAME", "")
+ASYNC_STAGING_URI = os.environ.get("ASYNC_STAGING_URI", "")
+ASYNC_THRESHOLD_BYTES = int(os.environ.get("ASYNC_THRESHOLD_BYTES", str(5 * 1024 * 1024)))
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+
+# Csv rows are validated against the features of the baseline constraints when set, and invalid
+# rows either reject the request or are dropped with their errors returned alongside predictions
+VALIDATION_CONSTRAINTS_URI = os.environ.get("VALIDATION_CONSTRAINTS_URI", "")
+VALIDATION_OUTPUT_COLUMNS = int(os.environ.get("VALIDATION_OUTPUT_COLUMNS", "1"))
+VALIDATION_DROP_INVALID = os.environ.get("VALIDATION_DROP_INVALID", "false").lower() == "true"
+VALIDATION_MAX_ERRORS = 100
+
+# Stage timings are written as embedded metric format log lines when a namespace is set, with a
+# sample of requests aggregated into high resolution distributions
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "")
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", "0"))
+
+# Keep-alive connections are pooled for each invoker thread, plus the shadow thread, and warm-up
+# events open connections for the batch workers ahead of requests
+MAX_POOL_CONNECTIONS = int(os.environ.get("MAX_POOL_CONNECTIONS", str(2 * BATCH_MAX_WORKERS + 3)))
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", str(BATCH_MAX_WORKERS)))
+WARMUP_ON_INIT = os.environ.get("WARMUP_ON_INIT", "false").lower() == "true"
+
+# Retries are handled by the invoker so they can respect the request deadline
+sm_runtime = boto3.client(
+    "sagemaker-runtime",
+    config=Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        read_timeout=INVOKE_READ_TIMEOUT,
+        retries={"max_attempts": 0},
+    ),
+)
+
+# Thread pools and cache are created once and re-used across invocations in a warm container
+executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS)
+invoker = invocation.Invoker(
+    ThreadPoolExecutor(max_workers=2 * BATCH_MAX_WORKERS + 2),
+    max_attempts=INVOKE_MAX_ATTEMPTS,
+    hedge_percentile=float(HEDGE_PERCENTILE) if HEDGE_PERCENTILE else None,
+    retry_budget=invocation.RetryBudget(ratio=RETRY_BUDGET_RATIO),
+    breaker=invocation.CircuitBreaker(
+        failure_rate=BREAKER_FAILURE_RATE,
+        min_calls=BREAKER_MIN_CALLS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+    ),
+)
+router = routing.Router.from_config(ROUTING_TARGETS, os.environ.get("ENDPOINT_NAME", ""))
+shadow_mirror = shadow.ShadowMirror(
+    lambda payload, content_type, custom_attributes: invoke_shadow(
+        payload, content_type, custom_attributes
+    ),
+    SHADOW_FRACTION if SHADOW_ENDPOINT_NAME else 0,
+    queue_size=int(os.environ.get("SHADOW_QUEUE_SIZE", "100")),
+    batch_size=int(os.environ.get("SHADOW_BATCH_SIZE", "50")),
+)
+s3 = (
+    boto3.client("s3", endpoint_url=S3_ENDPOINT_URL)
+    if LOCAL_MODEL_DATA_URL or ASYNC_ENDPOINT_NAME or VALIDATION_CONSTRAINTS_URI
+    else None
+)
+async_offload = async_inference.AsyncOffload(s3, sm_runtime, ASYNC_ENDPOINT_NAME, ASYNC_STAGING_URI)
+local_predictor = local_model.LocalModel(
+    s3,
+    LOCAL_MODEL_DATA_URL,
+    MODEL_VERSION,
+    refresh_seconds=int(os.environ.get("LOCAL_MODEL_REFRESH_SECONDS", "300")),
+    max_rows=int(os.environ.get("LOCAL_MODEL_MAX_ROWS", "100")),
+)
+# Lambda runs one request at a time in a container, so a single timer is shared with the pool
+timer = metrics.StageTimer()
+metrics_logger = metrics.MetricsLogger(METRICS_NAMESPACE, sample_rate=METRICS_SAMPLE_RATE)
+cache = prediction_cache.PredictionCache(
+    max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.environ.get("CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl_seconds=int(os.environ.get("CACHE_TTL_SECONDS", "300")),
+)
+# Csv responses are joined with the separator each target returns several rows with
+row_separators = batching.RowSeparators()
+csv_schema = None
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+def get_csv_schema():
+    """
+    Load the csv schema from the baseline constraints once per container.  Validation is
+    skipped if the constraints can't be loaded, leaving the endpoint to reject bad rows.
+    """
+    global csv_schema
+    if csv_schema is None and VALIDATION_CONSTRAINTS_URI:
+        try:
+            bucket, key = async_inference.parse_s3_uri(VALIDATION_CONSTRAINTS_URI)
+            constraints = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+            csv_schema = validation.CsvSchema.from_constraints(
+                constraints, VALIDATION_OUTPUT_COLUMNS
+            )
+            logger.info("validating csv columns: %s", ",".join(csv_schema.names))
+        except (ClientError, KeyError, ValueError) as e:
+            logger.warning("unable to load constraints, csv validation disabled: %s", e)
+            csv_schema = False
+    return csv_schema or None
+
+
+def format_row_errors(errors):
+    return [{"row": index, "error": error} for index, error in errors[:VALIDATION_MAX_ERRORS]]
+
+
+def with_row_errors(status_code, predictions, content_type, row_errors):
+    # Predictions of the valid rows are returned along side the errors of the dropped rows
+    if not row_errors or status_code != 200:
+        return status_code, predictions, content_type
+    body = json.dumps({"predictions": predictions, "errors": format_row_errors(row_errors)})
+    return 207, body, "application/json"
+
+
+def get_header(headers, name, default=""):
+    # API Gateway passes headers with the case sent by the client
+    for key, value in (headers or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return default
+
+
+def read_body(body, max_bytes=MAX_RESPONSE_BYTES, chunk_size=READ_CHUNK_BYTES):
+    """
+    Read a streaming body in chunks, failing fast once it exceeds the maximum size.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            body.close()
+            raise ResponseTooLarge("response exceeds {} bytes".format(max_bytes))
+        chunks.append(chunk)
+    return b"".join(chunks).decode("utf-8")
+
+
+def build_response(status_code, body, content_type, endpoint_name, accept_encoding=""):
+    start = time.perf_counter()
+    headers = {"Content-Type": content_type, "X-SageMaker-Endpoint": endpoint_name}
+    data = body.encode("utf-8")
+    is_base64_encoded = False
+    if "gzip" in accept_encoding and len(data) >= GZIP_MIN_BYTES:
+        data = base64.b64encode(gzip.compress(data, compresslevel=5))
+        headers["Content-Encoding"] = "gzip"
+        is_base64_encoded = True
+    if len(data) > MAX_RESPONSE_BYTES:
+        raise ResponseTooLarge("response exceeds {} bytes".format(MAX_RESPONSE_BYTES))
+    response = {
+        "statusCode": status_code,
+        "headers": headers,
+        "body": data.decode("utf-8") if is_base64_encoded else body,
+        "isBase64Encoded": is_base64_encoded,
+    }
+    timer.add("BuildResponse", time.perf_counter() - start)
+    return response
+
+
+def invoke_endpoint(target, payload, content_type, custom_attributes, deadline=None):
+    kwargs = {"TargetVariant": target.variant_name} if target.variant_name else {}
+
+    def call():
+        start = time.perf_counter()
+        response = sm_runtime.invoke_endpoint(
+            EndpointName=target.endpoint_name,
+            Body=payload,
+            ContentType=content_type,
+            CustomAttributes=custom_attributes,
+            Accept="application/json",
+            **kwargs,
+        )
+        invoked = time.perf_counter()
+        predictions = read_body(response["Body"])
+        return predictions, start, invoked, time.perf_counter()
+
+    # Only the call whose response is returned is recorded, not a hedged duplicate of it
+    start = time.perf_counter()
+    try:
+        predictions, started, invoked, finished = invoker.invoke(call, deadline, target.name)
+    except invocation.CircuitOpen:
+        raise
+    except Exception:
+        router.record(target, time.perf_counter() - start, success=False)
+        raise
+    timer.add("Invoke", invoked - started)
+    timer.add("ReadBody", finished - invoked)
+    router.record(target, finished - started)
+    return predictions
+
+
+def invoke_shadow(payload, content_type, custom_attributes):
+    response = sm_runtime.invoke_endpoint(
+        EndpointName=SHADOW_ENDPOINT_NAME,
+        Body=payload,
+        ContentType=content_type,
+        CustomAttributes=custom_attributes,
+        Accept="application/json",
+    )
+    return read_body(response["Body"])
+
+
+def invoke_batch(target, rows, content_type, custom_attributes, row_index=None, deadline=None):
+    logger.info("batch of %d rows in chunks of %d", len(rows), BATCH_CHUNK_ROWS)
+    results = batching.invoke_chunks(
+        executor,
+        lambda chunk: invoke_endpoint(target, chunk, content_type, custom_attributes, deadline),
+        rows,
+        BATCH_CHUNK_ROWS,
+        row_index,
+    )
+    errors = [r for r in results if "error" in r]
+    if not errors:
+        return 200, batching.merge_results(results, row_separators.get(target.name))
+    # Report the failed chunks along side the predictions for chunks that succeeded
+    status_code = 500 if len(errors) == len(results) else 207
+    return status_code, json.dumps({"chunks": results})
+
+
+def invoke_rows(target, rows, content_type, custom_attributes, row_index=None, deadline=None):
+    if len(rows) > BATCH_CHUNK_ROWS:
+        return invoke_batch(target, rows, content_type, custom_attributes, row_index, deadline)
+    payload = "\n".join(rows)
+    body = invoke_endpoint(target, payload, content_type, custom_attributes, deadline)
+    row_separators.learn(target.name, body)
+    return 200, body
+
+
+def invoke_cached_rows(target, rows, content_type, custom_attributes, deadline=None):
+    if content_type.startswith("text/csv"):
+        normalize = prediction_cache.normalize_csv_row
+    else:
+        normalize = str.strip
+    keys = [
+        prediction_cache.cache_key(
+            target.name,
+            content_type,
+            custom_attributes,
+            normalize(row),
+        )
+        for row in rows
+    ]
+    cached = [cache.get(key) for key in keys]
+    missing = [i for i, entry in enumerate(cached) if entry is None]
+    if not missing:
+        fmt = cached[0][1]
+        if fmt != "json":
+            fmt = row_separators.get(target.name, fmt)
+        return 200, batching.join_predictions([c[0] for c in cached], fmt)
+
+    # Only invoke the endpoint for the rows that are not cached
+    status_code, body = invoke_rows(
+        target,
+        [rows[i] for i in missing],
+        content_type,
+        custom_attributes,
+        row_index=missing,
+        deadline=deadline,
+    )
+    if status_code != 200:
+        return status_code, body
+    fmt = batching.prediction_format(body)
+    if fmt != "json":
+        # Entries are stored with the separator of the target, or of the cached rows if the
+        # target hasn't returned several rows yet
+        default = next((c[1] for c in cached if c is not None), batching.DEFAULT_SEPARATOR)
+        fmt = row_separators.get(target.name, default)
+    predictions = batching.split_predictions(body)
+    if len(predictions) != len(missing):
+        logger.warning("got %d predictions for %d rows", len(predictions), len(missing))
+        if len(missing) == len(rows):
+            return status_code, body
+        return invoke_rows(target, rows, content_type, custom_attributes, deadline=deadline)
+    for i, prediction in zip(missing, predictions):
+        cached[i] = (prediction, fmt)
+        cache.put(keys[i], cached[i])
+    return 200, batching.join_predictions([c[0] for c in cached], fmt)
+
+
+def invoke_cached(target, payload, content_type, custom_attributes, deadline=None):
+    key = prediction_cache.cache_key(
+        target.name,
+        content_type,
+        custom_attributes,
+        payload.strip(),
+    )
+    predictions = cache.get(key)
+    if predictions is None:
+        predictions = invoke_endpoint(target, payload, content_type, custom_attributes, deadline)
+        cache.put(key, predictions)
+    return 200, predictions
+
+
+def submit_async(event, data, content_type, custom_attributes):
+    token = async_offload.submit(data, content_type, custom_attributes)
+    # Include the stage in the location of the results route
+    path = event.get("requestContext", {}).get("path") or event.get("path") or "/api"
+    location = "{}/results/{}".format(path.rstrip("/"), token)
+    return {
+        "statusCode": 202,
+        "headers": {"Content-Type": "application/json", "Location": location},
+        "body": json.dumps({"token": token, "status": "InProgress", "location": location}),
+    }
+
+
+def get_async_result(token, endpoint_name, accept_encoding):
+    try:
+        status, location, head = async_offload.status(token)
+    except KeyError:
+        return {"statusCode": 404, "message": "unknown token: {}".format(token)}
+    if status == "InProgress":
+        return {
+            "statusCode": 202,
+            "headers": {"Content-Type": "application/json", "Retry-After": "5"},
+            "body": json.dumps({"token": token, "status": status}),
+        }
+    if status == "Failed":
+        message = read_body(async_offload.open(location))
+        logger.error("async job %s failed: %s", token, message)
+        return {"statusCode": 500, "message": message}
+    if head["ContentLength"] > MAX_RESPONSE_BYTES:
+        # Redirect to the output in s3 when it is too large to return through the api
+        return {
+            "statusCode": 303,
+            "headers": {"Location": async_offload.presign(location)},
+            "body": "",
+        }
+    predictions = read_body(async_offload.open(location))
+    return build_response(
+        200,
+        predictions,
+        head.get("ContentType", "application/json"),
+        endpoint_name,
+        accept_encoding,
+    )
+
+
+def is_warmup_event(event):
+    # Scheduled events from EventBridge, or an explicit warm-up payload
+    return event.get("source") == "aws.events" or bool(event.get("warmup"))
+
+
+def open_connection():
+    # A call for an endpoint that doesn't exist fails fast at the service, after the TLS
+    # handshake, leaving the keep-alive connection in the pool without invoking a model
+    start = time.perf_counter()
+    try:
+        sm_runtime.invoke_endpoint(EndpointName="connection-warmup", Body=b"")
+    except ClientError:
+        pass
+    return time.perf_counter() - start
+
+
+def warm_up(connections=WARMUP_CONNECTIONS):
+    """
+    Open pooled connections to sagemaker-runtime concurrently, so each is a separate
+    connection, and return the time taken for each.
+    """
+    if connections <= 0:
+        return []
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        futures = [pool.submit(open_connection) for _ in range(connections)]
+        wait(futures)
+    seconds = []
+    for future in futures:
+        if future.exception() is None:
+            seconds.append(future.result())
+        else:
+            logger.warning("unable to open connection: %s", future.exception())
+    return seconds
+
+
+cold_start = True
 
 
 def lambda_handler(event, context):
+    global cold_start
+    if cold_start:
+        cold_start = False
+        logger.info("cold start, module import %.1f ms", IMPORT_SECONDS * 1000)
+        metrics_logger.emit(
+            {"EndpointName": os.environ.get("ENDPOINT_NAME", "")},
+            {"ImportTime": IMPORT_SECONDS * 1000},
+            unit="Milliseconds",
+        )
+    if is_warmup_event(event):
+        seconds = warm_up()
+        logger.info("warm-up opened %d connections in %s s", len(seconds), seconds)
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"connections": len(seconds), "import_ms": IMPORT_SECONDS * 1000}),
+        }
+
+    timer.reset()
+    response = handle_request(event, context)
+    if timer.dimensions:
+        metrics_logger.record(timer, {"StatusCode": response["statusCode"]})
+        counters = invoker.stats()
+        if local_predictor.enabled:
+            counters.update(local_predictor.counters)
+        metrics_logger.emit_deltas(
+            {"EndpointName": timer.dimensions["EndpointName"]},
+            counters,
+            {"BreakerState": invoker.breaker_state()},
+        )
+    if shadow_mirror.enabled:
+        shadow_mirror.flush_if_due()
+    return response
+
+
+def service_unavailable(retry_after):
+    return {
+        "statusCode": 503,
+        "headers": {"Retry-After": str(max(1, int(round(retry_after))))},
+        "message": "endpoint is unavailable",
+    }
+
+
+def handle_request(event, context):
     logger.debug("event %s", json.dumps(event))
     endpoint_name = os.environ["ENDPOINT_NAME"]
     logger.info("api for endpoint %s", endpoint_name)
 
     # Get posted body and content type
-    content_type = event["headers"].get("Content-Type", "text/csv")
-    custom_attributes = event["headers"].get("X-Amzn-SageMaker-Custom-Attributes", "")
+    headers = event.get("headers")
+    content_type = get_header(headers, "Content-Type", "text/csv")
+    custom_attributes = get_header(headers, "X-Amzn-SageMaker-Custom-Attributes")
+    accept_encoding = get_header(headers, "Accept-Encoding")
+
+    if event.get("httpMethod") == "GET":
+        token = (event.get("pathParameters") or {}).get("token")
+        if not async_offload.enabled or not token:
+            return {"statusCode": 404, "message": "not found"}
+        try:
+            return get_async_result(token, async_offload.endpoint_name, accept_encoding)
+        except ResponseTooLarge as e:
+            logger.error(e)
+            return {"statusCode": 413, "message": str(e)}
+        except ClientError as e:
+            logger.error("Unexpected async result error: {}".format(e.response["Error"]["Message"]))
+            if e.response["Error"]["Code"] in ("SlowDown", "ThrottlingException", "503"):
+                return service_unavailable(5)
+            return {"statusCode": 500, "message": "Unexpected async result error"}
+
+    timer.dimensions = {
+        "EndpointName": endpoint_name,
+        "ContentType": content_type.split(";")[0].strip() or "none",
+    }
+    timer.mark("ParseHeaders")
+    body = event["body"]
+    data = None
+    if event.get("isBase64Encoded"):
+        data = base64.b64decode(body)
+        # Clients can compress large bodies, which are decompressed before validation
+        if "gzip" in get_header(headers, "Content-Encoding"):
+            data = gzip.decompress(data)
+        body = data.decode("utf-8")
+    # Row based content types are split so they can be cached per row and batched
+    rows = None
+    row_errors = None
+    error_message = None
     if content_type.startswith("text/csv"):
-        payload = event["body"]
+        rows = batching.split_rows(body)
+        schema = get_csv_schema()
+        if schema is not None:
+            row_errors = validation.validate_csv_rows(rows, schema)
+            if row_errors and (not VALIDATION_DROP_INVALID or len(row_errors) == len(rows)):
+                message = "{} of {} rows are invalid".format(len(row_errors), len(rows))
+                logger.error("invalid payload: %s", message)
+                return {
+                    "statusCode": 400,
+                    "message": message,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": json.dumps({"errors": format_row_errors(row_errors)}),
+                }
+            if row_errors:
+                logger.warning("dropping %d of %d invalid rows", len(row_errors), len(rows))
+                invalid = set(index for index, _ in row_errors)
+                rows = [row for index, row in enumerate(rows) if index not in invalid]
+                body = "\n".join(rows)
+                data = None
+    elif content_type.startswith("application/jsonlines"):
+        rows = batching.split_rows(body)
+        error_message = validation.validate_json_lines(rows)
     elif content_type.startswith("application/json"):
-        payload = json.loads(event["body"])
+        # Forward the original json document without parsing it into python objects
+        error_message = validation.validate_json(body)
     else:
         message = "bad content type: {}".format(content_type)
-        logger.error()
+        logger.error(message)
         return {"statusCode": 500, "message": message}
 
-    logger.info("content type: %s size: %d", content_type, len(payload))
+    if error_message is not None:
+        logger.error("invalid payload: %s", error_message)
+        return {"statusCode": 400, "message": error_message}
+
+    timer.mark("Validate")
+    logger.info("content type: %s size: %d", content_type, len(body))
+
+    if async_offload.enabled:
+        data = data if data is not None else body.encode("utf-8")
+        if len(data) > ASYNC_THRESHOLD_BYTES or "respond-async" in get_header(headers, "Prefer"):
+            try:
+                return submit_async(event, data, content_type, custom_attributes)
+            except ClientError as e:
+                logger.error(e)
+                return {"statusCode": 500, "message": "Unexpected async inference error"}
+
+    # Clear cached predictions if the endpoint or its config has changed
+    cache.bind((endpoint_name, os.environ.get("ENDPOINT_CONFIG_NAME", "")))
+    deadline = invocation.get_deadline(context, DEADLINE_MARGIN_MS)
 
+    if content_type.startswith("text/csv") and local_predictor.accepts(len(rows)):
+        try:
+            predictions = local_predictor.predict(
+                rows, endpoint_name, row_separators.get(endpoint_name)
+            )
+            status_code, predictions, response_type = with_row_errors(
+                200, predictions, content_type, row_errors
+            )
+            return build_response(
+                status_code, predictions, response_type, endpoint_name, accept_encoding
+            )
+        except Exception as e:
+            local_predictor.counters["LocalFallbacks"] += 1
+            logger.warning("local model failed, falling back to endpoint: %s", e)
+
+    # Route the request to an endpoint or variant by its row count and custom attributes,
+    # avoiding targets whose circuit is open
     try:
-        # Invoke the endpoint with full multi-line payload
-        response = sm_runtime.invoke_endpoint(
-            EndpointName=endpoint_name,
-            Body=payload,
-            ContentType=content_type,
-            CustomAttributes=custom_attributes,
-            Accept="application/json",
+        target = router.choose(
+            len(rows) if rows is not None else 1,
+            custom_attributes,
+            available=lambda t: not invoker.breaker_for(t.name).retry_after(),
         )
-        # Return predictions as JSON dictionary instead of CSV text
-        predictions = response["Body"].read().decode("utf-8")
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Content-Type": content_type,
-                "X-SageMaker-Endpoint": endpoint_name,
-            },
-            "body": predictions,
-        }
+    except ValueError as e:
+        logger.error(e)
+        return {"statusCode": 400, "message": str(e)}
+
+    # Shed requests while the circuit is open rather than splitting them into chunks that fail
+    breaker = invoker.breaker_for(target.name)
+    retry_after = breaker.retry_after()
+    if retry_after:
+        invoker.count("Shed")
+        logger.warning("shedding request, %s circuit is %s", target.name, breaker.state)
+        return service_unavailable(retry_after)
+
+    try:
+        if rows is not None:
+            if cache.enabled:
+                status_code, predictions = invoke_cached_rows(
+                    target, rows, content_type, custom_attributes, deadline
+                )
+            else:
+                status_code, predictions = invoke_rows(
+                    target, rows, content_type, custom_attributes, deadline=deadline
+                )
+        elif cache.enabled:
+            status_code, predictions = invoke_cached(
+                target, body, content_type, custom_attributes, deadline
+            )
+        else:
+            # Invoke the endpoint with full payload
+            status_code = 200
+            predictions = invoke_endpoint(target, body, content_type, custom_attributes, deadline)
+        if status_code == 200:
+            shadow_mirror.offer(body, content_type, custom_attributes, predictions)
+        logger.info("cache stats: %s", json.dumps(cache.stats()))
+        logger.info("invocation stats: %s", json.dumps(invoker.stats()))
+        if len(router.targets) > 1:
+            logger.info("routing stats: %s", json.dumps(router.stats()))
+        status_code, predictions, response_type = with_row_errors(
+            status_code,
+            predictions,
+            content_type if status_code == 200 else "application/json",
+            row_errors,
+        )
+        return build_response(
+            status_code, predictions, response_type, target.endpoint_name, accept_encoding
+        )
+    except ResponseTooLarge as e:
+        logger.error(e)
+        return {"statusCode": 413, "message": str(e)}
+    except invocation.CircuitOpen as e:
+        logger.warning(e)
+        return service_unavailable(e.retry_after)
+    except invocation.DeadlineExceeded as e:
+        logger.error(e)
+        return {"statusCode": 504, "message": str(e)}
     except ClientError as e:
         logger.error("Unexpected sagemaker error: {}".format(e.response["Error"]["Message"]))
         logger.error(e)
         return {"statusCode": 500, "message": "Unexpected sagemaker error"}
+
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+if WARMUP_ON_INIT:
+    warm_up()
@@ -0,0 +1,122 @@
+import io
+import json
+import logging
+import uuid
+from urllib.parse import urlparse
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Bodies are staged with multipart uploads of 8MB parts
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024, max_concurrency=4
+)
+
+
+def parse_s3_uri(uri):
+    url = urlparse(uri)
+    return url.netloc, url.path.lstrip("/")
+
+
+class AsyncOffload(object):
+    """
+    Offloads large or long running requests to a SageMaker asynchronous inference endpoint.
+
+    The request body is staged to S3 and the endpoint invoked asynchronously, returning a token
+    straight away so the lambda doesn't wait on the prediction.  A small marker object under the
+    staging prefix maps the token to the output and failure locations for polling the result.
+    """
+
+    def __init__(self, s3_client, sm_runtime, endpoint_name, staging_uri):
+        self.s3 = s3_client
+        self.sm_runtime = sm_runtime
+        self.endpoint_name = endpoint_name
+        self.bucket, self.prefix = (
+            parse_s3_uri(staging_uri.rstrip("/")) if staging_uri else ("", "")
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.endpoint_name and self.bucket)
+
+    def _key(self, token, name):
+        return "{}/{}/{}".format(self.prefix, token, name)
+
+    def submit(self, data, content_type, custom_attributes):
+        """
+        Stage the body and invoke the asynchronous endpoint, returning the job token.
+        """
+        token = uuid.uuid4().hex
+        input_key = self._key(token, "input")
+        self.s3.upload_fileobj(
+            io.BytesIO(data),
+            self.bucket,
+            input_key,
+            ExtraArgs={"ContentType": content_type},
+            Config=TRANSFER_CONFIG,
+        )
+        response = self.sm_runtime.invoke_endpoint_async(
+            EndpointName=self.endpoint_name,
+            ContentType=content_type,
+            CustomAttributes=custom_attributes,
+            Accept="application/json",
+            InferenceId=token,
+            InputLocation="s3://{}/{}".format(self.bucket, input_key),
+        )
+        marker = {
+            "OutputLocation": response["OutputLocation"],
+            "FailureLocation": response.get("FailureLocation", ""),
+            "ContentType": content_type,
+        }
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self._key(token, "job.json"), Body=json.dumps(marker)
+        )
+        logger.info("submitted async job %s output %s", token, response["OutputLocation"])
+        return token
+
+    def _head(self, uri):
+        if not uri:
+            return None
+        bucket, key = parse_s3_uri(uri)
+        try:
+            return self.s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def status(self, token):
+        """
+        Return the job status, one of "Completed", "Failed" or "InProgress", with the location
+        and head of the output or failure object.  Raises KeyError for unknown tokens.
+        """
+        try:
+            marker = self.s3.get_object(Bucket=self.bucket, Key=self._key(token, "job.json"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise KeyError(token)
+            raise
+        marker = json.loads(marker["Body"].read())
+        for status, location in [
+            ("Completed", marker["OutputLocation"]),
+            ("Failed", marker["FailureLocation"]),
+        ]:
+            head = self._head(location)
+            if head is not None:
+                return status, location, head
+        return "InProgress", None, None
+
+    def open(self, location):
+        """
+        Return the streaming body of the output or failure object.
+        """
+        bucket, key = parse_s3_uri(location)
+        return self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+
+    def presign(self, location, expires_seconds=3600):
+        bucket, key = parse_s3_uri(location)
+        return self.s3.generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires_seconds
+        )
@@ -0,0 +1,129 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def split_rows(payload):
+    """
+    Split a multi-line payload into its non-empty rows.
+    """
+    return [row for row in payload.splitlines() if row.strip()]
+
+
+def chunk_rows(rows, chunk_size):
+    """
+    Yield (start_row, rows) tuples of at most chunk_size rows.
+    """
+    for start in range(0, len(rows), chunk_size):
+        yield start, rows[start : start + chunk_size]
+
+
+# Csv predictions are joined with commas, as the built-in XGBoost container separates them,
+# until a multi-row response of the endpoint shows its separator
+DEFAULT_SEPARATOR = ","
+
+
+def prediction_format(body):
+    """
+    Return the format of a prediction body, either "json" or the row separator.
+    """
+    stripped = body.strip()
+    if stripped.startswith("{"):
+        return "json"
+    return "\n" if "\n" in stripped else ","
+
+
+def row_separator(body):
+    """
+    Return the separator of a csv prediction body of several rows, or None for a json body or a
+    single prediction which has no separator to learn from.
+    """
+    stripped = body.strip()
+    if stripped.startswith("{"):
+        return None
+    for separator in ["\n", ","]:
+        if separator in stripped:
+            return separator
+    return None
+
+
+class RowSeparators(object):
+    """
+    Remembers the csv prediction separator of each target from its multi-row responses, so
+    predictions joined from chunks, cache entries or single row responses are returned in the
+    same format as the endpoint returns a whole request.
+    """
+
+    def __init__(self):
+        self.separators = {}
+
+    def learn(self, name, body):
+        separator = row_separator(body)
+        if separator is not None:
+            self.separators[name] = separator
+
+    def get(self, name, default=DEFAULT_SEPARATOR):
+        return self.separators.get(name, default)
+
+
+def split_predictions(body):
+    """
+    Split a prediction body into one prediction per row.
+
+    The built-in XGBoost container returns CSV predictions separated by commas or newlines,
+    while newer versions honour the json accept type and return a predictions list.
+    """
+    fmt = prediction_format(body)
+    if fmt == "json":
+        return json.loads(body)["predictions"]
+    return [p for p in body.strip().split(fmt) if p != ""]
+
+
+def join_predictions(predictions, fmt):
+    """
+    Join per row predictions back into a body of the given prediction format.
+    """
+    if fmt == "json":
+        return json.dumps({"predictions": predictions})
+    return fmt.join(predictions)
+
+
+def invoke_chunks(executor, invoke, rows, chunk_size, row_index=None):
+    """
+    Invoke the endpoint concurrently for each chunk of rows and return the results in the
+    original row order.  Each result is a dictionary with the chunk position, and either the
+    prediction body or the error raised for that chunk.  When only a subset of the request
+    rows are invoked, row_index maps each row back to its position in the request.
+    """
+    futures = []
+    for index, (start, chunk) in enumerate(chunk_rows(rows, chunk_size)):
+        future = executor.submit(invoke, "\n".join(chunk))
+        futures.append((index, start, start + len(chunk), future))
+
+    results = []
+    for index, start, end, future in futures:
+        result = {"chunk": index, "start_row": start, "end_row": end}
+        if row_index is not None:
+            result["rows"] = row_index[start:end]
+        try:
+            result["body"] = future.result()
+        except Exception as e:
+            logger.error("chunk %d rows %d-%d failed: %s", index, start, end, e)
+            result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def merge_results(results, separator=DEFAULT_SEPARATOR):
+    """
+    Merge the chunk results into a single prediction body in the original row order, with the
+    csv separator of the chunks or the given separator when every chunk is a single row.
+    """
+    predictions = []
+    for result in results:
+        predictions.extend(split_predictions(result["body"]))
+    if prediction_format(results[0]["body"]) == "json":
+        return join_predictions(predictions, "json")
+    separators = [row_separator(result["body"]) for result in results]
+    return join_predictions(predictions, next((s for s in separators if s), separator))
@@ -0,0 +1,197 @@
+import math
+
+
+def normal_sf(z):
+    """
+    Return the survival function of the standard normal distribution at z.
+    """
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def median(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    if not n:
+        return None
+    mid = n // 2
+    return ordered[mid] if n % 2 else (ordered[mid - 1] + ordered[mid]) / 2.0
+
+
+def rank(values):
+    """
+    Return the ranks of the values starting at 1, averaging tied ranks, and the tie correction
+    sum of t^3 - t over each group of t tied values.
+    """
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2.0 + 1
+        t = j - i + 1
+        ties += t**3 - t
+        i = j + 1
+    return ranks, ties
+
+
+def _exact_u_sf(u, n1, n2):
+    """
+    Return P(U >= u) under the null hypothesis, counting the rank arrangements of each U.
+    """
+    # counts[j][k] is the number of arrangements of i values of x and j of y with U of k, built
+    # up one value of x at a time
+    counts = [[1] + [0] * (n1 * n2) for _ in range(n2 + 1)]
+    for i in range(1, n1 + 1):
+        updated = [[0] * (n1 * n2 + 1) for _ in range(n2 + 1)]
+        updated[0][0] = 1
+        for j in range(1, n2 + 1):
+            for k in range(n1 * n2 + 1):
+                # The largest value is either the i-th of the first sample, adding j to U, or not
+                updated[j][k] = (counts[j][k - j] if k >= j else 0) + updated[j - 1][k]
+        counts = updated
+    distribution = counts[n2]
+    total = sum(distribution)
+    return sum(distribution[int(math.ceil(u)) :]) / float(total)
+
+
+def mann_whitney_u(x, y, alternative="greater", exact_max_size=20):
+    """
+    Mann-Whitney U test of whether values of x tend to be greater than those of y, or differ
+    for the "two-sided" alternative.  Returns the U statistic of x and the p-value.
+
+    The p-value is exact for small samples without ties, otherwise from the normal approximation
+    with tie and continuity corrections.
+    """
+    n1, n2 = len(x), len(y)
+    if not n1 or not n2:
+        raise ValueError("both samples must be non-empty")
+    ranks, ties = rank(list(x) + list(y))
+    u = sum(ranks[:n1]) - n1 * (n1 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    if alternative == "two-sided":
+        u_tail = max(u, n1 * n2 - u)
+    else:
+        u_tail = u
+
+    if not ties and max(n1, n2) <= exact_max_size:
+        p = _exact_u_sf(u_tail, n1, n2)
+        return u, min(1.0, 2 * p if alternative == "two-sided" else p)
+
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u_tail - mean - 0.5) / math.sqrt(variance)
+    p = normal_sf(z)
+    return u, min(1.0, 2 * p if alternative == "two-sided" else p)
+
+
+def _kolmogorov_sf(x, terms=100):
+    """
+    Return the survival function of the Kolmogorov distribution at x.
+    """
+    if x <= 0:
+        return 1.0
+    total = 0.0
+    for k in range(1, terms + 1):
+        term = 2 * (-1) ** (k - 1) * math.exp(-2 * k * k * x * x)
+        total += term
+        if abs(term) < 1e-12:
+            break
+    return max(0.0, min(1.0, total))
+
+
+def ks_2samp(x, y, alternative="greater"):
+    """
+    Two sample Kolmogorov-Smirnov test of whether the distribution of x is shifted greater than
+    that of y, or differs for the "two-sided" alternative.  Returns the D statistic and the
+    asymptotic p-value.
+    """
+    n1, n2 = len(x), len(y)
+    if not n1 or not n2:
+        raise ValueError("both samples must be non-empty")
+    xs, ys = sorted(x), sorted(y)
+    i = j = 0
+    d_plus = d_minus = 0.0
+    # Walk the merged values, comparing the empirical cdfs after each distinct value
+    while i < n1 and j < n2:
+        value = min(xs[i], ys[j])
+        while i < n1 and xs[i] == value:
+            i += 1
+        while j < n2 and ys[j] == value:
+            j += 1
+        difference = j / float(n2) - i / float(n1)
+        d_plus = max(d_plus, difference)
+        d_minus = max(d_minus, -difference)
+    # x greater means its cdf is below that of y
+    ne = n1 * n2 / float(n1 + n2)
+    if alternative == "two-sided":
+        d = max(d_plus, d_minus)
+        return d, _kolmogorov_sf((math.sqrt(ne) + 0.12 + 0.11 / math.sqrt(ne)) * d)
+    return d_plus, min(1.0, math.exp(-2 * ne * d_plus * d_plus))
+
+
+def proportions_z_test(errors_x, n_x, errors_y, n_y):
+    """
+    One sided two proportion z test of whether the error rate of x is greater than that of y.
+    Returns the z statistic and the p-value.
+    """
+    if not n_x or not n_y:
+        raise ValueError("both samples must be non-empty")
+    pooled = (errors_x + errors_y) / float(n_x + n_y)
+    variance = pooled * (1 - pooled) * (1.0 / n_x + 1.0 / n_y)
+    if variance <= 0:
+        return 0.0, 1.0
+    z = (errors_x / float(n_x) - errors_y / float(n_y)) / math.sqrt(variance)
+    return z, normal_sf(z)
+
+
+def compare_latencies(canary, baseline, alpha=0.01, min_ratio=1.1, min_samples=20):
+    """
+    Compare the latency samples of canary and baseline traffic.  The canary has regressed when
+    both the Mann-Whitney and Kolmogorov-Smirnov tests find it significantly slower, and its
+    median is slower by at least the minimum ratio so that negligible differences in large
+    samples don't count.
+    """
+    result = {
+        "CanarySamples": len(canary),
+        "BaselineSamples": len(baseline),
+        "CanaryMedian": median(canary),
+        "BaselineMedian": median(baseline),
+        "Regressed": False,
+    }
+    if len(canary) < min_samples or len(baseline) < min_samples:
+        result["Skipped"] = "fewer than {} samples".format(min_samples)
+        return result
+    result["MannWhitneyU"], result["MannWhitneyP"] = mann_whitney_u(canary, baseline)
+    result["KolmogorovSmirnovD"], result["KolmogorovSmirnovP"] = ks_2samp(canary, baseline)
+    result["Regressed"] = (
+        result["MannWhitneyP"] < alpha
+        and result["KolmogorovSmirnovP"] < alpha
+        and result["CanaryMedian"] > result["BaselineMedian"] * min_ratio
+    )
+    return result
+
+
+def compare_errors(canary_errors, canary_count, baseline_errors, baseline_count, alpha=0.01):
+    """
+    Compare the error counts of canary and baseline traffic.  The canary has regressed when its
+    error rate is significantly greater.
+    """
+    result = {
+        "CanaryErrorRate": canary_errors / float(canary_count) if canary_count else None,
+        "BaselineErrorRate": baseline_errors / float(baseline_count) if baseline_count else None,
+        "Regressed": False,
+    }
+    if not canary_count or not baseline_count:
+        result["Skipped"] = "no samples"
+        return result
+    result["ErrorZ"], result["ErrorP"] = proportions_z_test(
+        canary_errors, canary_count, baseline_errors, baseline_count
+    )
+    result["Regressed"] = result["ErrorP"] < alpha
+    return result
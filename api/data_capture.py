@@ -0,0 +1,143 @@
+import base64
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def parse_s3_uri(uri):
+    url = urlparse(uri)
+    return url.netloc, url.path.lstrip("/")
+
+
+def hour_prefixes(prefix, start, end):
+    """
+    Return the hourly partition prefixes, eg "prefix/2021/01/31/23/", that SageMaker data
+    capture writes records between the start and end datetimes to, newest first.
+    """
+    hour = end.replace(minute=0, second=0, microsecond=0)
+    prefixes = []
+    while hour >= start.replace(minute=0, second=0, microsecond=0):
+        prefixes.append("{}/{}/".format(prefix.rstrip("/"), hour.strftime("%Y/%m/%d/%H")))
+        hour -= timedelta(hours=1)
+    return prefixes
+
+
+def list_objects(s3, bucket, prefix):
+    """
+    Return all the objects under the prefix, following continuation tokens past 1000 keys.
+    """
+    objects = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def list_keys(s3, bucket, prefix):
+    """
+    Return all the object keys under the prefix.
+    """
+    return [obj["Key"] for obj in list_objects(s3, bucket, prefix)]
+
+
+def scan_partitions(s3, bucket, prefixes, executor):
+    """
+    List the objects of each partition prefix concurrently, returning a dict of the prefix to
+    its objects.  Only the given partitions are listed, however much history is captured.
+    """
+    results = executor.map(lambda prefix: list_objects(s3, bucket, prefix), prefixes)
+    return dict(zip(prefixes, results))
+
+
+def summarize(objects):
+    """
+    Return the count, total bytes and newest modified time of the objects.
+    """
+    newest = max((obj["LastModified"] for obj in objects), default=None)
+    return {
+        "Objects": len(objects),
+        "Bytes": sum(obj["Size"] for obj in objects),
+        "Newest": newest.isoformat() if newest else None,
+    }
+
+
+def list_variants(s3, bucket, prefix, endpoint_name):
+    """
+    Return the prefixes of the production variants captured for the endpoint.
+    """
+    endpoint_prefix = "{}/{}/".format(prefix.rstrip("/"), endpoint_name)
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=endpoint_prefix, Delimiter="/")
+    return [p["Prefix"] for p in response.get("CommonPrefixes", [])]
+
+
+def iter_lines(s3, bucket, key):
+    """
+    Yield the non-empty lines of an object, streaming it so only a chunk is held in memory.
+    """
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        for line in body.iter_lines():
+            if line.strip():
+                yield line
+    finally:
+        body.close()
+
+
+def iter_records(s3, bucket, key):
+    """
+    Yield the capture records of a jsonl object, streaming it a line at a time.
+    """
+    for line in iter_lines(s3, bucket, key):
+        yield json.loads(line)
+
+
+def decode_capture(capture):
+    """
+    Return the content type and text of the captured endpoint input or output.
+    """
+    data = capture["data"]
+    if capture.get("encoding") == "BASE64":
+        data = base64.b64decode(data).decode("utf-8")
+    return capture.get("observedContentType", ""), data
+
+
+def validate_record(record):
+    """
+    Return an error if the record doesn't have both an endpoint input and output that decode,
+    or None if it is valid.
+    """
+    capture_data = record.get("captureData") or {}
+    for mode in ["endpointInput", "endpointOutput"]:
+        if mode not in capture_data:
+            return "missing {}".format(mode)
+        try:
+            content_type, data = decode_capture(capture_data[mode])
+        except (KeyError, TypeError, ValueError) as e:
+            return "{} not decodable: {}".format(mode, e)
+        if not data.strip():
+            return "{} empty".format(mode)
+        if "json" in content_type:
+            try:
+                for line in data.splitlines() if "jsonlines" in content_type else [data]:
+                    if line.strip():
+                        json.loads(line)
+            except ValueError as e:
+                return "{} not json: {}".format(mode, e)
+    return None
+
+
+def parse_inference_time(record):
+    """
+    Return the inference time of the record as seconds since the epoch, or None.
+    """
+    value = (record.get("eventMetadata") or {}).get("inferenceTime")
+    if not value:
+        return None
+    for fmt in ["%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.%fZ"]:
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    return None
@@ -0,0 +1,205 @@
+import io
+import json
+import math
+
+import numpy as np
+
+# Objectives whose predictions are the raw margin, and those that apply the logistic function
+IDENTITY_OBJECTIVES = ("reg:linear", "reg:squarederror", "reg:pseudohubererror")
+LOGISTIC_OBJECTIVES = ("reg:logistic", "binary:logistic")
+
+# Rows are walked through the trees in blocks so the node index arrays stay in cache
+BLOCK_ROWS = 512
+
+
+def get_booster_params(booster):
+    """
+    Return the base score and objective of a booster, using the defaults of older versions of
+    XGBoost which can't save their config.
+    """
+    try:
+        config = json.loads(booster.save_config())
+    except AttributeError:
+        return 0.5, "reg:linear"
+    learner = config["learner"]
+    base_score = learner["learner_model_param"]["base_score"]
+    # Newer versions save the base score as a vector in a string, eg "[1.5E1]"
+    base_score = float(base_score.strip("[]").split(",")[0])
+    return base_score, learner["objective"]["name"]
+
+
+class FlatTrees(object):
+    """
+    Tree ensemble stored as contiguous arrays of nodes so that all rows can be walked through
+    all trees with vectorized NumPy operations.
+
+    Nodes of all trees are concatenated, with the root of each tree at roots[t].  For each node
+    feature is the split feature index, or -1 for a leaf, and rows go to left when the feature
+    value is less than threshold, to right otherwise, or to missing when the value is NaN.
+    Leaves hold their value in value.
+    """
+
+    def __init__(
+        self, feature, threshold, left, right, missing, value, roots, base_score, objective
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing = missing
+        self.value = value
+        self.roots = roots
+        self.base_score = base_score
+        self.objective = objective
+        self.depth = self._max_depth()
+        # Leaves loop back to themselves with an infinite threshold, so every row can take the
+        # same number of steps without masking, and children are paired for a single gather
+        self._split_feature = np.maximum(feature, 0).astype(np.intp)
+        self._split_threshold = np.where(feature >= 0, threshold, np.inf).astype(np.float32)
+        self._children = np.column_stack([left, right]).ravel().astype(np.intp)
+
+    @classmethod
+    def from_booster(cls, booster):
+        """
+        Convert an XGBoost booster using its json dump, which is available in all versions.
+        """
+        feature_names = booster.feature_names or []
+        trees = [json.loads(tree) for tree in booster.get_dump(dump_format="json")]
+        base_score, objective = get_booster_params(booster)
+        return cls.from_json_trees(trees, base_score, objective, feature_names)
+
+    @classmethod
+    def from_json_trees(cls, trees, base_score=0.5, objective="reg:linear", feature_names=()):
+        feature_index = dict((name, i) for i, name in enumerate(feature_names))
+        nodes = []
+        roots = []
+        for tree in trees:
+            # Number nodes in tree order from the offset of this tree
+            offset = len(nodes)
+            tree_nodes = {}
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                tree_nodes[node["nodeid"]] = node
+                stack.extend(node.get("children", []))
+            ids = sorted(tree_nodes)
+            position = dict((nodeid, offset + i) for i, nodeid in enumerate(ids))
+            roots.append(position[tree["nodeid"]])
+            nodes.extend(tree_nodes[nodeid] for nodeid in ids)
+            for nodeid in ids:
+                node = tree_nodes[nodeid]
+                node["_position"] = position
+
+        count = len(nodes)
+        feature = np.full(count, -1, dtype=np.int32)
+        threshold = np.zeros(count, dtype=np.float32)
+        left = np.arange(count, dtype=np.int32)
+        right = np.arange(count, dtype=np.int32)
+        missing = np.arange(count, dtype=np.int32)
+        value = np.zeros(count, dtype=np.float32)
+        for i, node in enumerate(nodes):
+            position = node.pop("_position")
+            if "leaf" in node:
+                value[i] = node["leaf"]
+                continue
+            split = node["split"]
+            if split in feature_index:
+                feature[i] = feature_index[split]
+            else:
+                feature[i] = int(split.lstrip("f"))
+            threshold[i] = node["split_condition"]
+            left[i] = position[node["yes"]]
+            right[i] = position[node["no"]]
+            missing[i] = position[node["missing"]]
+        roots = np.array(roots, dtype=np.int32)
+        return cls(feature, threshold, left, right, missing, value, roots, base_score, objective)
+
+    def _max_depth(self):
+        # Walk all trees breadth first from their roots to find the deepest leaf
+        depth = 0
+        frontier = self.roots
+        while len(frontier):
+            frontier = frontier[self.feature[frontier] >= 0]
+            if len(frontier):
+                depth += 1
+                frontier = np.concatenate([self.left[frontier], self.right[frontier]])
+        return depth
+
+    def leaf_indices(self, features):
+        """
+        Return the leaf node index reached by each row (axis 0) in each tree (axis 1).
+        """
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        n_rows, n_features = features.shape
+        values = features.ravel()
+        row_offsets = (np.arange(n_rows, dtype=np.intp) * n_features)[:, np.newaxis]
+        nodes = np.tile(self.roots.astype(np.intp), (n_rows, 1))
+        for _ in range(self.depth):
+            row_values = values[row_offsets + self._split_feature[nodes]]
+            # NaN compares false and goes right, and is then redirected to the missing branch
+            go_right = ~(row_values < self._split_threshold[nodes])
+            next_nodes = self._children[2 * nodes + go_right]
+            is_missing = np.isnan(row_values)
+            if is_missing.any():
+                next_nodes = np.where(is_missing, self.missing[nodes], next_nodes)
+            nodes = next_nodes
+        return nodes
+
+    def predict_margin(self, features):
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        if self.objective in LOGISTIC_OBJECTIVES:
+            base_margin = np.float32(-math.log(1.0 / self.base_score - 1.0))
+        else:
+            base_margin = np.float32(self.base_score)
+        margin = np.full(features.shape[0], base_margin, dtype=np.float32)
+        for start in range(0, features.shape[0], BLOCK_ROWS):
+            leaves = self.value[self.leaf_indices(features[start : start + BLOCK_ROWS])]
+            # Accumulate in float32 in tree order, as XGBoost does, for identical predictions
+            block = margin[start : start + BLOCK_ROWS]
+            for t in range(leaves.shape[1]):
+                block += leaves[:, t]
+        return margin
+
+    def predict(self, features):
+        margin = self.predict_margin(features)
+        if self.objective in LOGISTIC_OBJECTIVES:
+            return (1.0 / (1.0 + np.exp(-margin))).astype(np.float32)
+        if self.objective not in IDENTITY_OBJECTIVES:
+            raise ValueError("unsupported objective: {}".format(self.objective))
+        return margin
+
+    @property
+    def nbytes(self):
+        arrays = [self.feature, self.threshold, self.left, self.right, self.missing, self.value]
+        return sum(a.nbytes for a in arrays) + self.roots.nbytes
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            missing=self.missing,
+            value=self.value,
+            roots=self.roots,
+            params=np.array([json.dumps([self.base_score, self.objective])]),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data))
+        base_score, objective = json.loads(str(arrays["params"][0]))
+        return cls(
+            arrays["feature"],
+            arrays["threshold"],
+            arrays["left"],
+            arrays["right"],
+            arrays["missing"],
+            arrays["value"],
+            arrays["roots"],
+            base_score,
+            objective,
+        )
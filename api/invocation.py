@@ -0,0 +1,363 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailable",
+    "InternalFailure",
+    "ModelNotReadyException",
+}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after):
+        super(CircuitOpen, self).__init__(
+            "endpoint circuit is open, retry after {:.0f}s".format(retry_after)
+        )
+        self.retry_after = retry_after
+
+
+def get_deadline(context, margin_ms):
+    """
+    Return the monotonic deadline for a request, leaving a margin of the lambda remaining time
+    to build the response.  Returns None if there is no lambda context.
+    """
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    remaining_ms = context.get_remaining_time_in_millis() - margin_ms
+    return time.monotonic() + max(0, remaining_ms) / 1000.0
+
+
+def remaining(deadline, limit=None):
+    """
+    Return the seconds remaining before the deadline, capped at the limit if given.
+    """
+    if deadline is None:
+        return limit
+    seconds = max(0.0, deadline - time.monotonic())
+    return seconds if limit is None else min(seconds, limit)
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in RETRYABLE_ERROR_CODES or status == 429 or status >= 500
+    return isinstance(error, (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError))
+
+
+class LatencyTracker(object):
+    """
+    Rolling window of recent invocation latencies in seconds.
+    """
+
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q / 100.0 * len(samples)))]
+
+
+class RetryBudget(object):
+    """
+    Token bucket limiting retries to a fraction of requests across all requests in the
+    container, so that retries add a bounded load to an endpoint that is already throttling.
+
+    Each request deposits ratio tokens and each retry withdraws one, with a minimum refill per
+    second so occasional retries are still allowed at low traffic.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, capacity=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens):
+        now = time.monotonic()
+        tokens += (now - self._refilled) * self.min_per_second
+        self._tokens = min(self.capacity, self._tokens + tokens)
+        self._refilled = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill(0.0)
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling the endpoint once the failure rate of the most recent calls exceeds the
+    threshold, shedding requests until the open period has passed.  A single probe call is
+    then let through, closing the circuit if it succeeds or opening it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_rate=0.5, min_calls=20, window=50, open_seconds=5.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.counters = {}
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        logger.warning("endpoint circuit %s -> %s", self.state, state)
+        self.state = state
+        name = {self.CLOSED: "BreakerClosed", self.OPEN: "BreakerOpened"}.get(
+            state, "BreakerHalfOpened"
+        )
+        self.counters[name] = self.counters.get(name, 0) + 1
+        if state == self.OPEN:
+            self._opened = time.monotonic()
+        self._outcomes.clear()
+        self._failures = 0
+        self._probing = False
+
+    def stats(self):
+        # State transitions are counted under the breaker's own lock
+        with self._lock:
+            return dict(self.counters)
+
+    def retry_after(self):
+        """
+        Return the seconds until the circuit lets a call through, or 0 if it is closed.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            if self.state == self.OPEN:
+                return max(0.0, self._opened + self.open_seconds - time.monotonic())
+            return self.open_seconds if self._probing else 0.0
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened < self.open_seconds:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED if success else self.OPEN)
+                return
+            if self.state == self.OPEN:
+                return
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._failures -= not self._outcomes[0]
+            self._outcomes.append(success)
+            if not success:
+                self._failures += 1
+                calls = len(self._outcomes)
+                if calls >= self.min_calls and self._failures >= self.failure_rate * calls:
+                    self._transition(self.OPEN)
+
+
+class Invoker(object):
+    """
+    Invokes an endpoint call with retries that stop at the request deadline, and optionally
+    hedges slow calls by sending one duplicate once the call has taken longer than the given
+    percentile of recent latencies, returning whichever response arrives first.
+
+    Retries are limited by the retry budget shared by all requests, and calls are shed with
+    CircuitOpen while the circuit breaker is open.  Calls to a named target have a breaker of
+    their own with the same settings, so a failing target doesn't shed calls to the others.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_attempts=3,
+        backoff_seconds=0.05,
+        hedge_percentile=None,
+        hedge_min_delay_seconds=0.005,
+        retry_budget=None,
+        breaker=None,
+    ):
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_seconds = hedge_min_delay_seconds
+        self.latency = LatencyTracker()
+        self.counters = {
+            "Retries": 0,
+            "HedgesFired": 0,
+            "HedgesWon": 0,
+            "DeadlinesExceeded": 0,
+            "RetryBudgetExhausted": 0,
+            "Shed": 0,
+        }
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker_for(self, name=None):
+        """
+        Return the circuit breaker of the named target, or the default breaker without a name.
+        """
+        if name is None:
+            return self.breaker
+        with self._lock:
+            if name not in self.breakers:
+                breaker = CircuitBreaker(
+                    failure_rate=self.breaker.failure_rate,
+                    min_calls=self.breaker.min_calls,
+                    window=self.breaker.window,
+                    open_seconds=self.breaker.open_seconds,
+                )
+                self.breakers[name] = breaker
+            return self.breakers[name]
+
+    def breaker_state(self):
+        """
+        Return the state of the most open of the breakers.
+        """
+        with self._lock:
+            states = [b.state for b in [self.breaker] + list(self.breakers.values())]
+        for state in [CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN]:
+            if state in states:
+                return state
+        return CircuitBreaker.CLOSED
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """
+        Return the invocation counters with the state transitions of all the breakers.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            breakers = [self.breaker] + list(self.breakers.values())
+        for breaker in breakers:
+            for name, value in breaker.stats().items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def hedge_delay(self):
+        if self.hedge_percentile is None:
+            return None
+        delay = self.latency.percentile(self.hedge_percentile)
+        if delay is None:
+            return None
+        return max(delay, self.hedge_min_delay_seconds)
+
+    def shed(self, breaker):
+        # Raise without waiting for a call while the circuit is open
+        if not breaker.allow():
+            self.count("Shed")
+            raise CircuitOpen(breaker.retry_after() or breaker.open_seconds)
+
+    def invoke(self, call, deadline=None, name=None):
+        breaker = self.breaker_for(name)
+        self.shed(breaker)
+        self.retry_budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                result = self._invoke_once(call, deadline)
+                breaker.record(True)
+                return result
+            except DeadlineExceeded:
+                breaker.record(False)
+                self.count("DeadlinesExceeded")
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                # Errors of the request itself, eg validation, don't count against the endpoint
+                breaker.record(not retryable)
+                if attempt >= self.max_attempts or not retryable:
+                    raise
+                if not self.retry_budget.withdraw():
+                    self.count("RetryBudgetExhausted")
+                    raise
+                # Full jitter backoff, giving up rather than sleeping past the deadline
+                delay = random.uniform(0, self.backoff_seconds * 2**attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning("retrying attempt %d after %.3fs: %s", attempt, delay, e)
+                self.count("Retries")
+                time.sleep(delay)
+                self.shed(breaker)
+                attempt += 1
+
+    def _invoke_once(self, call, deadline):
+        start = time.monotonic()
+        primary = self.executor.submit(call)
+        futures = [primary]
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(futures, timeout=remaining(deadline, hedge_delay))
+            if not done and (deadline is None or remaining(deadline) > 0):
+                self.count("HedgesFired")
+                futures.append(self.executor.submit(call))
+        future = self._first_success(futures, deadline)
+        if future is not primary:
+            self.count("HedgesWon")
+        self.latency.record(time.monotonic() - start)
+        return future.result()
+
+    def _first_success(self, futures, deadline):
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("endpoint did not respond before the request deadline")
+            for future in done:
+                if future.exception() is None:
+                    return future
+                error = future.exception()
+        raise error
@@ -0,0 +1,152 @@
+import io
+import logging
+import pickle
+import tarfile
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# File name the built-in XGBoost algorithm saves the booster as inside model.tar.gz
+MODEL_FILE_NAME = "xgboost-model"
+
+# Flat trees built from the booster by the training workflow, which load with numpy only
+FLAT_TREES_FILE_NAME = "flat-trees.npz"
+
+
+class ModelVersionMismatch(Exception):
+    pass
+
+
+class UnsupportedObjective(Exception):
+    pass
+
+
+def load_booster(data):
+    """
+    Load an XGBoost booster from the saved model bytes.  Older versions of the built-in
+    algorithm pickle the booster, while newer versions use the XGBoost binary format.
+    """
+    import xgboost
+
+    try:
+        booster = xgboost.Booster()
+        booster.load_model(bytearray(data))
+        return booster
+    except xgboost.core.XGBoostError:
+        return pickle.loads(data)
+
+
+def parse_csv_rows(rows):
+    return [
+        [float(value) if value.strip() else float("nan") for value in row.split(",")]
+        for row in rows
+    ]
+
+
+class LocalModel(object):
+    """
+    Scores csv rows in process with the XGBoost model artifact of the training job, saving the
+    hop to the SageMaker endpoint for small models.
+
+    The model is downloaded once as flat arrays of tree nodes and kept in the warm container.
+    Flat trees built offline are loaded with numpy alone, while a model.tar.gz is converted at
+    load and needs xgboost.  Only models with a squared-error objective are scored locally, as
+    their predictions are the float32 margin and match the endpoint exactly, while the logistic
+    function differs from the endpoint's in the last bits.  Flat trees are only faster than the
+    endpoint's booster for small batches, so requests over the maximum rows aren't scored
+    locally.  It is only used while the endpoint serves the same model version, and the artifact
+    ETag is re-checked periodically so a replaced artifact is reloaded.  Callers fall back to the
+    endpoint on any error, and a failed load isn't retried until the next check so each request
+    doesn't pay for it.
+    """
+
+    def __init__(self, s3_client, model_data_url, model_version, refresh_seconds=300, max_rows=100):
+        self.s3 = s3_client
+        self.model_data_url = model_data_url
+        self.model_version = model_version
+        self.refresh_seconds = refresh_seconds
+        self.max_rows = max_rows
+        self.trees = None
+        self.etag = None
+        self.counters = {"LocalPredictions": 0, "LocalFallbacks": 0}
+        self._checked = 0
+        self._load_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.model_data_url)
+
+    def accepts(self, row_count):
+        return self.enabled and row_count <= self.max_rows
+
+    def check_version(self, endpoint_name):
+        # Endpoint and model artifact names are both suffixed with "-" and the training job id,
+        # which is matched whole so that a job id ending in the version doesn't match
+        if not self.model_version or not endpoint_name.endswith("-" + self.model_version):
+            raise ModelVersionMismatch(
+                "endpoint {} is not serving model version {}".format(
+                    endpoint_name, self.model_version
+                )
+            )
+
+    def _head_etag(self, bucket, key):
+        return self.s3.head_object(Bucket=bucket, Key=key)["ETag"]
+
+    def load(self):
+        """
+        Load the model if it is not loaded, or if the artifact has changed since the last check.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked < self.refresh_seconds:
+                if self._load_error is not None:
+                    raise self._load_error
+                if self.trees is not None:
+                    return self.trees
+            try:
+                trees = self._load()
+            except Exception as e:
+                logger.error("unable to load model from %s: %s", self.model_data_url, e)
+                self._load_error = e
+                self._checked = now
+                raise
+            self._load_error = None
+            self._checked = now
+            return trees
+
+    def _load(self):
+        import flat_trees
+
+        url = urlparse(self.model_data_url)
+        bucket, key = url.netloc, url.path.lstrip("/")
+        if self.trees is not None and self._head_etag(bucket, key) == self.etag:
+            return self.trees
+
+        logger.info("loading model from %s", self.model_data_url)
+        s3_object = self.s3.get_object(Bucket=bucket, Key=key)
+        data = s3_object["Body"].read()
+        if key.endswith(".npz"):
+            trees = flat_trees.FlatTrees.from_bytes(data)
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+                data = tar.extractfile(MODEL_FILE_NAME).read()
+            trees = flat_trees.FlatTrees.from_booster(load_booster(data))
+        if trees.objective not in flat_trees.IDENTITY_OBJECTIVES:
+            raise UnsupportedObjective("objective {} is not scored locally".format(trees.objective))
+        self.trees = trees
+        self.etag = s3_object["ETag"]
+        return self.trees
+
+    def predict(self, rows, endpoint_name, separator=","):
+        """
+        Return predictions for the csv rows in a single vectorized batch, joined with the
+        separator the endpoint returns them with.
+        """
+        self.check_version(endpoint_name)
+        trees = self.load()
+        predictions = trees.predict(parse_csv_rows(rows))
+        self.counters["LocalPredictions"] += len(rows)
+        return separator.join(str(float(p)) for p in predictions)
@@ -0,0 +1,138 @@
+import json
+import random
+import sys
+import threading
+import time
+
+
+class StageTimer(object):
+    """
+    Accumulates the time spent in each stage of a request.
+
+    Stages are either marked in sequence, taking the time since the previous mark, or added
+    explicitly for work done elsewhere such as endpoint calls in the thread pool.  Time in
+    stages that run concurrently, eg chunks of a batch, is summed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = self._last = time.perf_counter()
+        self.stages = {}
+        self.dimensions = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.add(stage, now - self._last)
+        self._last = now
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class MetricsLogger(object):
+    """
+    Writes metrics as CloudWatch embedded metric format log lines, which CloudWatch Logs
+    extracts into metrics without calls to the CloudWatch api.
+
+    Stage timings of a sample of requests are also buffered in the warm container and flushed
+    as arrays of values with one second resolution, from which CloudWatch computes the
+    distribution and percentiles.  A metric has a single storage resolution, so the samples are
+    written under their own metric names, eg TotalHighRes, rather than counted twice in the
+    metrics of every request.
+    """
+
+    # Embedded metric format allows up to 100 values per metric
+    MAX_VALUES = 100
+    HIGH_RESOLUTION_SUFFIX = "HighRes"
+
+    def __init__(self, namespace, sample_rate=0.0, flush_seconds=60, stream=None):
+        self.namespace = namespace
+        self.sample_rate = sample_rate
+        self.flush_seconds = flush_seconds
+        self.stream = stream or sys.stdout
+        self._samples = {}
+        self._counters = {}
+        self._flushed = time.monotonic()
+
+    def _write(self, dimensions, values, unit, storage_resolution=60, properties=None):
+        definitions = []
+        for name in values:
+            definition = {"Name": name, "Unit": unit}
+            if storage_resolution == 1:
+                definition["StorageResolution"] = 1
+            definitions.append(definition)
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": definitions,
+                    }
+                ],
+            }
+        }
+        record.update(properties or {})
+        record.update(dimensions)
+        record.update(values)
+        self.stream.write(json.dumps(record) + "\n")
+
+    def emit(self, dimensions, values, unit="Count", properties=None):
+        """
+        Write a single metric record, eg of counters.
+        """
+        if self.namespace and values:
+            self._write(dimensions, values, unit, properties=properties)
+
+    def emit_deltas(self, dimensions, counters, properties=None):
+        """
+        Write the increase of cumulative counters since they were last written.
+        """
+        values = {}
+        for name, value in list(counters.items()):
+            delta = value - self._counters.get(name, 0)
+            self._counters[name] = value
+            if delta:
+                values[name] = delta
+        self.emit(dimensions, values, properties=properties)
+
+    def record(self, timer, properties=None):
+        """
+        Write the stage timings of a request in milliseconds, and sample them for the
+        high resolution distribution.
+        """
+        if not self.namespace:
+            return
+        values = dict((stage, seconds * 1000.0) for stage, seconds in timer.stages.items())
+        values["Total"] = timer.elapsed() * 1000.0
+        self._write(timer.dimensions, values, "Milliseconds", properties=properties)
+        if self.sample_rate and random.random() < self.sample_rate:
+            key = tuple(sorted(timer.dimensions.items()))
+            samples = self._samples.setdefault(key, {})
+            for stage, value in values.items():
+                samples.setdefault(stage, []).append(value)
+            if len(samples["Total"]) >= self.MAX_VALUES:
+                self._write_samples(key, self._samples.pop(key))
+        if time.monotonic() - self._flushed >= self.flush_seconds:
+            self.flush()
+
+    def _write_samples(self, key, samples):
+        values = dict(
+            (stage + self.HIGH_RESOLUTION_SUFFIX, stage_samples)
+            for stage, stage_samples in samples.items()
+        )
+        self._write(dict(key), values, "Milliseconds", 1)
+
+    def flush(self):
+        for key, samples in self._samples.items():
+            self._write_samples(key, samples)
+        self._samples = {}
+        self._flushed = time.monotonic()
@@ -1,25 +1,305 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+import canary_analysis
+import data_capture
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Only the hourly capture partitions since the deployment started are scanned, concurrently
+CAPTURE_SCAN_CONCURRENCY = int(os.environ.get("CAPTURE_SCAN_CONCURRENCY", "8"))
+CAPTURE_WINDOW_HOURS = int(os.environ.get("CAPTURE_WINDOW_HOURS", "1"))
+
+# Capture files are stream parsed, up to the maximum number of objects, and the rate of records
+# captured to endpoint invocations and the fraction of valid records must be over the minimums
+CAPTURE_MAX_OBJECTS = int(os.environ.get("CAPTURE_MAX_OBJECTS", "1000"))
+CAPTURE_MIN_RATE = float(os.environ.get("CAPTURE_MIN_RATE", "0.8"))
+CAPTURE_MIN_VALID_RATE = float(os.environ.get("CAPTURE_MIN_VALID_RATE", "0.99"))
+
+# Capture is buffered before it is written to s3, so the rate is only compared over the window
+# that ends this many seconds before the check, and only when that window is long enough
+CAPTURE_BUFFER_SECONDS = int(os.environ.get("CAPTURE_BUFFER_SECONDS", "300"))
+CAPTURE_MIN_RATE_SECONDS = int(os.environ.get("CAPTURE_MIN_RATE_SECONDS", "60"))
+
+# Api latency and errors of requests to the new endpoint are compared with those to the previous
+# endpoint during the deployment, from the metric log records of the api function
+API_LOG_GROUP = os.environ.get("API_LOG_GROUP", "")
+CANARY_ALPHA = float(os.environ.get("CANARY_ALPHA", "0.01"))
+CANARY_MIN_LATENCY_RATIO = float(os.environ.get("CANARY_MIN_LATENCY_RATIO", "1.1"))
+CANARY_MIN_SAMPLES = int(os.environ.get("CANARY_MIN_SAMPLES", "20"))
+CANARY_MAX_SAMPLES = int(os.environ.get("CANARY_MAX_SAMPLES", "50000"))
+
 sm = boto3.client("sagemaker")
-s3 = boto3.client("s3")
+s3 = boto3.client("s3", config=Config(max_pool_connections=CAPTURE_SCAN_CONCURRENCY))
 cd = boto3.client("codedeploy")
+cw = boto3.client("cloudwatch")
+logs = boto3.client("logs")
+executor = ThreadPoolExecutor(max_workers=CAPTURE_SCAN_CONCURRENCY)
+
+
+def get_deployment_start(deployment_id):
+    """
+    Return when the deployment was created, or the capture window before now without one.
+    """
+    now = datetime.now(timezone.utc)
+    if deployment_id:
+        response = cd.get_deployment(deploymentId=deployment_id)
+        created = response["deploymentInfo"].get("createTime")
+        if created is not None:
+            return created.astimezone(timezone.utc)
+    return now - timedelta(hours=CAPTURE_WINDOW_HOURS)
+
+
+def scan_capture(data_capture_uri, endpoint_name, start, end):
+    """
+    Return the summary of the capture objects written for the endpoint between the start and
+    end, for each hourly partition of each variant, and the objects themselves.
+    """
+    bucket, prefix = data_capture.parse_s3_uri(data_capture_uri)
+    prefixes = [
+        hour_prefix
+        for variant_prefix in data_capture.list_variants(s3, bucket, prefix, endpoint_name)
+        for hour_prefix in data_capture.hour_prefixes(variant_prefix, start, end)
+    ]
+    partitions = data_capture.scan_partitions(s3, bucket, prefixes, executor)
+    summary, objects = {}, []
+    for partition, partition_objects in sorted(partitions.items()):
+        # The first partition can hold records from before the deployment started
+        partition_objects = [obj for obj in partition_objects if obj["LastModified"] >= start]
+        summary[partition] = data_capture.summarize(partition_objects)
+        objects.extend(partition_objects)
+    return summary, objects
+
+
+def profile_object(bucket, key, start=None, cutoff=None):
+    """
+    Stream the records of a capture object, returning the counts of records, invalid records
+    and records inferred between the start and cutoff, the first and last inference times and
+    the largest gap between consecutive records.
+    """
+    profile = {
+        "Records": 0,
+        "Invalid": 0,
+        "Settled": 0,
+        "First": None,
+        "Last": None,
+        "MaxGapSeconds": 0.0,
+    }
+    for line in data_capture.iter_lines(s3, bucket, key):
+        profile["Records"] += 1
+        try:
+            record = json.loads(line)
+            error = data_capture.validate_record(record)
+        except ValueError as e:
+            record, error = {}, "not json: {}".format(e)
+        if error:
+            profile["Invalid"] += 1
+            if profile["Invalid"] == 1:
+                logger.warning("invalid capture record in %s: %s", key, error)
+        timestamp = data_capture.parse_inference_time(record)
+        if timestamp is None:
+            continue
+        if start is not None and cutoff is not None and start <= timestamp <= cutoff:
+            profile["Settled"] += 1
+        if profile["Last"] is not None:
+            profile["MaxGapSeconds"] = max(profile["MaxGapSeconds"], timestamp - profile["Last"])
+        if profile["First"] is None:
+            profile["First"] = timestamp
+        profile["Last"] = timestamp
+    return profile
+
+
+def merge_profiles(profiles):
+    """
+    Combine the profiles of capture objects, including the gaps between objects.
+    """
+    merged = {
+        "Records": 0,
+        "Invalid": 0,
+        "Settled": 0,
+        "MaxGapSeconds": 0.0,
+        "MeanGapSeconds": None,
+    }
+    first = last = None
+    timed = sorted((p for p in profiles if p["First"] is not None), key=lambda p: p["First"])
+    for profile in profiles:
+        merged["Records"] += profile["Records"]
+        merged["Invalid"] += profile["Invalid"]
+        merged["Settled"] += profile.get("Settled", 0)
+    timed_records = 0
+    for profile in timed:
+        if last is not None:
+            merged["MaxGapSeconds"] = max(merged["MaxGapSeconds"], profile["First"] - last)
+        merged["MaxGapSeconds"] = max(merged["MaxGapSeconds"], profile["MaxGapSeconds"])
+        first = profile["First"] if first is None else first
+        last = profile["Last"] if last is None else max(last, profile["Last"])
+        timed_records += profile["Records"]
+    if timed_records > 1:
+        merged["MeanGapSeconds"] = (last - first) / (timed_records - 1)
+    return merged
 
 
-def get_bucket_prefix(url):
+def get_invocations(endpoint_name, variant_names, start, end):
+    """
+    Return the sum of the endpoint invocations of the variants between the start and end.
+    """
+    invocations = 0
+    for variant_name in variant_names:
+        response = cw.get_metric_statistics(
+            Namespace="AWS/SageMaker",
+            MetricName="Invocations",
+            Dimensions=[
+                {"Name": "EndpointName", "Value": endpoint_name},
+                {"Name": "VariantName", "Value": variant_name},
+            ],
+            StartTime=start,
+            EndTime=end,
+            Period=60,
+            Statistics=["Sum"],
+        )
+        invocations += sum(point["Sum"] for point in response["Datapoints"])
+    return int(invocations)
+
+
+def check_capture(data_capture_uri, endpoint_name, objects, start, end):
+    """
+    Stream parse the capture objects concurrently, and return an error message if the capture
+    rate or the fraction of valid records is under the minimum.
+    """
+    bucket, _ = data_capture.parse_s3_uri(data_capture_uri)
+    # The newest objects are parsed if there are more than the maximum
+    objects = sorted(objects, key=lambda obj: obj["LastModified"], reverse=True)
+    complete = len(objects) <= CAPTURE_MAX_OBJECTS
+    keys = [obj["Key"] for obj in objects[:CAPTURE_MAX_OBJECTS]]
+    # Records inferred in the last minutes may still be buffered, so neither count includes them
+    cutoff = end - timedelta(seconds=CAPTURE_BUFFER_SECONDS)
+    profile = merge_profiles(
+        list(
+            executor.map(
+                lambda key: profile_object(
+                    bucket, key, start.replace(microsecond=0).timestamp(), cutoff.timestamp()
+                ),
+                keys,
+            )
+        )
+    )
+
+    # Capture keys are prefix/endpoint/variant/yyyy/mm/dd/hh/file
+    variant_names = sorted(set(key.split("/")[-6] for key in keys))
+    rate_seconds = (cutoff - start).total_seconds()
+    profile["Invocations"] = (
+        get_invocations(endpoint_name, variant_names, start, cutoff)
+        if rate_seconds >= CAPTURE_MIN_RATE_SECONDS
+        else 0
+    )
+    logger.info("data capture profile %s", json.dumps(profile))
+
+    records = profile["Records"]
+    if not records:
+        return "No data capture records found since {}".format(start.isoformat())
+    valid_rate = 1.0 - profile["Invalid"] / records
+    if valid_rate < CAPTURE_MIN_VALID_RATE:
+        return "Data capture valid record rate {:.3f} under {}".format(
+            valid_rate, CAPTURE_MIN_VALID_RATE
+        )
+    if not complete:
+        logger.warning("parsed the newest %d capture objects, not checking rate", len(keys))
+    elif rate_seconds < CAPTURE_MIN_RATE_SECONDS:
+        logger.warning(
+            "only %.0fs before the %ds capture buffer, not checking rate",
+            rate_seconds,
+            CAPTURE_BUFFER_SECONDS,
+        )
+    elif profile["Invocations"]:
+        capture_rate = profile["Settled"] / profile["Invocations"]
+        if capture_rate < CAPTURE_MIN_RATE:
+            return "Data capture rate {:.3f} of {} invocations before {} under {}".format(
+                capture_rate, profile["Invocations"], cutoff.isoformat(), CAPTURE_MIN_RATE
+            )
+    return None
+
+
+def fetch_request_samples(log_group, start, end, max_samples):
+    """
+    Return the api latencies in milliseconds, error and request counts of each endpoint from
+    the embedded metric format records of the api function logs.
+    """
+    samples = {}
+    count = 0
+    paginator = logs.get_paginator("filter_log_events")
+    for page in paginator.paginate(
+        logGroupName=log_group,
+        startTime=int(start.timestamp() * 1000),
+        endTime=int(end.timestamp() * 1000),
+        filterPattern="{ $.Total = * }",
+    ):
+        for log_event in page["events"]:
+            try:
+                record = json.loads(log_event["message"])
+                endpoint_name, latency = record["EndpointName"], float(record["Total"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            sample = samples.setdefault(endpoint_name, {"Latencies": [], "Errors": 0})
+            sample["Latencies"].append(latency)
+            sample["Errors"] += int(record.get("StatusCode", 200)) >= 500
+            count += 1
+            if count >= max_samples:
+                return samples
+    return samples
+
+
+def check_canary(endpoint_name, start, end):
+    """
+    Return an error message if the latency or error rate of api requests to the new endpoint
+    is significantly worse than for requests to the previous endpoint, otherwise None.
+    """
+    if not API_LOG_GROUP:
+        logger.info("canary analysis disabled")
+        return None
     try:
-        from urllib.parse import urlparse
-    except ImportError:
-        from urlparse import urlparse
-    a = urlparse(url)
-    return a.netloc, a.path.lstrip("/") + "/"
+        samples = fetch_request_samples(API_LOG_GROUP, start, end, CANARY_MAX_SAMPLES)
+    except ClientError as e:
+        logger.warning("unable to fetch api samples: %s", e)
+        return None
+    canary = samples.pop(endpoint_name, {"Latencies": [], "Errors": 0})
+    # Traffic to any other endpoint is from the versions being replaced
+    baseline = {"Latencies": [], "Errors": 0}
+    for sample in samples.values():
+        baseline["Latencies"].extend(sample["Latencies"])
+        baseline["Errors"] += sample["Errors"]
+
+    latency = canary_analysis.compare_latencies(
+        canary["Latencies"],
+        baseline["Latencies"],
+        alpha=CANARY_ALPHA,
+        min_ratio=CANARY_MIN_LATENCY_RATIO,
+        min_samples=CANARY_MIN_SAMPLES,
+    )
+    errors = canary_analysis.compare_errors(
+        canary["Errors"],
+        len(canary["Latencies"]),
+        baseline["Errors"],
+        len(baseline["Latencies"]),
+        alpha=CANARY_ALPHA,
+    )
+    logger.info("canary analysis %s", json.dumps({"Latency": latency, "Errors": errors}))
+    if latency["Regressed"]:
+        return "Canary latency median {:.1f}ms regressed from {:.1f}ms (p={:.2g})".format(
+            latency["CanaryMedian"], latency["BaselineMedian"], latency["MannWhitneyP"]
+        )
+    if errors["Regressed"]:
+        return "Canary error rate {:.4f} regressed from {:.4f} (p={:.2g})".format(
+            errors["CanaryErrorRate"], errors["BaselineErrorRate"], errors["ErrorP"]
+        )
+    return None
 
 
 def lambda_handler(event, context):
@@ -32,17 +312,27 @@ def lambda_handler(event, context):
     error_message = None
     try:
         if data_capture_uri:
-            # List objects under data capture logs director
-            bucket, prefix = get_bucket_prefix(data_capture_uri)
-            contents = s3.list_objects(Bucket=bucket, Prefix=prefix).get("Contents")
-            if contents != None and contents:
-                logger.info("Found %d data capture logs", len(contents))
+            # List objects under the data capture partitions of this deployment
+            start = get_deployment_start(event.get("DeploymentId"))
+            end = datetime.now(timezone.utc)
+            summary, objects = scan_capture(data_capture_uri, endpoint_name, start, end)
+            logger.info("data capture partitions %s", json.dumps(summary))
+            if objects:
+                logger.info("Found %d data capture logs since %s", len(objects), start)
+                error_message = check_capture(data_capture_uri, endpoint_name, objects, start, end)
             else:
-                error_message = "No data capture logs found"
+                error_message = "No data capture logs found since {}".format(start.isoformat())
+            if error_message is None:
+                error_message = check_canary(endpoint_name, start, end)
+            if error_message:
                 logger.error(error_message)
     except ClientError as e:
         error_message = e.response["Error"]["Message"]
         logger.error("Error checking logs %s", error_message)
+    except Exception as e:
+        # Any other failure of the checks must still fail the hook rather than leave it to time out
+        logger.exception("Unexpected error checking endpoint %s", endpoint_name)
+        error_message = "Error checking endpoint {}: {!r}".format(endpoint_name, e)
 
     try:
         if error_message != None:
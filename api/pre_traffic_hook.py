@@ -1,15 +1,385 @@
 import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import batching
+import data_capture
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Synthetic load test replaying rows of the baseline dataset against the new endpoint, compared
+# with the endpoint of the live alias of the api function when there is one
+BASELINE_URI = os.environ.get("BASELINE_URI", "")
+API_FUNCTION_NAME = os.environ.get("API_FUNCTION_NAME", "")
+LOAD_TEST_SECONDS = float(os.environ.get("LOAD_TEST_SECONDS", "30"))
+LOAD_TEST_CONCURRENCY = int(os.environ.get("LOAD_TEST_CONCURRENCY", "4"))
+LOAD_TEST_SAMPLE_ROWS = int(os.environ.get("LOAD_TEST_SAMPLE_ROWS", "1000"))
+LOAD_TEST_ROWS_PER_REQUEST = int(os.environ.get("LOAD_TEST_ROWS_PER_REQUEST", "1"))
+LOAD_TEST_READ_TIMEOUT = int(os.environ.get("LOAD_TEST_READ_TIMEOUT", "5"))
+LOAD_TEST_MAX_ERROR_RATE = float(os.environ.get("LOAD_TEST_MAX_ERROR_RATE", "0.01"))
+
+# Latency and throughput may regress by these ratios of the live endpoint's, with some slack so
+# that noise in small latencies doesn't fail the deployment
+LOAD_TEST_MAX_P50_RATIO = float(os.environ.get("LOAD_TEST_MAX_P50_RATIO", "1.5"))
+LOAD_TEST_MAX_P99_RATIO = float(os.environ.get("LOAD_TEST_MAX_P99_RATIO", "1.5"))
+LOAD_TEST_LATENCY_SLACK_MS = float(os.environ.get("LOAD_TEST_LATENCY_SLACK_MS", "10"))
+LOAD_TEST_MIN_RPS_RATIO = float(os.environ.get("LOAD_TEST_MIN_RPS_RATIO", "0.7"))
+
+# Absolute thresholds used when there is no live endpoint to compare with, eg the first deployment
+LOAD_TEST_MAX_P99_MS = float(os.environ.get("LOAD_TEST_MAX_P99_MS", "1000"))
+LOAD_TEST_MIN_RPS = float(os.environ.get("LOAD_TEST_MIN_RPS", "0"))
+
+# Recent requests captured from the live endpoint are replayed in batches through both endpoints,
+# and the absolute differences of their predictions must be within the bounds
+DATA_CAPTURE_URI = os.environ.get("DATA_CAPTURE_URI", "")
+PARITY_SAMPLE_ROWS = int(os.environ.get("PARITY_SAMPLE_ROWS", "1000"))
+PARITY_BATCH_ROWS = int(os.environ.get("PARITY_BATCH_ROWS", "100"))
+PARITY_CONCURRENCY = int(os.environ.get("PARITY_CONCURRENCY", "4"))
+PARITY_LOOKBACK_HOURS = int(os.environ.get("PARITY_LOOKBACK_HOURS", "24"))
+# The capture files are read one at a time, so the walk is bounded to leave time for the checks
+PARITY_MAX_OBJECTS = int(os.environ.get("PARITY_MAX_OBJECTS", "100"))
+PARITY_LOAD_SECONDS = float(os.environ.get("PARITY_LOAD_SECONDS", "20"))
+PARITY_MAX_MEAN_DELTA = float(os.environ.get("PARITY_MAX_MEAN_DELTA", "1.0"))
+PARITY_MAX_P99_DELTA = float(os.environ.get("PARITY_MAX_P99_DELTA", "5.0"))
+PARITY_MAX_DELTA = float(os.environ.get("PARITY_MAX_DELTA", "25.0"))
+
 sm = boto3.client("sagemaker")
 cd = boto3.client("codedeploy")
+s3 = boto3.client("s3")
+lambda_client = boto3.client("lambda")
+# Both endpoints are load tested at once, and a stuck call mustn't outlast the hook
+sm_runtime = boto3.client(
+    "sagemaker-runtime",
+    config=Config(
+        max_pool_connections=max(2 * LOAD_TEST_CONCURRENCY, PARITY_CONCURRENCY),
+        connect_timeout=2,
+        read_timeout=LOAD_TEST_READ_TIMEOUT,
+        retries={"max_attempts": 0},
+    ),
+)
+
+
+def load_baseline_bodies(baseline_uri, sample_rows, rows_per_request):
+    """
+    Return csv request bodies from the first rows of the baseline dataset, which has a header
+    and the label in its first column.  Rows without features after the label are skipped.
+    """
+    url = urlparse(baseline_uri)
+    body = s3.get_object(Bucket=url.netloc, Key=url.path.lstrip("/"))["Body"]
+    rows = []
+    skipped = 0
+    try:
+        lines = body.iter_lines()
+        next(lines, None)
+        for line in lines:
+            if len(rows) >= sample_rows:
+                break
+            row = line.decode("utf-8", errors="replace").strip()
+            if not row:
+                continue
+            _, separator, features = row.partition(",")
+            if separator and features:
+                rows.append(features)
+            else:
+                skipped += 1
+    finally:
+        body.close()
+    if skipped:
+        logger.warning("skipped %d malformed baseline rows in %s", skipped, baseline_uri)
+    return [
+        "\n".join(rows[i : i + rows_per_request]) for i in range(0, len(rows), rows_per_request)
+    ]
+
+
+def get_live_endpoint_name(function_name):
+    """
+    Return the endpoint of the api function version currently serving on the live alias, or
+    None if there isn't one.
+    """
+    if not function_name:
+        return None
+    try:
+        response = lambda_client.get_function_configuration(
+            FunctionName=function_name, Qualifier="live"
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            return None
+        raise
+    return response.get("Environment", {}).get("Variables", {}).get("ENDPOINT_NAME")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def invoke(endpoint_name, body):
+    response = sm_runtime.invoke_endpoint(
+        EndpointName=endpoint_name, Body=body, ContentType="text/csv"
+    )
+    return response["Body"].read()
+
+
+def load_captured_rows(
+    capture_uri, endpoint_name, sample_rows, lookback_hours, max_objects=None, deadline=None
+):
+    """
+    Return up to the sample rows of the most recent csv requests captured from the endpoint.
+    Records that can't be decoded, eg the last line of a truncated file, are skipped.  Fewer rows
+    are returned once the maximum objects have been read or the monotonic deadline has passed.
+    """
+    bucket, prefix = data_capture.parse_s3_uri(capture_uri)
+    end = datetime.utcnow()
+    start = end - timedelta(hours=lookback_hours)
+    rows = []
+    skipped = 0
+    objects = 0
+    try:
+        for variant_prefix in data_capture.list_variants(s3, bucket, prefix, endpoint_name):
+            for hour_prefix in data_capture.hour_prefixes(variant_prefix, start, end):
+                # Capture files are named by the time they were written
+                for key in sorted(data_capture.list_keys(s3, bucket, hour_prefix), reverse=True):
+                    if (max_objects is not None and objects >= max_objects) or (
+                        deadline is not None and time.monotonic() >= deadline
+                    ):
+                        logger.warning(
+                            "stopped reading captures after %d objects with %d rows",
+                            objects,
+                            len(rows),
+                        )
+                        return rows
+                    objects += 1
+                    for line in data_capture.iter_lines(s3, bucket, key):
+                        try:
+                            record = json.loads(line)
+                            content_type, data = data_capture.decode_capture(
+                                record["captureData"]["endpointInput"]
+                            )
+                        except (ValueError, KeyError, TypeError) as e:
+                            logger.debug("skipping capture record in %s: %r", key, e)
+                            skipped += 1
+                            continue
+                        if content_type.startswith("text/csv"):
+                            rows.extend(batching.split_rows(data))
+                        if len(rows) >= sample_rows:
+                            return rows[:sample_rows]
+    finally:
+        if skipped:
+            logger.warning("skipped %d capture records that could not be decoded", skipped)
+    return rows
+
+
+def replay(endpoint_names, rows, batch_rows, concurrency):
+    """
+    Invoke each endpoint with the rows in batches, all concurrently, and return the list of
+    predictions of each endpoint.
+    """
+    batches = ["\n".join(batch) for _, batch in batching.chunk_rows(rows, batch_rows)]
+    jobs = [(name, body) for body in batches for name in endpoint_names]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        bodies = list(pool.map(lambda job: invoke(*job).decode("utf-8"), jobs))
+    predictions = dict((name, []) for name in endpoint_names)
+    for (name, _), body in zip(jobs, bodies):
+        predictions[name].extend(float(p) for p in batching.split_predictions(body))
+    return [predictions[name] for name in endpoint_names]
+
+
+def prediction_delta_stats(live_predictions, predictions):
+    """
+    Return the mean, max and quantiles of the absolute differences between the predictions.
+    """
+    deltas = sorted(abs(p - q) for p, q in zip(live_predictions, predictions))
+    return {
+        "Rows": len(deltas),
+        "MeanAbsDelta": sum(deltas) / len(deltas) if deltas else 0.0,
+        "MaxAbsDelta": deltas[-1] if deltas else 0.0,
+        "P50AbsDelta": percentile(deltas, 50),
+        "P90AbsDelta": percentile(deltas, 90),
+        "P99AbsDelta": percentile(deltas, 99),
+    }
+
+
+def check_parity(endpoint_name, live_endpoint_name, context=None):
+    """
+    Replay recent captured requests of the live endpoint through it and the new endpoint, and
+    return an error message if their predictions differ past the bounds.
+    """
+    if not live_endpoint_name or not DATA_CAPTURE_URI or PARITY_SAMPLE_ROWS <= 0:
+        logger.info("prediction parity check disabled")
+        return None
+    # Leave the time of the load test, and for its calls in flight to time out, after the replay
+    seconds = PARITY_LOAD_SECONDS
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000.0
+        seconds = min(seconds, remaining - LOAD_TEST_SECONDS - 2 * LOAD_TEST_READ_TIMEOUT - 15)
+    rows = load_captured_rows(
+        DATA_CAPTURE_URI,
+        live_endpoint_name,
+        PARITY_SAMPLE_ROWS,
+        PARITY_LOOKBACK_HOURS,
+        max_objects=PARITY_MAX_OBJECTS,
+        deadline=time.monotonic() + seconds,
+    )
+    if not rows:
+        logger.warning("no captured requests of %s to replay", live_endpoint_name)
+        return None
+    try:
+        live_predictions, predictions = replay(
+            [live_endpoint_name, endpoint_name], rows, PARITY_BATCH_ROWS, PARITY_CONCURRENCY
+        )
+    except (BotoCoreError, ClientError, ValueError) as e:
+        return "Prediction parity replay failed: {}".format(e)
+    if len(predictions) != len(live_predictions) or len(predictions) != len(rows):
+        return "Prediction parity replay of {} rows returned {} and {} live predictions".format(
+            len(rows), len(predictions), len(live_predictions)
+        )
+    stats = prediction_delta_stats(live_predictions, predictions)
+    logger.info("prediction parity against %s %s", live_endpoint_name, json.dumps(stats))
+    for name, bound in [
+        ("MeanAbsDelta", PARITY_MAX_MEAN_DELTA),
+        ("P99AbsDelta", PARITY_MAX_P99_DELTA),
+        ("MaxAbsDelta", PARITY_MAX_DELTA),
+    ]:
+        if stats[name] > bound:
+            return "Prediction parity {} {:.4f} over {} against live endpoint {}".format(
+                name, stats[name], bound, live_endpoint_name
+            )
+    return None
+
+
+def run_load_test(endpoint_name, bodies, concurrency, seconds):
+    """
+    Invoke the endpoint from concurrent workers cycling through the request bodies for the
+    given seconds, and return the latency percentiles in milliseconds and requests per second.
+    Each worker sends an untimed request first to open its connection.
+    """
+    ready, stop = threading.Event(), threading.Event()
+
+    def worker(offset):
+        latencies, errors = [], 0
+        try:
+            invoke(endpoint_name, bodies[offset % len(bodies)])
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("warm up of %s failed: %s", endpoint_name, e)
+        ready.wait()
+        i = offset
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                invoke(endpoint_name, bodies[i % len(bodies)])
+                latencies.append(time.perf_counter() - start)
+            except (BotoCoreError, ClientError) as e:
+                logger.debug("load test request to %s failed: %s", endpoint_name, e)
+                errors += 1
+            i += concurrency
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker, offset) for offset in range(concurrency)]
+        # Give the workers a moment to warm up before the timed run starts
+        time.sleep(min(1.0, seconds / 10.0))
+        ready.set()
+        start = time.perf_counter()
+        time.sleep(seconds)
+        stop.set()
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000.0 for samples, _ in results for latency in samples)
+    errors = sum(errors for _, errors in results)
+    requests = len(latencies) + errors
+    return {
+        "EndpointName": endpoint_name,
+        "Requests": requests,
+        "ErrorRate": errors / requests if requests else 1.0,
+        "P50Ms": percentile(latencies, 50),
+        "P99Ms": percentile(latencies, 99),
+        "RequestsPerSecond": len(latencies) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def check_load_test(result, live_result=None):
+    """
+    Return an error message if the new endpoint's results regress past the thresholds, compared
+    with the live endpoint's results if given, otherwise None.
+    """
+    if result["ErrorRate"] > LOAD_TEST_MAX_ERROR_RATE:
+        return "Load test error rate {:.3f} over {}".format(
+            result["ErrorRate"], LOAD_TEST_MAX_ERROR_RATE
+        )
+    if live_result is None:
+        if result["P99Ms"] > LOAD_TEST_MAX_P99_MS:
+            return "Load test p99 {:.1f}ms over {}ms".format(result["P99Ms"], LOAD_TEST_MAX_P99_MS)
+        if result["RequestsPerSecond"] < LOAD_TEST_MIN_RPS:
+            return "Load test {:.1f} requests/sec under {}".format(
+                result["RequestsPerSecond"], LOAD_TEST_MIN_RPS
+            )
+        return None
+    for name, ratio in [("P50Ms", LOAD_TEST_MAX_P50_RATIO), ("P99Ms", LOAD_TEST_MAX_P99_RATIO)]:
+        limit = live_result[name] * ratio + LOAD_TEST_LATENCY_SLACK_MS
+        if result[name] > limit:
+            return "Load test {} {:.1f} over {:.1f} of live endpoint {}".format(
+                name, result[name], limit, live_result["EndpointName"]
+            )
+    limit = live_result["RequestsPerSecond"] * LOAD_TEST_MIN_RPS_RATIO
+    if result["RequestsPerSecond"] < limit:
+        return "Load test {:.1f} requests/sec under {:.1f} of live endpoint {}".format(
+            result["RequestsPerSecond"], limit, live_result["EndpointName"]
+        )
+    return None
+
+
+def load_test(endpoint_name, live_endpoint_name, context):
+    """
+    Load test the new endpoint, and the live endpoint alongside it if there is one, within the
+    remaining time of the hook.  Returns an error message if the new endpoint regressed.
+    """
+    if not BASELINE_URI or LOAD_TEST_SECONDS <= 0:
+        logger.info("load test disabled")
+        return None
+    # Leave time for calls in flight to time out and to report the lifecycle status
+    seconds = LOAD_TEST_SECONDS
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() / 1000.0
+        seconds = min(seconds, remaining - 2 * LOAD_TEST_READ_TIMEOUT - 5)
+    if seconds < 1:
+        logger.warning("not enough time remaining to load test")
+        return None
+
+    bodies = load_baseline_bodies(BASELINE_URI, LOAD_TEST_SAMPLE_ROWS, LOAD_TEST_ROWS_PER_REQUEST)
+    if not bodies:
+        return "No baseline rows to load test with in {}".format(BASELINE_URI)
+    logger.info("load testing %s against %s for %.0fs", endpoint_name, live_endpoint_name, seconds)
+
+    # Both endpoints are tested over the same period so they see the same conditions
+    endpoint_names = [endpoint_name] + ([live_endpoint_name] if live_endpoint_name else [])
+    with ThreadPoolExecutor(max_workers=len(endpoint_names)) as pool:
+        results = list(
+            pool.map(
+                lambda name: run_load_test(name, bodies, LOAD_TEST_CONCURRENCY, seconds),
+                endpoint_names,
+            )
+        )
+    logger.info("load test results %s", json.dumps(results))
+
+    live_result = results[1] if len(results) > 1 else None
+    if live_result is not None and live_result["ErrorRate"] > LOAD_TEST_MAX_ERROR_RATE:
+        logger.warning("live endpoint errors, using absolute load test thresholds")
+        live_result = None
+    return check_load_test(results[0], live_result)
 
 
 def lambda_handler(event, context):
@@ -34,10 +404,20 @@ def lambda_handler(event, context):
                 logger.info("data capture enabled for endpoint config %s", endpoint_config_name)
             else:
                 error_message = "SageMaker data capture not enabled for endpoint config"
-            # TODO: Invoke endpoint if don't have canary / live traffic
+        if error_message is None:
+            live_endpoint_name = get_live_endpoint_name(API_FUNCTION_NAME)
+            if live_endpoint_name == endpoint_name:
+                live_endpoint_name = None
+            error_message = check_parity(endpoint_name, live_endpoint_name, context) or load_test(
+                endpoint_name, live_endpoint_name, context
+            )
     except ClientError as e:
         error_message = e.response["Error"]["Message"]
         logger.error("Error checking endpoint %s", error_message)
+    except Exception as e:
+        # Any other failure of the checks must still fail the hook rather than leave it to time out
+        logger.exception("Unexpected error checking endpoint %s", endpoint_name)
+        error_message = "Error checking endpoint {}: {!r}".format(endpoint_name, e)
 
     try:
         if error_message != None:
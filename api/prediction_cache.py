@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Approximate per entry overhead of the key, tuple and ordered dict node
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_csv_row(row):
+    """
+    Normalize a csv row so rows that only differ in whitespace share a cache entry.
+    """
+    return ",".join(field.strip() for field in row.strip().split(","))
+
+
+def cache_key(endpoint_name, content_type, custom_attributes, payload):
+    """
+    Return a compact cache key for the payload sent to an endpoint.
+    """
+    digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    return "\x00".join([endpoint_name, content_type, custom_attributes, digest])
+
+
+class PredictionCache(object):
+    """
+    In-process LRU cache of predictions with a time to live, that survives across
+    invocations of a warm Lambda container.
+
+    Entries are bound to a generation (endpoint name and endpoint config) so that the cache is
+    cleared automatically when the function is pointed at a new endpoint or model.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def bind(self, generation):
+        """
+        Bind the cache to a generation, clearing all entries if the generation has changed.
+        """
+        with self._lock:
+            if generation != self.generation:
+                if self.generation is not None:
+                    logger.info(
+                        "cache generation changed from %s to %s", self.generation, generation
+                    )
+                self._entries.clear()
+                self._size_bytes = 0
+                self.generation = generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires, size = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(key) + len(str(value)) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._size_bytes += size
+            # Evict the least recently used entries until within bounds
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size_bytes -= size
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,127 @@
+import json
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Target(object):
+    """
+    An endpoint, and optionally a production variant of it, that requests can be routed to.
+
+    Requests are eligible for a target when their row count is within the target's range and
+    their custom attributes contain the target's attributes, if any.
+    """
+
+    def __init__(
+        self,
+        endpoint_name,
+        variant_name=None,
+        weight=1.0,
+        min_rows=0,
+        max_rows=None,
+        attributes=None,
+    ):
+        self.endpoint_name = endpoint_name
+        self.variant_name = variant_name or None
+        self.weight = float(weight)
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.attributes = attributes
+        self.latency = None
+        self.error_rate = 0.0
+
+    @property
+    def name(self):
+        if self.variant_name:
+            return "{}/{}".format(self.endpoint_name, self.variant_name)
+        return self.endpoint_name
+
+    def accepts(self, row_count, custom_attributes):
+        if row_count < self.min_rows:
+            return False
+        if self.max_rows is not None and row_count > self.max_rows:
+            return False
+        return not self.attributes or self.attributes in (custom_attributes or "")
+
+
+class Router(object):
+    """
+    Chooses the target for each request from those eligible for its row count and custom
+    attributes, at random in proportion to the configured weights divided by the
+    exponentially weighted moving average of each target's latency.  Traffic is steered toward
+    the fastest targets while the slower ones still get enough requests to track their latency.
+
+    Targets with an error rate average over the threshold only get a small probe fraction of
+    their share while there is a healthy target, so they are tried again once they recover.
+    Targets are configured as a json list, eg:
+    [{"endpoint_name": "taxi-prd-small", "max_rows": 1},
+     {"endpoint_name": "taxi-prd-large", "variant_name": "batch", "min_rows": 2, "weight": 2}]
+    """
+
+    def __init__(self, targets, alpha=0.1, unhealthy_error_rate=0.5, probe_fraction=0.02):
+        self.targets = targets
+        self.alpha = alpha
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.probe_fraction = probe_fraction
+        self.random = random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, default_endpoint_name, **kwargs):
+        if not config:
+            return cls([Target(default_endpoint_name)], **kwargs)
+        return cls([Target(**target) for target in json.loads(config)], **kwargs)
+
+    def _effective_weight(self, target, default_latency, probe):
+        latency = target.latency if target.latency is not None else default_latency
+        weight = target.weight / latency if latency else target.weight
+        return weight * self.probe_fraction if probe else weight
+
+    def choose(self, row_count, custom_attributes="", available=None):
+        """
+        Choose a target for the request, from only those the available function accepts while
+        any of the eligible targets are available, eg those whose circuit isn't open.
+        """
+        if len(self.targets) == 1:
+            return self.targets[0]
+        eligible = [t for t in self.targets if t.accepts(row_count, custom_attributes)]
+        if not eligible:
+            raise ValueError(
+                "no target accepts {} rows with attributes: {}".format(row_count, custom_attributes)
+            )
+        if available is not None:
+            eligible = [t for t in eligible if available(t)] or eligible
+        with self._lock:
+            unhealthy = [t.error_rate > self.unhealthy_error_rate for t in eligible]
+            probe = [is_unhealthy and not all(unhealthy) for is_unhealthy in unhealthy]
+            # Targets without latency samples are given the fastest latency so they are tried
+            latencies = [t.latency for t in eligible if t.latency is not None]
+            default_latency = min(latencies) if latencies else None
+            weights = [
+                self._effective_weight(t, default_latency, p) for t, p in zip(eligible, probe)
+            ]
+            return self.random.choices(eligible, weights)[0]
+
+    def record(self, target, seconds, success=True):
+        with self._lock:
+            if success:
+                if target.latency is None:
+                    target.latency = seconds
+                else:
+                    target.latency += self.alpha * (seconds - target.latency)
+            target.error_rate += self.alpha * ((0.0 if success else 1.0) - target.error_rate)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                (
+                    t.name,
+                    {
+                        "LatencyEwmaMs": None if t.latency is None else t.latency * 1000.0,
+                        "ErrorRateEwma": t.error_rate,
+                    },
+                )
+                for t in self.targets
+            )
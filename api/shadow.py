@@ -0,0 +1,132 @@
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+import batching
+
+logger = logging.getLogger(__name__)
+
+
+def prediction_deltas(primary, shadow):
+    """
+    Return summary statistics of the absolute difference between primary and shadow predictions.
+    """
+    try:
+        primary_values = [float(p) for p in batching.split_predictions(primary)]
+        shadow_values = [float(p) for p in batching.split_predictions(shadow)]
+    except (TypeError, ValueError) as e:
+        return {"error": "predictions not numeric: {}".format(e)}
+    if len(primary_values) != len(shadow_values):
+        return {
+            "error": "{} primary and {} shadow predictions".format(
+                len(primary_values), len(shadow_values)
+            )
+        }
+    deltas = [abs(p - s) for p, s in zip(primary_values, shadow_values)]
+    return {
+        "rows": len(deltas),
+        "mean_abs_delta": sum(deltas) / len(deltas) if deltas else 0.0,
+        "max_abs_delta": max(deltas) if deltas else 0.0,
+    }
+
+
+class ShadowMirror(object):
+    """
+    Mirrors a fraction of requests to a shadow endpoint on a background thread so the client
+    response never waits on the shadow.
+
+    Requests are placed on a bounded queue and dropped when it is full.  The shadow latency and
+    prediction deltas are logged in batches of records for offline comparison, with the records
+    and counters guarded by a lock shared with the handler thread.  Background work
+    is frozen along with the container between invocations and resumes on the next one.
+    """
+
+    def __init__(self, invoke, fraction, queue_size=100, batch_size=50, flush_seconds=60):
+        self.invoke = invoke
+        self.fraction = fraction
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.counters = {"ShadowMirrored": 0, "ShadowDropped": 0, "ShadowErrors": 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._records = []
+        self._last_flush = time.monotonic()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.fraction > 0
+
+    def offer(self, payload, content_type, custom_attributes, predictions):
+        """
+        Sample the request for mirroring without blocking.
+        """
+        if not self.enabled or random.random() >= self.fraction:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((payload, content_type, custom_attributes, predictions))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.counters["ShadowDropped"] += 1
+            return False
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="shadow-mirror", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                self.flush()
+                continue
+            self._mirror(*item)
+            self.flush_if_due()
+
+    def _mirror(self, payload, content_type, custom_attributes, predictions):
+        start = time.monotonic()
+        record = {"timestamp": time.time(), "content_type": content_type}
+        try:
+            shadow_predictions = self.invoke(payload, content_type, custom_attributes)
+            record["latency_ms"] = (time.monotonic() - start) * 1000
+            record.update(prediction_deltas(predictions, shadow_predictions))
+            with self._lock:
+                self.counters["ShadowMirrored"] += 1
+        except Exception as e:
+            record["latency_ms"] = (time.monotonic() - start) * 1000
+            record["error"] = str(e)
+            with self._lock:
+                self.counters["ShadowErrors"] += 1
+        with self._lock:
+            self._records.append(record)
+
+    def flush_if_due(self):
+        """
+        Flush the records once there is a batch of them or the flush period has passed.  Called
+        by the handler at the end of each invocation, as the background thread is frozen between
+        invocations and would otherwise hold the records until the next request.
+        """
+        with self._lock:
+            due = (
+                len(self._records) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        # Records are taken under the lock, as flush is also called from the handler thread
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._records:
+                return
+            records, self._records = self._records, []
+            counters = dict(self.counters)
+        logger.info("shadow records: %s", json.dumps({"records": records, **counters}))
@@ -0,0 +1,135 @@
+import math
+import re
+from itertools import repeat
+
+# Strings are removed leaving only the structural and scalar characters of a document
+STRING_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"')
+STRUCTURE_TABLE = str.maketrans("", "", "{}[],: \t\r\n0123456789+-.eEtruefalsn")
+CLOSING_CHARS = {"{": "}", "[": "]"}
+
+# Digits are removed from numeric csv rows to leave their separators and decimal points
+DIGITS_TABLE = str.maketrans("", "", "0123456789")
+LONE_POINT_PATTERN = re.compile(r"\.(?![0-9])(?<![0-9]\.)")
+
+
+def validate_json(text):
+    """
+    Cheaply validate the structure of a json document without building the python objects.
+
+    String literals are removed, and the rest of the document is checked for characters that
+    can't appear in numbers, literals or structure and for unbalanced brackets.  This catches
+    truncated and malformed documents in a few passes over the text, leaving full validation
+    to the endpoint container.
+    Returns an error message, or None if the document looks valid.
+    """
+    stripped = text.strip()
+    if not stripped:
+        return "empty json document"
+    if stripped[0] not in CLOSING_CHARS or stripped[-1] != CLOSING_CHARS[stripped[0]]:
+        return "json document is not a complete object or array"
+    skeleton = STRING_PATTERN.sub("", stripped) if '"' in stripped else stripped
+    if skeleton.translate(STRUCTURE_TABLE):
+        return "json document has unexpected characters"
+    if skeleton.count("{") != skeleton.count("}") or skeleton.count("[") != skeleton.count("]"):
+        return "json document has unbalanced brackets"
+    return None
+
+
+def validate_json_lines(rows):
+    """
+    Validate each row of a json lines document, returning the first error found or None.
+    """
+    for index, row in enumerate(rows):
+        error = validate_json(row)
+        if error is not None:
+            return "row {}: {}".format(index, error)
+    return None
+
+
+class CsvSchema(object):
+    """
+    Expected columns of csv rows, taken from the features of a Model Monitor baseline
+    constraints.json.  The baseline dataset has the output columns first, so those are dropped
+    from the features sent to the endpoint.
+    """
+
+    NUMERIC_TYPES = ("Integral", "Fractional")
+
+    def __init__(self, names, numeric):
+        self.names = names
+        self.numeric = numeric
+        self.numeric_columns = [i for i, is_numeric in enumerate(numeric) if is_numeric]
+
+    @property
+    def column_count(self):
+        return len(self.names)
+
+    @classmethod
+    def from_constraints(cls, constraints, output_columns=1):
+        features = constraints["features"][output_columns:]
+        return cls(
+            [f["name"] for f in features],
+            [f.get("inferred_type") in cls.NUMERIC_TYPES for f in features],
+        )
+
+
+def validate_csv_row(row, schema):
+    """
+    Validate a single csv row, returning an error message or None.  Empty values are allowed
+    as they are treated as missing by XGBoost.
+    """
+    values = row.split(",")
+    if len(values) != schema.column_count:
+        return "expected {} columns, got {}".format(schema.column_count, len(values))
+    for i in schema.numeric_columns:
+        value = values[i].strip()
+        if not value:
+            continue
+        try:
+            number = float(value)
+        except ValueError:
+            return "column {} ({}) is not a number: {}".format(i, schema.names[i], value[:20])
+        if not math.isfinite(number):
+            return "column {} ({}) is not finite: {}".format(i, schema.names[i], value[:20])
+    return None
+
+
+def validate_csv_rows(rows, schema):
+    """
+    Validate csv rows against the schema, returning a list of (row index, error message).
+
+    All rows are first checked in bulk with passes over the whole text that stay in C, and
+    only when that fails is each row checked to find the errors.  Rows of plain decimals are
+    valid when removing their digits leaves only the expected separators and at most one
+    decimal point, next to a digit, per value.  Other rows, eg with signs or exponents, are
+    parsed in bulk before falling back to checking each row.
+    """
+    if len(schema.numeric_columns) != schema.column_count:
+        return find_csv_errors(rows, schema)
+    text = "\n".join(rows)
+    skeleton = text.translate(DIGITS_TABLE)
+    expected = ("," * (schema.column_count - 1) + "\n") * len(rows)
+    if (
+        ".." not in skeleton
+        and skeleton.replace(".", "") == expected[:-1]
+        and not LONE_POINT_PATTERN.search(text)
+    ):
+        return []
+    separators = schema.column_count - 1
+    if all(count == separators for count in map(str.count, rows, repeat(","))):
+        try:
+            values = map(float, filter(None, text.replace("\n", ",").split(",")))
+            if all(map(math.isfinite, values)):
+                return []
+        except ValueError:
+            pass
+    return find_csv_errors(rows, schema)
+
+
+def find_csv_errors(rows, schema):
+    errors = []
+    for index, row in enumerate(rows):
+        error = validate_csv_row(row, schema)
+        if error is not None:
+            errors.append((index, error))
+    return errors
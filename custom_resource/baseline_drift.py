@@ -0,0 +1,177 @@
+import numpy as np
+
+# Model Monitor compares distributions against this threshold unless the constraints set one
+DEFAULT_COMPARISON_THRESHOLD = 0.1
+
+
+def get_buckets(feature):
+    """
+    Return the lower bounds, upper bounds and counts of the kll buckets of a numerical feature,
+    or None if it has no distribution.
+    """
+    distribution = feature.get("numerical_statistics", {}).get("distribution", {})
+    buckets = distribution.get("kll", {}).get("buckets") or []
+    if not buckets:
+        return None
+    return (
+        [b["lower_bound"] for b in buckets],
+        [b["upper_bound"] for b in buckets],
+        [b["count"] for b in buckets],
+    )
+
+
+def get_sketch(feature):
+    """
+    Return the items and weights of the kll sketch of a numerical feature, or None if it has no
+    sketch.  Items retained by the compactor at level i stand for 2^i values.
+    """
+    distribution = feature.get("numerical_statistics", {}).get("distribution", {})
+    data = distribution.get("kll", {}).get("sketch", {}).get("data") or []
+    if not any(data):
+        return None
+    items = np.concatenate([np.asarray(level, dtype=float) for level in data])
+    weights = np.concatenate([np.full(len(level), 2.0**i) for i, level in enumerate(data)])
+    return items, weights
+
+
+def sketch_distance(baseline, current):
+    """
+    Return the L-infinity distance between the weighted empirical cdfs of two kll sketches,
+    evaluated at every item of either, where the largest difference of step functions lies.
+    """
+    points = np.union1d(baseline[0], current[0])
+    cdfs = []
+    for items, weights in [baseline, current]:
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order]) / weights.sum()
+        index = np.searchsorted(items[order], points, side="right")
+        cdfs.append(np.where(index > 0, cumulative[np.maximum(index - 1, 0)], 0.0))
+    return float(np.abs(cdfs[0] - cdfs[1]).max())
+
+
+def get_categories(feature):
+    """
+    Return a dict of value to count of a string feature, or None if it has no distribution.
+    """
+    distribution = feature.get("string_statistics", {}).get("distribution", {})
+    buckets = distribution.get("categorical", {}).get("buckets") or []
+    if not buckets:
+        return None
+    return dict((b["value"], b["count"]) for b in buckets)
+
+
+def pad(rows, value):
+    """
+    Return a 2d array of the rows padded to the same length with the value.
+    """
+    width = max(len(row) for row in rows)
+    padded = np.full((len(rows), width), value, dtype=float)
+    for i, row in enumerate(rows):
+        padded[i, : len(row)] = row
+    return padded
+
+
+def cdf(points, lower, upper, counts):
+    """
+    Return the cdf at each point of a batch of histograms, assuming values are uniform within
+    each bucket.  Points have shape (features, points), and the bucket bounds and counts have
+    shape (features, buckets).  Zero width buckets are a step at their bound.
+    """
+    points = points[:, :, None]
+    lower, upper = lower[:, None, :], upper[:, None, :]
+    width = upper - lower
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(width > 0, (points - lower) / width, (points >= lower) * 1.0)
+    fraction = np.clip(fraction, 0.0, 1.0)
+    totals = counts.sum(axis=1, keepdims=True)
+    totals[totals == 0] = 1.0
+    return (fraction * counts[:, None, :]).sum(axis=2) / totals
+
+
+def numerical_distances(baselines, currents):
+    """
+    Return the L-infinity distance between the cdfs of each pair of baseline and current
+    bucket tuples, computed for all features at once.  Both cdfs are compared at every bucket
+    bound of either histogram, where the largest difference of piecewise linear cdfs must lie.
+    """
+    if not baselines:
+        return np.zeros(0)
+    # Padding buckets have no count so don't change the cdfs, and padding points repeat a bound
+    points = [sorted(set(b[0] + b[1] + c[0] + c[1])) for b, c in zip(baselines, currents)]
+    width = max(len(p) for p in points)
+    points = np.array([p + [p[-1]] * (width - len(p)) for p in points], dtype=float)
+    baseline_cdf = cdf(
+        points,
+        pad([b[0] for b in baselines], 0.0),
+        pad([b[1] for b in baselines], 0.0),
+        pad([b[2] for b in baselines], 0.0),
+    )
+    current_cdf = cdf(
+        points,
+        pad([c[0] for c in currents], 0.0),
+        pad([c[1] for c in currents], 0.0),
+        pad([c[2] for c in currents], 0.0),
+    )
+    return np.abs(baseline_cdf - current_cdf).max(axis=1)
+
+
+def categorical_distance(baseline, current):
+    """
+    Return the L-infinity distance between the category frequencies of two distributions.
+    """
+    values = sorted(set(baseline) | set(current))
+    b = np.array([baseline.get(v, 0) for v in values], dtype=float)
+    c = np.array([current.get(v, 0) for v in values], dtype=float)
+    return float(np.abs(b / max(b.sum(), 1.0) - c / max(c.sum(), 1.0)).max())
+
+
+def get_threshold(constraints):
+    if not constraints:
+        return DEFAULT_COMPARISON_THRESHOLD
+    config = constraints.get("monitoring_config", {}).get("distribution_constraints", {})
+    return float(config.get("comparison_threshold", DEFAULT_COMPARISON_THRESHOLD))
+
+
+def compute_drift(baseline_statistics, current_statistics, constraints=None):
+    """
+    Return the baseline drift of every feature in both the baseline and current statistics, as
+    a list of the feature name, the L-infinity distance between their distributions, the
+    comparison threshold and whether the distance exceeds it.
+    """
+    threshold = get_threshold(constraints)
+    current_features = dict((f["name"], f) for f in current_statistics.get("features", []))
+    names, baselines, currents = [], [], []
+    drift = {}
+    for feature in baseline_statistics.get("features", []):
+        name = feature["name"]
+        current = current_features.get(name)
+        if current is None:
+            continue
+        # Sketches give the exact cdf of their retained items, otherwise buckets are interpolated
+        baseline_sketch, current_sketch = get_sketch(feature), get_sketch(current)
+        if baseline_sketch and current_sketch:
+            drift[name] = sketch_distance(baseline_sketch, current_sketch)
+            continue
+        baseline_buckets, current_buckets = get_buckets(feature), get_buckets(current)
+        if baseline_buckets and current_buckets:
+            names.append(name)
+            baselines.append(baseline_buckets)
+            currents.append(current_buckets)
+            continue
+        baseline_categories, current_categories = get_categories(feature), get_categories(current)
+        if baseline_categories and current_categories:
+            drift[name] = categorical_distance(baseline_categories, current_categories)
+    for name, distance in zip(names, numerical_distances(baselines, currents)):
+        drift[name] = float(distance)
+
+    # Report features in the order of the baseline statistics
+    return [
+        {
+            "feature": feature["name"],
+            "drift": drift[feature["name"]],
+            "threshold": threshold,
+            "exceeds": drift[feature["name"]] > threshold,
+        }
+        for feature in baseline_statistics.get("features", [])
+        if feature["name"] in drift
+    ]
@@ -0,0 +1,367 @@
+import csv
+import json
+import math
+from urllib.parse import urlparse
+
+import numpy as np
+
+# Sketch parameters of the Model Monitor container, so drift is compared between like sketches
+KLL_K = 2048
+KLL_C = 0.64
+BUCKETS = 10
+
+# Rows are parsed a chunk at a time, and the counts of values are kept for string features
+# only while they have few enough distinct values to suggest a domain
+CHUNK_ROWS = 10000
+MAX_CATEGORIES = 1000
+
+NUMERIC_TYPES = ("Integral", "Fractional")
+
+
+class KllSketch(object):
+    """
+    Mergeable quantile sketch, keeping a compactor of items for each level where an item at
+    level i stands for 2^i values.  A full compactor sorts its items and promotes every other
+    one to the next level, so the total weight is always the number of values added.
+    """
+
+    def __init__(self, k=KLL_K, c=KLL_C, seed=None):
+        self.k = k
+        self.c = c
+        self.levels = [np.zeros(0)]
+        self.random = np.random.RandomState(seed)
+
+    def _capacity(self, level):
+        # Lower levels are given geometrically less room than the top level
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * self.c**depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.zeros(0))
+            items = np.sort(self.levels[level])
+            # An odd item out stays at its level
+            paired = len(items) - len(items) % 2
+            self.levels[level] = items[paired:]
+            self.levels[level + 1] = np.concatenate(
+                [self.levels[level + 1], items[self.random.randint(2) : paired : 2]]
+            )
+            # Adding a level shrinks the capacity of the levels below it
+            level = 0
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=float)])
+        self._compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.zeros(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def items(self):
+        """
+        Return the items and their weights.
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(items), 2.0**i) for i, items in enumerate(self.levels)]
+        )
+        return items, weights
+
+    def buckets(self, minimum, maximum, count=BUCKETS):
+        """
+        Return the weight of the items in each of the equal width buckets between the minimum
+        and maximum, with the last bucket including the maximum.
+        """
+        items, weights = self.items()
+        if maximum <= minimum:
+            return [{"lower_bound": minimum, "upper_bound": maximum, "count": float(weights.sum())}]
+        bounds = np.linspace(minimum, maximum, count + 1)
+        index = np.clip(np.searchsorted(bounds, items, side="right") - 1, 0, count - 1)
+        counts = np.bincount(index, weights=weights, minlength=count)
+        return [
+            {"lower_bound": float(lower), "upper_bound": float(upper), "count": float(c)}
+            for lower, upper, c in zip(bounds[:-1], bounds[1:], counts)
+        ]
+
+    def to_dict(self):
+        return {
+            "parameters": {"c": self.c, "k": float(self.k)},
+            "data": [items.tolist() for items in self.levels],
+        }
+
+
+class FeatureStatistics(object):
+    """
+    Streaming statistics of a column.  Values are counted as numbers until one doesn't parse,
+    when the feature becomes a string feature, so its type is inferred from all of its values.
+    Mean and variance are merged with Chan's parallel update for numerical stability.
+    """
+
+    def __init__(self, name, seed=None):
+        self.name = name
+        self.num_present = 0
+        self.num_missing = 0
+        self.numeric = True
+        self.integral = True
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = KllSketch(seed=seed)
+        self.categories = {}
+
+    @property
+    def inferred_type(self):
+        if not self.num_present or not self.numeric:
+            return "String"
+        return "Integral" if self.integral else "Fractional"
+
+    def _update_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def _update_categories(self, counts):
+        if self.categories is None:
+            return
+        for value, count in counts:
+            self.categories[value] = self.categories.get(value, 0) + count
+        if len(self.categories) > MAX_CATEGORIES:
+            self.categories = None
+
+    def update(self, values):
+        """
+        Add a chunk of the column's values as strings, where empty values are missing.
+        """
+        present = [v for v in values if v != ""]
+        self.num_missing += len(values) - len(present)
+        self.num_present += len(present)
+        if not present:
+            return
+        self._update_categories((value, 1) for value in present)
+        if not self.numeric:
+            return
+        try:
+            numbers = np.array(present, dtype=float)
+        except ValueError:
+            self.numeric = False
+            return
+        if not np.isfinite(numbers).all():
+            self.numeric = False
+            return
+        if self.integral:
+            try:
+                np.array(present, dtype=np.int64)
+            except (ValueError, OverflowError):
+                self.integral = False
+        self._update_moments(len(numbers), numbers.mean(), ((numbers - numbers.mean()) ** 2).sum())
+        self.sum += numbers.sum()
+        self.min = min(self.min, numbers.min())
+        self.max = max(self.max, numbers.max())
+        self.sketch.update(numbers)
+
+    def merge(self, other):
+        self.num_present += other.num_present
+        self.num_missing += other.num_missing
+        self.numeric = self.numeric and other.numeric
+        self.integral = self.integral and other.integral
+        if other.categories is None:
+            self.categories = None
+        else:
+            self._update_categories(other.categories.items())
+        if other.count:
+            self._update_moments(other.count, other.mean, other.m2)
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.sketch.merge(other.sketch)
+
+    def common(self):
+        return {"num_present": self.num_present, "num_missing": self.num_missing}
+
+    def statistics(self):
+        feature = {"name": self.name, "inferred_type": self.inferred_type}
+        if self.inferred_type in NUMERIC_TYPES:
+            feature["numerical_statistics"] = {
+                "common": self.common(),
+                "mean": float(self.mean),
+                "sum": float(self.sum),
+                "std_dev": math.sqrt(self.m2 / self.count),
+                "min": float(self.min),
+                "max": float(self.max),
+                "distribution": {
+                    "kll": {
+                        "buckets": self.sketch.buckets(float(self.min), float(self.max)),
+                        "sketch": self.sketch.to_dict(),
+                    }
+                },
+            }
+            return feature
+        feature["string_statistics"] = {"common": self.common()}
+        if self.categories is not None:
+            feature["string_statistics"]["distinct_count"] = float(len(self.categories))
+            feature["string_statistics"]["distribution"] = {
+                "categorical": {
+                    "buckets": [
+                        {"value": value, "count": count}
+                        for value, count in sorted(self.categories.items())
+                    ]
+                }
+            }
+        return feature
+
+    def constraints(self, item_count):
+        feature = {
+            "name": self.name,
+            "inferred_type": self.inferred_type,
+            "completeness": self.num_present / float(item_count) if item_count else 0.0,
+        }
+        if self.inferred_type in NUMERIC_TYPES:
+            feature["num_constraints"] = {"is_non_negative": bool(self.min >= 0)}
+        elif self.categories:
+            feature["string_constraints"] = {"domains": sorted(self.categories)}
+        return feature
+
+
+class BaselineStatistics(object):
+    """
+    Computes the statistics.json and constraints.json of a csv dataset in the schema of the
+    Model Monitor container, a chunk of rows at a time.  Statistics of separate chunks or files
+    can be merged, so the dataset never has to be held in memory.
+    """
+
+    def __init__(self, names=None, seed=None):
+        self.names = list(names) if names else None
+        self.seed = seed
+        self.features = None
+        self.item_count = 0
+
+    def _init_features(self, columns):
+        if self.names is None:
+            # Columns are named as the container names them for csv without a header
+            self.names = ["_c{}".format(i) for i in range(columns)]
+        self.features = [FeatureStatistics(name, self.seed) for name in self.names]
+
+    def update(self, rows):
+        """
+        Add a chunk of rows, each a list of string values.  Short rows have missing values.
+        """
+        if not rows:
+            return
+        if self.features is None:
+            self._init_features(len(rows[0]))
+        self.item_count += len(rows)
+        width = len(self.features)
+        rows = [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+        for feature, values in zip(self.features, zip(*rows)):
+            feature.update(list(values))
+
+    def merge(self, other):
+        if other.features is None:
+            return
+        if self.features is None:
+            self.names, self.features = other.names, other.features
+        else:
+            for feature, other_feature in zip(self.features, other.features):
+                feature.merge(other_feature)
+        self.item_count += other.item_count
+
+    def statistics(self):
+        return {
+            "version": 0.0,
+            "dataset": {"item_count": self.item_count},
+            "features": [f.statistics() for f in self.features or []],
+        }
+
+    def constraints(self, comparison_threshold=0.1):
+        return {
+            "version": 0.0,
+            "features": [f.constraints(self.item_count) for f in self.features or []],
+            "monitoring_config": {
+                "evaluate_constraints": "Enabled",
+                "emit_metrics": "Enabled",
+                "datatype_check_threshold": 1.0,
+                "domain_content_threshold": 1.0,
+                "distribution_constraints": {
+                    "perform_comparison": "Enabled",
+                    "comparison_threshold": comparison_threshold,
+                    "comparison_method": "Robust",
+                },
+            },
+        }
+
+
+def iter_chunks(rows, chunk_rows=CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def update_from_lines(baseline, lines, header=True, chunk_rows=CHUNK_ROWS):
+    """
+    Add the csv rows of an iterable of lines to the baseline statistics, taking the feature
+    names from the header of the first file when there is one.
+    """
+    rows = (row for row in csv.reader(lines) if row)
+    if header:
+        names = next(rows, None)
+        if names is not None and baseline.names is None:
+            baseline.names = [name.strip() for name in names]
+    for chunk in iter_chunks(rows, chunk_rows):
+        baseline.update(chunk)
+
+
+def iter_object_lines(s3_client, bucket, key):
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        for line in body.iter_lines():
+            yield line.decode("utf-8")
+    finally:
+        body.close()
+
+
+def suggest_baseline(s3_client, input_uri, output_uri, header=True, chunk_rows=CHUNK_ROWS):
+    """
+    Stream the csv objects under the input uri, and write their statistics.json and
+    constraints.json under the output uri.  Returns the uris of the constraints and statistics.
+    """
+    url = urlparse(input_uri)
+    bucket, prefix = url.netloc, url.path.lstrip("/")
+    keys = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []) if not o["Key"].endswith("/"))
+    if not keys:
+        raise ValueError("No baseline dataset found at: {}".format(input_uri))
+
+    baseline = BaselineStatistics()
+    for key in sorted(keys):
+        update_from_lines(baseline, iter_object_lines(s3_client, bucket, key), header, chunk_rows)
+
+    url = urlparse(output_uri)
+    output_bucket, output_prefix = url.netloc, url.path.strip("/")
+    uris = []
+    for filename, document in [
+        ("constraints.json", baseline.constraints()),
+        ("statistics.json", baseline.statistics()),
+    ]:
+        key = "{}/{}".format(output_prefix, filename) if output_prefix else filename
+        s3_client.put_object(Bucket=output_bucket, Key=key, Body=json.dumps(document, indent=4))
+        uris.append("s3://{}/{}".format(output_bucket, key))
+    return uris[0], uris[1]
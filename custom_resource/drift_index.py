@@ -0,0 +1,247 @@
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+# Drift is stored as float32 and reported rounded to the precision it was stored with
+PRECISION = 6
+
+
+class DayPartition(object):
+    """
+    The drift of each feature for the monitoring runs of one day, as a features by runs array
+    with NaN where a run has no drift for a feature.  Runs are only ever appended.
+    """
+
+    def __init__(self, features=None, times=None, jobs=None, drift=None):
+        self.features = list(features or [])
+        self.times = np.asarray(times if times is not None else [], dtype=np.int64)
+        self.jobs = list(jobs or [])
+        self.drift = (
+            np.asarray(drift, dtype=np.float32)
+            if drift is not None
+            else np.zeros((len(self.features), 0), dtype=np.float32)
+        )
+
+    def append(self, time, job_name, drift):
+        """
+        Append the drift of a run, a dict of feature to drift, unless the job is already in the
+        partition.  Returns whether the run was appended.
+        """
+        if job_name in self.jobs:
+            return False
+        new_features = [f for f in drift if f not in self.features]
+        if new_features:
+            self.features.extend(new_features)
+            padding = np.full((len(new_features), len(self.jobs)), np.nan, dtype=np.float32)
+            self.drift = np.vstack([self.drift, padding])
+        column = np.full((len(self.features), 1), np.nan, dtype=np.float32)
+        for feature, value in drift.items():
+            column[self.features.index(feature), 0] = value
+        self.drift = np.hstack([self.drift, column])
+        self.times = np.append(self.times, int(time.timestamp()))
+        self.jobs.append(job_name)
+        return True
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            features=np.array(self.features, dtype=str),
+            times=self.times,
+            jobs=np.array(self.jobs, dtype=str),
+            drift=self.drift,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        return cls(
+            arrays["features"].tolist(),
+            arrays["times"],
+            arrays["jobs"].tolist(),
+            arrays["drift"],
+        )
+
+
+def combine(partitions):
+    """
+    Return the features, run times and features by runs drift array of the partitions in time
+    order, aligning the features of each.
+    """
+    features = []
+    for partition in partitions:
+        features.extend(f for f in partition.features if f not in features)
+    columns = sum(len(p.times) for p in partitions)
+    drift = np.full((len(features), columns), np.nan, dtype=np.float32)
+    times = np.zeros(columns, dtype=np.int64)
+    start = 0
+    for partition in partitions:
+        end = start + len(partition.times)
+        rows = [features.index(f) for f in partition.features]
+        drift[rows, start:end] = partition.drift
+        times[start:end] = partition.times
+        start = end
+    order = np.argsort(times, kind="stable")
+    return features, times[order], drift[:, order]
+
+
+class DriftIndex(object):
+    """
+    Append-only store of the per feature drift of monitoring runs, with one compressed numpy
+    partition per day under the index uri and a manifest of the last run indexed.
+
+    Partitions from before yesterday no longer change, so they are cached in the warm container,
+    while the latest partitions are re-read when their etag changes.
+    """
+
+    def __init__(self, s3_client, uri, max_workers=8):
+        url = urlparse(uri)
+        self.s3 = s3_client
+        self.bucket, self.prefix = url.netloc, url.path.strip("/")
+        self.max_workers = max_workers
+        self._cache = {}
+
+    def _key(self, name):
+        return "{}/{}".format(self.prefix, name) if self.prefix else name
+
+    def _partition_key(self, day):
+        return self._key("day={}/drift.npz".format(day.isoformat()))
+
+    def _get(self, key, etag=None):
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                return etag, None
+            if code in ("404", "NoSuchKey"):
+                return None, None
+            raise
+        return response["ETag"], response["Body"].read()
+
+    def load_partition(self, day):
+        """
+        Return the partition of the day, or None if no runs are indexed for it.
+        """
+        cached = self._cache.get(day)
+        # Runs late in the day can be indexed after midnight, so yesterday is re-read as well
+        past = day < datetime.now(timezone.utc).date() - timedelta(days=1)
+        if cached is not None and past:
+            return cached[1]
+        etag, data = self._get(self._partition_key(day), cached[0] if cached else None)
+        if etag is None:
+            # Past days without runs are remembered too, so queries only read partitions once
+            if past:
+                self._cache[day] = (None, None)
+            return None
+        if data is not None:
+            self._cache[day] = (etag, DayPartition.from_bytes(data))
+        return self._cache[day][1]
+
+    def save_partition(self, day, partition):
+        response = self.s3.put_object(
+            Bucket=self.bucket, Key=self._partition_key(day), Body=partition.to_bytes()
+        )
+        self._cache[day] = (response["ETag"], partition)
+
+    def load_manifest(self):
+        _, data = self._get(self._key("manifest.json"))
+        return json.loads(data) if data else {}
+
+    def save_manifest(self, manifest):
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self._key("manifest.json"), Body=json.dumps(manifest)
+        )
+
+    def append(self, runs):
+        """
+        Append runs of (scheduled time, job name, drift dict of feature to value), rewriting only
+        the partitions of their days.  Returns the number of runs appended.
+        """
+        by_day = {}
+        for time, job_name, drift in sorted(runs, key=lambda run: run[0]):
+            by_day.setdefault(time.astimezone(timezone.utc).date(), []).append(
+                (time, job_name, drift)
+            )
+        appended = 0
+        for day, day_runs in by_day.items():
+            partition = self.load_partition(day) or DayPartition()
+            day_appended = sum(partition.append(*run) for run in day_runs)
+            if day_appended:
+                self.save_partition(day, partition)
+                appended += day_appended
+        return appended
+
+    def load(self, days, now=None):
+        """
+        Return the combined features, run times and drift of the last number of days.
+        """
+        today = (now or datetime.now(timezone.utc)).date()
+        dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            partitions = [p for p in executor.map(self.load_partition, dates) if p is not None]
+        return combine(partitions)
+
+    def feature_series(self, feature, days=30, now=None):
+        """
+        Return the run times and drift of a feature over the last number of days.
+        """
+        features, times, drift = self.load(days, now)
+        if feature not in features:
+            return {"Feature": feature, "Times": [], "Drift": []}
+        values = drift[features.index(feature)]
+        present = ~np.isnan(values)
+        return {
+            "Feature": feature,
+            "Times": times[present].tolist(),
+            "Drift": values[present].astype(float).round(PRECISION).tolist(),
+        }
+
+    def top_features(self, k=10, days=1, statistic="max", now=None):
+        """
+        Return the k features with the largest max or mean drift over the last number of days.
+        """
+        features, _, drift = self.load(days, now)
+        if not features or not drift.shape[1]:
+            return []
+        with np.errstate(all="ignore"):
+            values = np.nanmean(drift, axis=1) if statistic == "mean" else np.nanmax(drift, axis=1)
+        values = np.where(np.isnan(values), -np.inf, values)
+        order = np.argsort(-values, kind="stable")[:k]
+        return [
+            {"Feature": features[i], "Drift": round(float(values[i]), PRECISION)}
+            for i in order
+            if np.isfinite(values[i])
+        ]
+
+    def rolling(self, feature, window=24, days=30, statistic="mean", now=None):
+        """
+        Return the rolling mean or max drift of a feature over windows of the given number of
+        runs, for the runs of the last number of days.
+        """
+        series = self.feature_series(feature, days, now)
+        values = np.asarray(series["Drift"], dtype=float)
+        if len(values) < window:
+            return {"Feature": feature, "Window": window, "Times": [], "Drift": []}
+        if statistic == "max":
+            rolled = np.lib.stride_tricks.sliding_window_view(values, window).max(axis=1)
+        else:
+            cumulative = np.cumsum(np.insert(values, 0, 0.0))
+            rolled = (cumulative[window:] - cumulative[:-window]) / window
+        return {
+            "Feature": feature,
+            "Window": window,
+            "Times": series["Times"][window - 1 :],
+            "Drift": rolled.round(PRECISION).tolist(),
+        }
@@ -0,0 +1,104 @@
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+NUMBER = "0123456789+-.eE"
+
+
+class JsonStream(object):
+    """
+    Incrementally decodes json values from an iterable of byte chunks, holding only the
+    undecoded remainder of the chunks read so far.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.buffer = self.buffer[self.pos :] + self.utf8.decode(b"", final=True)
+        else:
+            self.buffer = self.buffer[self.pos :] + self.utf8.decode(chunk)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """
+        Return the next character that isn't whitespace, without consuming it, or "" at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("expected one of {!r} but found {!r}".format(characters, character))
+        self.pos += 1
+        return character
+
+    def _number_continues(self, value):
+        if self.eof or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        end = self.pos
+        while end < len(self.buffer) and self.buffer[end] in NUMBER:
+            end += 1
+        return end == len(self.buffer)
+
+    def value(self):
+        """
+        Decode the next json value, reading more chunks until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self._read():
+                    raise
+                continue
+            # A number that runs to the end of the buffer may continue in the next chunk
+            if self._number_continues(value):
+                self._read()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array_items(chunks, key):
+    """
+    Yield the items of the array under the key of a top-level json object one at a time,
+    reading the chunks as they are needed, so memory is bounded by the largest item rather
+    than the document.  Values of other keys are decoded and discarded.
+    """
+    stream = JsonStream(chunks)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        name = stream.value()
+        stream.expect(":")
+        if name == key:
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(",]") == "]":
+                        break
+        else:
+            stream.value()
+        if stream.expect(",}") == "}":
+            return
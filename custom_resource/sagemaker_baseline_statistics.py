@@ -0,0 +1,32 @@
+import boto3
+import logging
+import json
+
+import baseline_statistics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3_client = boto3.client("s3")
+
+
+# Compute the baseline statistics and constraints of a csv dataset in process, in place of a
+# Model Monitor processing job
+def lambda_handler(event, context):
+    for key in ["BaselineInputUri", "BaselineOutputUri"]:
+        if key not in event:
+            raise KeyError("{} key not found in event: {}.".format(key, json.dumps(event)))
+    constraints_uri, statistics_uri = baseline_statistics.suggest_baseline(
+        s3_client,
+        event["BaselineInputUri"],
+        event["BaselineOutputUri"],
+        header=event.get("Header", True),
+    )
+    logger.info("Baseline written to: {}".format(event["BaselineOutputUri"]))
+    return {
+        "statusCode": 200,
+        "results": {
+            "BaselineConstraintsUri": constraints_uri,
+            "BaselineStatisticsUri": statistics_uri,
+        },
+    }
@@ -0,0 +1,132 @@
+import boto3
+import logging
+import os
+import json
+from datetime import datetime, timedelta, timezone
+
+from botocore.config import Config
+
+import drift_index
+import sagemaker_query_drift
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Runs not yet indexed are looked for back to this many hours on the first update
+INITIAL_HOURS = int(os.environ.get("INITIAL_HOURS", "720"))
+
+s3_client = boto3.client(
+    "s3", config=Config(max_pool_connections=sagemaker_query_drift.MAX_WORKERS)
+)
+
+# Executions still in these states are indexed by a later update
+UNFINISHED_STATUSES = {"Pending", "InProgress", "Stopping"}
+
+# Jobs in these states have drift, so a run without it, eg when its statistics couldn't be read,
+# is retried by a later update
+COMPLETED_STATUSES = {"Completed", "CompletedWithViolations"}
+
+# Indexes are kept across invocations in a warm container to re-use their cached partitions
+indexes = {}
+
+
+def get_index(uri):
+    if uri not in indexes:
+        indexes[uri] = drift_index.DriftIndex(
+            s3_client, uri, max_workers=sagemaker_query_drift.MAX_WORKERS
+        )
+    return indexes[uri]
+
+
+def update_index(index, schedule_name):
+    """
+    Index the drift of the monitoring schedule's runs that finished since the last update.
+    """
+    manifest = index.load_manifest()
+    end_time = datetime.now(timezone.utc)
+    if "LastScheduledTime" in manifest:
+        start_time = sagemaker_query_drift.parse_time(manifest["LastScheduledTime"])
+    else:
+        start_time = end_time - timedelta(hours=INITIAL_HOURS)
+    executions = [
+        e
+        for e in sagemaker_query_drift.list_schedule_executions(schedule_name, start_time, end_time)
+        if e["ScheduledTime"] > start_time
+    ]
+    # Stop at the first unfinished run so it isn't skipped by the next update
+    finished = []
+    for execution in executions:
+        if execution["MonitoringExecutionStatus"] in UNFINISHED_STATUSES:
+            break
+        finished.append(execution)
+    # A backlog of runs, as on the first update, is indexed oldest first over several updates
+    if len(finished) > sagemaker_query_drift.MAX_JOBS:
+        logger.info(
+            "Indexing the first {} of {} runs".format(sagemaker_query_drift.MAX_JOBS, len(finished))
+        )
+        finished = finished[: sagemaker_query_drift.MAX_JOBS]
+
+    jobs = dict(
+        (e["ProcessingJobArn"].split("/")[-1], e["ScheduledTime"])
+        for e in finished
+        if "ProcessingJobArn" in e
+    )
+    results, errors = sagemaker_query_drift.query_processing_jobs(list(jobs))
+    runs = [
+        (
+            jobs[result["ProcessingJobName"]],
+            result["ProcessingJobName"],
+            dict((d["feature"], d["drift"]) for d in result["BaselineDrift"]),
+        )
+        for result in results
+        if result["BaselineDrift"]
+    ]
+    appended = index.append(runs)
+
+    # Runs from the first that failed to query or is missing its drift are retried by the next
+    # update, and those already appended are skipped by the index
+    failed = set(error["ProcessingJobName"] for error in errors)
+    failed.update(
+        result["ProcessingJobName"]
+        for result in results
+        if result["BaselineDrift"] is None and result["ProcessingJobStatus"] in COMPLETED_STATUSES
+    )
+    last_time = None
+    for execution in finished:
+        if execution.get("ProcessingJobArn", "").split("/")[-1] in failed:
+            break
+        last_time = execution["ScheduledTime"]
+    if last_time is not None:
+        manifest["LastScheduledTime"] = last_time.isoformat()
+        index.save_manifest(manifest)
+    logger.info("Indexed {} of {} runs of {}".format(appended, len(finished), schedule_name))
+    return {"Indexed": appended, "Runs": len(finished), "errors": errors}
+
+
+# Update the drift index with new runs, or query it for a feature, the top features or a
+# rolling aggregate
+def lambda_handler(event, context):
+    if "IndexUri" not in event:
+        raise KeyError("IndexUri key not found in event: {}.".format(json.dumps(event)))
+    index = get_index(event["IndexUri"])
+    action = event.get("Action", "Update")
+    if action == "Update":
+        results = update_index(index, event["MonitoringScheduleName"])
+    elif action == "Feature":
+        results = index.feature_series(event["Feature"], days=int(event.get("Days", 30)))
+    elif action == "TopFeatures":
+        results = index.top_features(
+            k=int(event.get("K", 10)),
+            days=int(event.get("Days", 1)),
+            statistic=event.get("Statistic", "max"),
+        )
+    elif action == "Rolling":
+        results = index.rolling(
+            event["Feature"],
+            window=int(event.get("Window", 24)),
+            days=int(event.get("Days", 30)),
+            statistic=event.get("Statistic", "mean"),
+        )
+    else:
+        return {"statusCode": 400, "error": "Unknown action: {}".format(action)}
+    return {"statusCode": 200, "results": results}
@@ -1,14 +1,30 @@
 import boto3
 import logging
 import os
-import re
 import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from urllib.parse import urlparse
 
+from botocore.config import Config
+
+import baseline_drift
+import json_stream
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-sm_client = boto3.client("sagemaker")
-s3_client = boto3.client("s3")
+
+# Jobs are queried concurrently on a bounded pool, with a pooled connection for each worker
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+MAX_JOBS = int(os.environ.get("MAX_JOBS", "168"))
+
+# Violations are streamed from s3 in chunks rather than read as a whole document
+READ_CHUNK_BYTES = int(os.environ.get("READ_CHUNK_BYTES", str(64 * 1024)))
+
+config = Config(max_pool_connections=MAX_WORKERS)
+sm_client = boto3.client("sagemaker", config=config)
+s3_client = boto3.client("s3", config=config)
 
 
 def get_processing_job(processing_job_name):
@@ -18,7 +34,7 @@ def get_processing_job(processing_job_name):
     s3_result_uri = response["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
     url_parsed = urlparse(s3_result_uri)
     result_bucket, result_path = url_parsed.netloc, url_parsed.path
-    return status, exit_message, result_bucket, result_path
+    return status, exit_message, result_bucket, result_path, response
 
 
 def get_s3_results_json(result_bucket, result_path, filename):
@@ -29,56 +45,204 @@ def get_s3_results_json(result_bucket, result_path, filename):
     return json.loads(s3_object["Body"].read())
 
 
-def get_baseline_drift(feature):
-    if "violations" in feature:
-        for violation in feature["violations"]:
-            if violation["constraint_check_type"] == "baseline_drift_check":
-                desc = violation["description"]
-                print(desc)
-                matches = re.search("distance: (.+) exceeds threshold: (.+)", desc)
-                if matches:
-                    match = matches.group(1)
-                    threshold = matches.group(2)
-                    yield {
-                        "feature": violation["feature_name"],
-                        "drift": float(match),
-                        "threshold": float(threshold),
-                    }
-
-
-# Retrieve transform job name from event and return transform job status.
+def iter_s3_results_array(result_bucket, result_path, filename, key):
+    """
+    Yield the items of the array under the key of a json results file, streaming the object.
+    """
+    s3_object = s3_client.get_object(
+        Bucket=result_bucket,
+        Key=os.path.join(result_path.lstrip("/"), filename),
+    )
+    body = s3_object["Body"]
+    try:
+        for item in json_stream.iter_array_items(body.iter_chunks(READ_CHUNK_BYTES), key):
+            yield item
+    finally:
+        body.close()
+
+
+def get_drift_violations(violations):
+    """
+    Yield the baseline drift violations of the violations as they are parsed.
+    """
+    for violation in violations:
+        if violation.get("constraint_check_type") == "baseline_drift_check":
+            yield violation
+
+
+# The baseline files are shared by all the runs of a monitoring schedule, so are read once
+@lru_cache(maxsize=16)
+def get_s3_json(uri):
+    url_parsed = urlparse(uri)
+    return get_s3_results_json(
+        url_parsed.netloc, os.path.dirname(url_parsed.path), os.path.basename(url_parsed.path)
+    )
+
+
+def get_baseline_uri(processing_job, environment_name, filename):
+    """
+    Return the s3 uri of the baseline file given to the monitoring job as the environment
+    variable, from the processing input downloaded to its local path.
+    """
+    local_path = processing_job.get("Environment", {}).get(environment_name)
+    if not local_path:
+        return None
+    for processing_input in processing_job.get("ProcessingInputs", []):
+        s3_input = processing_input.get("S3Input", {})
+        if local_path.startswith(s3_input.get("LocalPath", "").rstrip("/") + "/"):
+            s3_uri = s3_input["S3Uri"]
+            return s3_uri if s3_uri.endswith(".json") else s3_uri.rstrip("/") + "/" + filename
+    return None
+
+
+def get_baseline_drift(processing_job, result_bucket, result_path):
+    """
+    Return the drift of every feature between the baseline statistics and the statistics of the
+    monitoring run, not only the features that violated the constraints.
+    """
+    statistics_uri = get_baseline_uri(processing_job, "baseline_statistics", "statistics.json")
+    if statistics_uri is None:
+        logger.info("No baseline statistics for processing job")
+        return None
+    baseline_statistics = get_s3_json(statistics_uri)
+    statistics = get_s3_results_json(result_bucket, result_path, "statistics.json")
+    constraints_uri = get_baseline_uri(processing_job, "baseline_constraints", "constraints.json")
+    constraints = get_s3_json(constraints_uri) if constraints_uri else None
+    return baseline_drift.compute_drift(baseline_statistics, statistics, constraints)
+
+
+def query_processing_job(job_name):
+    """
+    Return the status and baseline drift of a monitoring processing job.
+    """
+    status, exit_message, result_bucket, result_path, processing_job = get_processing_job(job_name)
+    logger.info("Processing job: {} has status:{}.".format(job_name, status))
+    drift = None
+    violated_features = None
+    if status == "Completed":
+        try:
+            # Attempt to stream the violations, keeping only the features that drifted
+            violations = iter_s3_results_array(
+                result_bucket, result_path, "constraint_violations.json", "violations"
+            )
+            violated_features = [v["feature_name"] for v in get_drift_violations(violations)]
+            status = "CompletedWithViolations"
+            logger.info("Has violations")
+        except Exception as e:
+            print(e)
+            logger.info("No violations")
+        try:
+            # The violations are still returned when the drift can't be computed
+            drift = get_baseline_drift(processing_job, result_bucket, result_path)
+        except Exception:
+            logger.exception(
+                "Error computing baseline drift for processing job: {}".format(job_name)
+            )
+    return {
+        "ProcessingJobName": job_name,
+        "ProcessingJobStatus": status,
+        "ExitMessage": exit_message,
+        "BaselineDrift": drift,
+        "DriftViolations": violated_features,
+    }
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def list_schedule_executions(schedule_name, start_time, end_time):
+    """
+    Return the monitoring schedule's executions scheduled between the start and end times,
+    oldest first.
+    """
+    paginator = sm_client.get_paginator("list_monitoring_executions")
+    executions = []
+    for page in paginator.paginate(
+        MonitoringScheduleName=schedule_name,
+        ScheduledTimeAfter=start_time,
+        ScheduledTimeBefore=end_time,
+        SortBy="ScheduledTime",
+        SortOrder="Ascending",
+    ):
+        executions.extend(page["MonitoringExecutionSummaries"])
+    return executions
+
+
+def list_schedule_jobs(schedule_name, start_time, end_time):
+    """
+    Return the processing job names of the monitoring schedule's executions scheduled between
+    the start and end times, oldest first.
+    """
+    return [
+        execution["ProcessingJobArn"].split("/")[-1]
+        for execution in list_schedule_executions(schedule_name, start_time, end_time)
+        if "ProcessingJobArn" in execution
+    ]
+
+
+def get_job_names(event):
+    """
+    Return the processing job names to query from the event, either a list of job names or the
+    executions of a monitoring schedule over a time range or the last number of hours.
+    """
+    if "ProcessingJobNames" in event:
+        return list(event["ProcessingJobNames"])
+    if "MonitoringScheduleName" in event:
+        end_time = (
+            parse_time(event["EndTime"]) if "EndTime" in event else datetime.now(timezone.utc)
+        )
+        if "StartTime" in event:
+            start_time = parse_time(event["StartTime"])
+        else:
+            start_time = end_time - timedelta(hours=int(event.get("Hours", 24)))
+        return list_schedule_jobs(event["MonitoringScheduleName"], start_time, end_time)
+    raise KeyError("Processing job names not found in event: {}.".format(json.dumps(event)))
+
+
+def query_processing_jobs(job_names):
+    """
+    Query the jobs concurrently, returning the results of those that succeeded and the errors
+    of those that failed.
+    """
+
+    def query(job_name):
+        try:
+            return query_processing_job(job_name), None
+        except Exception as e:
+            logger.error("Failed to query processing job: {} {}".format(job_name, e))
+            return None, {"ProcessingJobName": job_name, "Error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        outcomes = list(executor.map(query, job_names))
+    results = [result for result, _ in outcomes if result is not None]
+    errors = [error for _, error in outcomes if error is not None]
+    return results, errors
+
+
+# Retrieve processing job names from event and return their status and drift.
 def lambda_handler(event, context):
     if "ProcessingJobName" in event:
         job_name = event["ProcessingJobName"]
-    else:
-        raise KeyError("ProcessingJobName key not found in event: {}.".format(json.dumps(event)))
+        try:
+            return {"statusCode": 200, "results": query_processing_job(job_name)}
+        except Exception as e:
+            message = "Failed to read processing status!"
+            print(e)
+            return {"statusCode": 500, "error": message}
+
+    job_names = get_job_names(event)
+    if len(job_names) > MAX_JOBS:
+        logger.info("Querying the latest {} of {} jobs".format(MAX_JOBS, len(job_names)))
+        job_names = job_names[-MAX_JOBS:]
     try:
-        # Parse the result uri
-        status, exit_message, result_bucket, result_path = get_processing_job(job_name)
-        logger.info("Processing job: {} has status:{}.".format(job_name, status))
-        drift = None
-        if status == "Completed":
-            try:
-                # Attempt to load the violations
-                violations = get_s3_results_json(
-                    result_bucket, result_path, "constraint_violations.json"
-                )
-                status = "CompletedWithViolations"
-                logger.info("Has violations")
-                drift = list(get_baseline_drift(violations))
-            except Exception as e:
-                print(e)
-                logger.info("No violations")
-        return {
-            "statusCode": 200,
-            "results": {
-                "ProcessingJobName": job_name,
-                "ProcessingJobStatus": status,
-                "ExitMessage": exit_message,
-                "BaselineDrift": drift,
-            },
-        }
+        results, errors = query_processing_jobs(job_names)
     except Exception as e:
         message = "Failed to read processing status!"
         print(e)
         return {"statusCode": 500, "error": message}
+    return {
+        "statusCode": 200 if results or not errors else 500,
+        "results": results,
+        "errors": errors,
+    }
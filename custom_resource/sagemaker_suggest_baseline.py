@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 
 import boto3
 import botocore
@@ -7,8 +8,11 @@ from botocore.exceptions import ClientError
 
 from crhelper import CfnResource
 
+import baseline_statistics
+
 logger = logging.getLogger(__name__)
 sm = boto3.client("sagemaker")
+s3 = boto3.client("s3")
 
 # cfnhelper makes it easier to implement a CloudFormation custom resource
 helper = CfnResource()
@@ -26,6 +30,8 @@ def create_handler(event, context):
     """
     Called when CloudFormation custom resource sends the create event
     """
+    if is_local_engine(event):
+        return create_local_baseline(event)
     return create_processing_job(event)
 
 
@@ -45,6 +51,8 @@ def poll_create(event, context):
     Return true if the resource has been created and false otherwise so
     CloudFormation polls again.
     """
+    if is_local_engine(event):
+        return True
     processing_job_name = get_processing_job_name(event)
     logger.info("Polling for creation of processing job: %s", processing_job_name)
     return is_processing_job_ready(processing_job_name)
@@ -95,6 +103,13 @@ def get_processing_job_name(event):
     return event["ResourceProperties"]["ProcessingJobName"]
 
 
+def is_local_engine(event):
+    """
+    The baseline is computed in process by the "local" engine, or by a processing job otherwise.
+    """
+    return event["ResourceProperties"].get("BaselineEngine", "processing") == "local"
+
+
 def is_processing_job_ready(processing_job_name):
     is_ready = False
 
@@ -134,6 +149,23 @@ def create_processing_job(event):
     return helper.Data["Arn"]
 
 
+def create_local_baseline(event):
+    processing_job_name = get_processing_job_name(event)
+    props = event["ResourceProperties"]
+
+    logger.info("Computing baseline in process for: %s", processing_job_name)
+    constraints_uri, statistics_uri = baseline_statistics.suggest_baseline(
+        s3, props["BaselineInputUri"], props["BaselineResultsUri"]
+    )
+
+    # Update Output Parameters, with the job name standing in for the resource
+    helper.Data["ProcessingJobName"] = processing_job_name
+    helper.Data["BaselineConstraintsUri"] = constraints_uri
+    helper.Data["BaselineStatisticsUri"] = statistics_uri
+    helper.Data["Arn"] = processing_job_name
+    return helper.Data["Arn"]
+
+
 def stop_processing_job(processing_job_name):
     try:
         processing_job = sm.describe_processing_job(ProcessingJobName=processing_job_name)
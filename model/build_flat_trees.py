@@ -0,0 +1,37 @@
+import argparse
+import io
+import os
+import sys
+import tarfile
+
+# The api modules are copied next to this script in the processing job
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import flat_trees  # noqa: E402
+import local_model  # noqa: E402
+
+
+def main(model_dir, output_dir):
+    with open(os.path.join(model_dir, "model.tar.gz"), "rb") as f:
+        with tarfile.open(fileobj=io.BytesIO(f.read()), mode="r:gz") as tar:
+            data = tar.extractfile(local_model.MODEL_FILE_NAME).read()
+    trees = flat_trees.FlatTrees.from_booster(local_model.load_booster(data))
+    # The api only scores squared-error models locally, so flat trees aren't built for others
+    if trees.objective not in flat_trees.IDENTITY_OBJECTIVES:
+        raise local_model.UnsupportedObjective(
+            "objective {} is not scored locally".format(trees.objective)
+        )
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    path = os.path.join(output_dir, local_model.FLAT_TREES_FILE_NAME)
+    with open(path, "wb") as f:
+        f.write(trees.to_bytes())
+    print("wrote {} trees of {} nodes to {}".format(len(trees.roots), len(trees.value), path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the flat trees of an xgboost model")
+    parser.add_argument("--model-dir", default="/opt/ml/processing/input/model")
+    parser.add_argument("--output-dir", default="/opt/ml/processing/output")
+    args = parser.parse_args()
+    main(args.model_dir, args.output_dir)
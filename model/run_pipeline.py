@@ -3,6 +3,7 @@ import json
 import os
 import sys
 import time
+from urllib.parse import urlparse
 
 import boto3
 
@@ -32,6 +33,32 @@ def create_experiment_step(create_experiment_function_name):
     return create_experiment_step
 
 
+def create_local_baseline_step(input_data, baseline_statistics_function_name):
+    # Compute the baseline in process, writing the same outputs as the processing job
+    baseline_step = steps.compute.LambdaStep(
+        "Baseline Statistics",
+        parameters={
+            "FunctionName": baseline_statistics_function_name,
+            "Payload": {
+                "BaselineInputUri": input_data["BaselineUri"],
+                "BaselineOutputUri.$": "$.BaselineOutputUri",
+            },
+        },
+        result_path="$.BaselineStatisticsResults",
+    )
+
+    # Add the catch
+    baseline_step.add_catch(
+        steps.states.Catch(
+            error_equals=["States.TaskFailed"],
+            next_step=stepfunctions.steps.states.Fail(
+                "Baseline failed", cause="BaselineStatisticsFailed"
+            ),
+        )
+    )
+    return baseline_step
+
+
 def create_baseline_step(input_data, execution_input, region, role):
     # Define the enviornment
     dataset_format = DatasetFormat.csv()
@@ -104,6 +131,63 @@ def create_baseline_step(input_data, execution_input, region, role):
     return baseline_step
 
 
+def upload_flat_trees_code(code_uri):
+    # The processing job runs the build script with the api modules that load the flat trees
+    url = urlparse(code_uri)
+    bucket, prefix = url.netloc, url.path.strip("/")
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    s3 = boto3.client("s3")
+    for path in [
+        os.path.join(base_dir, "build_flat_trees.py"),
+        os.path.join(base_dir, "..", "api", "flat_trees.py"),
+        os.path.join(base_dir, "..", "api", "local_model.py"),
+    ]:
+        s3.upload_file(path, bucket, "{}/{}".format(prefix, os.path.basename(path)))
+
+
+def create_flat_trees_step(image_uri, code_uri, execution_input, role):
+    # Convert the trained booster to flat trees once, so the api function loads them with numpy
+    inputs = [
+        ProcessingInput(
+            source=execution_input["ModelArtifactUri"],
+            destination="/opt/ml/processing/input/model",
+            input_name="model",
+        ),
+        ProcessingInput(
+            source=code_uri,
+            destination="/opt/ml/processing/input/code",
+            input_name="code",
+        ),
+    ]
+    outputs = [
+        ProcessingOutput(
+            source="/opt/ml/processing/output",
+            destination=execution_input["FlatTreesOutputUri"],
+            output_name="flat_trees",
+        ),
+    ]
+
+    # Use the training image, so the booster loads with the version of xgboost that saved it
+    processor = Processor(
+        image_uri=image_uri,
+        role=role,
+        instance_count=1,
+        instance_type="ml.m5.large",
+        entrypoint=["python3", "/opt/ml/processing/input/code/build_flat_trees.py"],
+        max_runtime_in_seconds=900,
+    )
+
+    flat_trees_step = steps.sagemaker.ProcessingStep(
+        "Build Flat Trees",
+        processor=processor,
+        job_name=execution_input["FlatTreesJobName"],
+        inputs=inputs,
+        outputs=outputs,
+        result_path="$.FlatTreesResults",
+    )
+    return flat_trees_step
+
+
 def get_training_image(region):
     return sagemaker.image_uris.retrieve(region=region, framework="xgboost", version="latest")
 
@@ -117,6 +201,7 @@ def create_training_step(
     query_training_function_name,
     region,
     role,
+    flat_trees_step=None,
 ):
     # Create the estimator
     xgb = sagemaker.estimator.Estimator(
@@ -213,7 +298,25 @@ def create_training_step(
 
     check_accuracy_step = steps.states.Choice("RMSE < 10")
 
-    check_accuracy_step.add_choice(rule=threshold_rule, next_step=check_accuracy_succeed_step)
+    # Build the flat trees of an accepted model, where a failed build leaves the api function
+    # scoring with the endpoint rather than failing the training
+    accepted_step = check_accuracy_succeed_step
+    if flat_trees_step is not None:
+        flat_trees_failed_step = steps.states.Pass(
+            "Flat Trees Failed", comment="Local inference falls back to the endpoint"
+        )
+        flat_trees_failed_step.next(check_accuracy_succeed_step)
+        flat_trees_step.add_catch(
+            steps.states.Catch(
+                error_equals=["States.TaskFailed"],
+                next_step=flat_trees_failed_step,
+                result_path="$.FlatTreesError",
+            )
+        )
+        flat_trees_step.next(check_accuracy_succeed_step)
+        accepted_step = flat_trees_step
+
+    check_accuracy_step.add_choice(rule=threshold_rule, next_step=accepted_step)
     check_accuracy_step.default_choice(next_step=check_accuracy_fail_step)
 
     # Return the chain of these steps
@@ -258,7 +361,16 @@ def get_dev_config(model_name, job_id, role, image_uri, kms_key_id, sagemaker_pr
 
 
 def get_prd_config(
-    model_name, job_id, role, image_uri, kms_key_id, notification_arn, sagemaker_project_id
+    model_name,
+    job_id,
+    role,
+    image_uri,
+    kms_key_id,
+    notification_arn,
+    sagemaker_project_id,
+    baseline_uri,
+    local_inference="false",
+    local_inference_layer_arn="",
 ):
     dev_config = get_dev_config(
         model_name, job_id, role, image_uri, kms_key_id, sagemaker_project_id
@@ -268,6 +380,9 @@ def get_prd_config(
         "ScheduleMetricName": "feature_baseline_drift_total_amount",
         "ScheduleMetricThreshold": str("0.20"),
         "NotificationArn": notification_arn,
+        "BaselineUri": baseline_uri,
+        "LocalInference": local_inference,
+        "LocalInferenceLayerArn": local_inference_layer_arn,
     }
     prod_tags = {"mlops:stage": "prd", "SageMakerProjectId": sagemaker_project_id}
     return {
@@ -316,10 +431,14 @@ def main(
     notification_arn,
     sagemaker_project_id,
     tags,
+    baseline_engine="processing",
+    local_inference="false",
+    local_inference_layer_arn="",
 ):
     # Define the function names
     create_experiment_function_name = "mlops-create-experiment"
     query_training_function_name = "mlops-query-training"
+    baseline_statistics_function_name = "mlops-baseline-statistics"
 
     # Get the region
     region = boto3.Session().region_name
@@ -353,6 +472,7 @@ def main(
     output_data = {
         "ModelOutputUri": "s3://{}/{}".format(sagemaker_bucket, model_name),
         "BaselineOutputUri": f"s3://{sagemaker_bucket}/{model_name}/monitoring/baseline/{model_name}-pbl-{job_id}",
+        "FlatTreesCodeUri": f"s3://{sagemaker_bucket}/{model_name}/code/{model_name}-fte-{job_id}",
     }
     print("model output uri: {}".format(output_data["ModelOutputUri"]))
 
@@ -375,12 +495,25 @@ def main(
             "BaselineJobName": str,
             "BaselineOutputUri": str,
             "TrainingJobName": str,
+            "FlatTreesJobName": str,
+            "ModelArtifactUri": str,
+            "FlatTreesOutputUri": str,
         }
     )
 
     # Create experiment step
     experiment_step = create_experiment_step(create_experiment_function_name)
-    baseline_step = create_baseline_step(input_data, execution_input, region, sagemaker_role)
+    if baseline_engine == "local":
+        baseline_step = create_local_baseline_step(input_data, baseline_statistics_function_name)
+    else:
+        baseline_step = create_baseline_step(input_data, execution_input, region, sagemaker_role)
+    # Flat trees are only built for the api function to score with when local inference is on
+    flat_trees_step = None
+    if local_inference == "true":
+        upload_flat_trees_code(output_data["FlatTreesCodeUri"])
+        flat_trees_step = create_flat_trees_step(
+            image_uri, output_data["FlatTreesCodeUri"], execution_input, sagemaker_role
+        )
     training_step = create_training_step(
         image_uri,
         hyperparameters,
@@ -390,6 +523,7 @@ def main(
         query_training_function_name,
         region,
         sagemaker_role,
+        flat_trees_step,
     )
     workflow_definition = create_graph(experiment_step, baseline_step, training_step)
 
@@ -420,6 +554,13 @@ def main(
             "BaselineJobName": "{}-pbl-{}".format(model_name, job_id),
             "BaselineOutputUri": output_data["BaselineOutputUri"],
             "TrainingJobName": "{}-{}".format(model_name, job_id),
+            "FlatTreesJobName": "{}-fte-{}".format(model_name, job_id),
+            "ModelArtifactUri": "{}/{}-{}/output/model.tar.gz".format(
+                output_data["ModelOutputUri"], model_name, job_id
+            ),
+            "FlatTreesOutputUri": "{}/{}-{}/output/flat-trees".format(
+                output_data["ModelOutputUri"], model_name, job_id
+            ),
         }
         json.dump(workflow_inputs, f)
 
@@ -438,6 +579,9 @@ def main(
             kms_key_id,
             notification_arn,
             sagemaker_project_id,
+            input_data["BaselineUri"],
+            local_inference,
+            local_inference_layer_arn,
         )
         json.dump(config, f)
 
@@ -472,6 +616,19 @@ if __name__ == "__main__":
     parser.add_argument("--workflow-role-arn", required=True)
     parser.add_argument("--notification-arn", required=True)
     parser.add_argument("--sagemaker-project-id", required=True)
+    parser.add_argument(
+        "--baseline-engine",
+        choices=["processing", "local"],
+        default="processing",
+        help="Compute the baseline with a processing job, or in process with a lambda",
+    )
+    parser.add_argument(
+        "--local-inference",
+        choices=["true", "false"],
+        default="false",
+        help="Build flat trees for the api function to score csv requests with",
+    )
+    parser.add_argument("--local-inference-layer-arn", default="")
     args = vars(parser.parse_args())
     print("args: {}".format(args))
     main(**args)
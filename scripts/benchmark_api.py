@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+# The api module creates its clients on import, so configure an offline environment first
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("ENDPOINT_NAME", "benchmark-endpoint")
+
+CONTENT_TYPES = ["text/csv", "application/json", "application/jsonlines"]
+
+
+class ServiceTime(object):
+    """
+    Samples endpoint service times in seconds from a named distribution.
+    """
+
+    def __init__(self, distribution, mean_ms, stddev_ms=0.0, seed=None):
+        self.distribution = distribution
+        self.mean = mean_ms / 1000.0
+        self.stddev = stddev_ms / 1000.0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample(self):
+        with self.lock:
+            if self.distribution == "constant":
+                return self.mean
+            if self.distribution == "uniform":
+                return self.random.uniform(0, 2 * self.mean)
+            if self.distribution == "exponential":
+                return self.random.expovariate(1.0 / self.mean)
+            if self.distribution == "lognormal":
+                # Parameterize the underlying normal so the samples have the given mean and stddev
+                ratio = 1 + (self.stddev / self.mean) ** 2
+                mu, sigma = math.log(self.mean / math.sqrt(ratio)), math.sqrt(math.log(ratio))
+                return self.random.lognormvariate(mu, sigma)
+            raise ValueError("unknown distribution: {}".format(self.distribution))
+
+
+class StubRuntime(object):
+    """
+    Local stand-in for the sagemaker-runtime client that returns one prediction per row.
+
+    Faults can be injected by throttling a fraction of invocations, or all invocations during
+    an outage of the given seconds after the start, as while the endpoint is scaling out.
+    """
+
+    def __init__(self, service_time, fault_rate=0.0, outage=None, seed=None):
+        self.service_time = service_time
+        self.fault_rate = fault_rate
+        self.outage = outage
+        self.invocations = 0
+        self.faults = 0
+        self.started = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def is_fault(self):
+        if self.outage is not None:
+            start, seconds = self.outage
+            if start <= time.monotonic() - self.started < start + seconds:
+                return True
+        return self.fault_rate > 0 and self.random.random() < self.fault_rate
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType, **kwargs):
+        with self.lock:
+            self.invocations += 1
+            fault = self.is_fault()
+            self.faults += fault
+        if fault:
+            time.sleep(0.001)
+            raise ClientError(
+                {
+                    "Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"},
+                    "ResponseMetadata": {"HTTPStatusCode": 429},
+                },
+                "InvokeEndpoint",
+            )
+        time.sleep(self.service_time.sample())
+        body = Body.decode("utf-8") if isinstance(Body, bytes) else Body
+        rows = [row for row in body.splitlines() if row.strip()]
+        if ContentType.startswith("application/json") and len(rows) == 1:
+            rows = json.loads(rows[0]).get("instances", rows)
+        predictions = ",".join("{:.4f}".format(10 + i % 50) for i in range(len(rows)))
+        return {
+            "Body": io.BytesIO(predictions.encode("utf-8")),
+            "ContentType": "text/csv",
+            "InvokedProductionVariant": "benchmark",
+        }
+
+
+class LambdaContext(object):
+    def __init__(self, timeout_ms=30000):
+        self.function_name = "benchmark"
+        self.aws_request_id = "benchmark"
+        self.deadline = time.time() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+def make_rows(count, rnd):
+    # Taxi features similar to the test data set: duration, passenger count and distance
+    return [
+        [round(rnd.uniform(1, 60), 2), rnd.randint(1, 6), round(rnd.uniform(0, 20), 2)]
+        for _ in range(count)
+    ]
+
+
+def make_event(content_type, rows):
+    if content_type == "text/csv":
+        body = "\n".join(",".join(str(v) for v in row) for row in rows)
+    elif content_type == "application/jsonlines":
+        body = "\n".join(json.dumps({"features": row}) for row in rows)
+    else:
+        body = json.dumps({"instances": rows})
+    return {"headers": {"Content-Type": content_type}, "body": body, "isBase64Encoded": False}
+
+
+def synthetic_events(content_type, row_count, count, seed):
+    rnd = random.Random(seed)
+    return [make_event(content_type, make_rows(row_count, rnd)) for _ in range(count)]
+
+
+def load_events(path):
+    # Recorded events are either a json list, or one api gateway event per line
+    with open(path, "r") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(app, events, concurrency, timeout_ms):
+    def invoke(event):
+        start = time.perf_counter()
+        response = app.lambda_handler(event, LambdaContext(timeout_ms))
+        return time.perf_counter() - start, response.get("statusCode")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(invoke, events))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    errors = sum(1 for _, status_code in results if status_code not in (200, 207, 503))
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "shed": sum(1 for _, status_code in results if status_code == 503),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "rps": len(results) / elapsed if elapsed > 0 else 0.0,
+        # ru_maxrss is reported in kilobytes on linux, and is the peak for the whole process
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def main(args):
+    if not args.cache:
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+    import app
+
+    service_time = ServiceTime(args.distribution, args.mean_ms, args.stddev_ms, args.seed)
+    outage = (args.outage_start, args.outage_seconds) if args.outage_seconds else None
+    app.sm_runtime = StubRuntime(service_time, args.fault_rate, outage, args.seed)
+
+    scenarios = []
+    if args.events_file:
+        scenarios.append(("recorded", "-", load_events(args.events_file)))
+    else:
+        for content_type in args.content_types:
+            for row_count in args.rows:
+                events = synthetic_events(content_type, row_count, args.requests, args.seed)
+                scenarios.append((content_type, row_count, events))
+
+    # Silence the per request logging of the api so it doesn't dominate the measurements
+    app.logger.setLevel("WARNING")
+
+    print(
+        "{:>22} {:>6} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+            "content type",
+            "rows",
+            "errors",
+            "shed",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "req/s",
+            "rss MB",
+        )
+    )
+    report = []
+    for content_type, row_count, events in scenarios:
+        result = run_scenario(app, events, args.concurrency, args.timeout_ms)
+        result.update({"content_type": content_type, "rows": row_count})
+        report.append(result)
+        print(
+            "{:>22} {:>6} {:>6} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>8.1f}".format(
+                content_type,
+                row_count,
+                result["errors"],
+                result["shed"],
+                result["p50_ms"],
+                result["p95_ms"],
+                result["p99_ms"],
+                result["rps"],
+                result["peak_rss_mb"],
+            )
+        )
+
+    print("invocation counters: {}".format(json.dumps(app.invoker.stats())))
+    print(
+        "endpoint invocations: {} faults: {}".format(
+            app.sm_runtime.invocations, app.sm_runtime.faults
+        )
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the api lambda handler against a local sagemaker-runtime stub"
+    )
+    parser.add_argument("--events-file", help="Recorded api gateway events as json or jsonl")
+    parser.add_argument("--content-types", nargs="+", default=CONTENT_TYPES)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100, 5000])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--distribution",
+        choices=["constant", "uniform", "exponential", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument("--mean-ms", type=float, default=20.0)
+    parser.add_argument("--stddev-ms", type=float, default=10.0)
+    parser.add_argument("--timeout-ms", type=int, default=30000)
+    parser.add_argument(
+        "--fault-rate", type=float, default=0.0, help="Fraction of invocations throttled"
+    )
+    parser.add_argument(
+        "--outage-start", type=float, default=0.0, help="Seconds after start of the outage"
+    )
+    parser.add_argument(
+        "--outage-seconds", type=float, default=0.0, help="Seconds all invocations throttle"
+    )
+    parser.add_argument("--cache", action="store_true", help="Enable the prediction cache")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    main(parser.parse_args())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+import numpy as np
+import xgboost
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import flat_trees  # noqa: E402
+import local_model  # noqa: E402
+from benchmark_local_model import train_model  # noqa: E402
+
+
+def read_uri(uri):
+    # Read a local file, or an object from s3 such as the validation uri from inputData.json
+    url = urlparse(uri)
+    if url.scheme != "s3":
+        with open(uri, "rb") as f:
+            return f.read()
+    import boto3
+
+    s3 = boto3.client("s3")
+    key = url.path.lstrip("/")
+    if key.endswith("/") or not os.path.splitext(key)[1]:
+        # The uri is a prefix, so read the first csv under it
+        contents = s3.list_objects_v2(Bucket=url.netloc, Prefix=key)["Contents"]
+        key = [c["Key"] for c in contents if c["Key"].endswith(".csv")][0]
+    return s3.get_object(Bucket=url.netloc, Key=key)["Body"].read()
+
+
+def load_validation(input_data, rows):
+    with open(input_data, "r") as f:
+        validation_uri = json.load(f)["ValidationUri"]
+    print("validation uri: {}".format(validation_uri))
+    data = np.loadtxt(io.BytesIO(read_uri(validation_uri)), delimiter=",", dtype=np.float32)
+    # The label is the first column of the validation set, which has no header
+    return data[:rows, 1:]
+
+
+def timed(fn, features, repeat):
+    fn(features)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(features)
+    return (time.perf_counter() - start) / repeat
+
+
+def peak_memory(fn, features):
+    tracemalloc.start()
+    fn(features)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(args):
+    if args.model_tar:
+        with open(args.model_tar, "rb") as f:
+            data = f.read()
+    else:
+        data = train_model(args.num_round, args.max_depth, args.seed)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+        booster = local_model.load_booster(tar.extractfile(local_model.MODEL_FILE_NAME).read())
+    # Compare a single core of each predictor
+    booster.set_param({"nthread": 1})
+
+    start = time.perf_counter()
+    trees = flat_trees.FlatTrees.from_booster(booster)
+    print(
+        "converted {} trees in {:.1f} ms".format(
+            len(trees.roots), (time.perf_counter() - start) * 1000
+        )
+    )
+
+    if args.input_data:
+        features = load_validation(args.input_data, args.rows)
+    else:
+        rnd = np.random.RandomState(args.seed)
+        features = np.column_stack(
+            [
+                rnd.uniform(1, 60, args.rows),
+                rnd.randint(1, 7, args.rows),
+                rnd.uniform(0, 20, args.rows),
+            ]
+        ).astype(np.float32)
+
+    reference = booster.predict(xgboost.DMatrix(features))
+    predictions = trees.predict(features)
+    exact = np.array_equal(reference.view(np.uint32), predictions.view(np.uint32))
+    print(
+        "parity on {} rows: bit exact: {} max abs diff: {}".format(
+            len(features), exact, float(np.max(np.abs(reference - predictions)))
+        )
+    )
+
+    print("{:>8} {:>16} {:>16}".format("rows", "booster rows/s", "flat rows/s"))
+    for batch_size in args.batch_sizes:
+        batch = features[:batch_size]
+        booster_seconds = timed(lambda x: booster.predict(xgboost.DMatrix(x)), batch, args.repeat)
+        flat_seconds = timed(trees.predict, batch, args.repeat)
+        print(
+            "{:>8} {:>16.0f} {:>16.0f}".format(
+                len(batch), len(batch) / booster_seconds, len(batch) / flat_seconds
+            )
+        )
+
+    print("booster model size: {:.1f} KB".format(len(booster.save_raw()) / 1024.0))
+    print("flat arrays size: {:.1f} KB".format(trees.nbytes / 1024.0))
+    print(
+        "peak python heap in predict: booster {:.1f} KB flat {:.1f} KB".format(
+            peak_memory(lambda x: booster.predict(xgboost.DMatrix(x)), features) / 1024.0,
+            peak_memory(trees.predict, features) / 1024.0,
+        )
+    )
+    if not exact:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check parity and compare throughput of flat trees with the xgboost booster"
+    )
+    parser.add_argument("--model-tar", help="Path to a model.tar.gz, otherwise one is trained")
+    parser.add_argument("--input-data", help="Path to inputData.json for the validation set")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--num-round", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=9)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import os
+import random
+import sys
+import tarfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import local_model  # noqa: E402
+
+# Lambda prices in us-east-1
+LAMBDA_REQUEST_PRICE = 0.20 / 1000000
+LAMBDA_GB_SECOND_PRICE = 0.0000166667
+
+
+class StubS3(object):
+    """
+    Serves a model.tar.gz from memory in place of the s3 client.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.data), "ETag": "benchmark"}
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": "benchmark"}
+
+
+def train_model(num_round, max_depth, seed):
+    # Train on synthetic taxi features with the same hyperparameters as the pipeline
+    import numpy as np
+    import xgboost
+
+    rnd = np.random.RandomState(seed)
+    features = np.column_stack(
+        [rnd.uniform(1, 60, 10000), rnd.randint(1, 7, 10000), rnd.uniform(0, 20, 10000)]
+    )
+    label = 2.5 + features[:, 0] * 0.4 + features[:, 2] * 2.5 + rnd.normal(0, 1, 10000)
+    params = {"max_depth": max_depth, "eta": 0.2, "objective": "reg:squarederror"}
+    booster = xgboost.train(params, xgboost.DMatrix(features, label=label), num_round)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        data = booster.save_raw(raw_format="ubj")
+        info = tarfile.TarInfo(local_model.MODEL_FILE_NAME)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(bytes(data)))
+    return buffer.getvalue()
+
+
+def make_rows(count, rnd):
+    return [
+        "{:.2f},{},{:.2f}".format(rnd.uniform(1, 60), rnd.randint(1, 6), rnd.uniform(0, 20))
+        for _ in range(count)
+    ]
+
+
+def lambda_cost(duration_seconds, memory_mb):
+    return LAMBDA_REQUEST_PRICE + duration_seconds * memory_mb / 1024.0 * LAMBDA_GB_SECOND_PRICE
+
+
+def main(args):
+    if args.model_tar:
+        with open(args.model_tar, "rb") as f:
+            data = f.read()
+    else:
+        data = train_model(args.num_round, args.max_depth, args.seed)
+
+    model = local_model.LocalModel(StubS3(data), "s3://benchmark/model.tar.gz", "v1")
+    start = time.perf_counter()
+    model.load()
+    print("model load: {:.1f} ms".format((time.perf_counter() - start) * 1000))
+
+    # Endpoint throughput is taken from the autoscaling target of invocations per instance
+    endpoint_invocations_per_hour = args.invocations_per_instance_minute * 60
+    rnd = random.Random(args.seed)
+    print(
+        "{:>8} {:>12} {:>14} {:>14} {:>14} {:>14}".format(
+            "rows", "local ms", "endpoint ms", "local rows/s", "local $/1M", "endpoint $/1M"
+        )
+    )
+    for batch_size in args.batch_sizes:
+        rows = make_rows(batch_size, rnd)
+        model.predict(rows, "endpoint-v1")
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            model.predict(rows, "endpoint-v1")
+        local_seconds = (time.perf_counter() - start) / args.repeat
+
+        # Per million predictions, in invocations of batch_size rows each
+        invocations = 1000000.0 / batch_size
+        local_cost = invocations * lambda_cost(local_seconds, args.memory_mb)
+        endpoint_seconds = args.endpoint_latency_ms / 1000.0
+        endpoint_cost = invocations * lambda_cost(endpoint_seconds, args.memory_mb)
+        endpoint_cost += invocations / endpoint_invocations_per_hour * args.instance_price
+        print(
+            "{:>8} {:>12.3f} {:>14.3f} {:>14.0f} {:>14.4f} {:>14.4f}".format(
+                batch_size,
+                local_seconds * 1000,
+                args.endpoint_latency_ms,
+                batch_size / local_seconds,
+                local_cost,
+                endpoint_cost,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare in process xgboost scoring with the endpoint for latency and cost"
+    )
+    parser.add_argument("--model-tar", help="Path to a model.tar.gz, otherwise one is trained")
+    parser.add_argument("--num-round", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=9)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--endpoint-latency-ms",
+        type=float,
+        default=25.0,
+        help="Measured latency of the endpoint invocation, eg from benchmark_api.py",
+    )
+    parser.add_argument("--memory-mb", type=int, default=512, help="Lambda memory size")
+    parser.add_argument("--instance-price", type=float, default=0.115, help="ml.m5.large $/hour")
+    parser.add_argument("--invocations-per-instance-minute", type=float, default=750.0)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
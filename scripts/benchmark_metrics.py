@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import metrics  # noqa: E402
+
+
+def instrument(timer, metrics_logger):
+    # The same calls the api makes for a request, without any work between them
+    timer.reset()
+    timer.dimensions = {"EndpointName": "benchmark-prd-v1", "ContentType": "text/csv"}
+    timer.mark("ParseHeaders")
+    timer.mark("Validate")
+    timer.add("Invoke", 0.02)
+    timer.add("ReadBody", 0.001)
+    timer.add("BuildResponse", 0.0001)
+    metrics_logger.record(timer, {"StatusCode": 200})
+
+
+def main(args):
+    with open(os.devnull, "w") as stream:
+        timer = metrics.StageTimer()
+        metrics_logger = metrics.MetricsLogger(
+            "benchmark/api", sample_rate=args.sample_rate, flush_seconds=1, stream=stream
+        )
+        for _ in range(100):
+            instrument(timer, metrics_logger)
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            instrument(timer, metrics_logger)
+        overhead_ms = (time.perf_counter() - start) / args.requests * 1000
+    print(
+        "overhead per request: {:.3f} ms ({} requests, sample rate {})".format(
+            overhead_ms, args.requests, args.sample_rate
+        )
+    )
+    if overhead_ms >= args.max_overhead_ms:
+        print("overhead exceeds {} ms".format(args.max_overhead_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the per request overhead of the api stage timings and metrics"
+    )
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--max-overhead-ms", type=float, default=1.0)
+    main(parser.parse_args())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import validation  # noqa: E402
+
+
+def make_json_body(size_bytes):
+    # Rows of taxi features similar to the test data set, without the total_amount label
+    rows = []
+    size = 0
+    while size < size_bytes:
+        row = [
+            round(random.uniform(1, 60), 2),
+            random.randint(1, 6),
+            round(random.uniform(0, 20), 2),
+        ]
+        rows.append(row)
+        size += len(json.dumps(row)) + 1
+    return json.dumps({"instances": rows})
+
+
+def measure(fn, body, repeat):
+    tracemalloc.start()
+    fn(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(body)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000, peak / 1024
+
+
+def main(sizes, repeat):
+    paths = {
+        "json.loads": json.loads,
+        "passthrough": validation.validate_json,
+    }
+    print("{:>10} {:>12} {:>12} {:>14}".format("size", "path", "time (ms)", "peak mem (KB)"))
+    for size in sizes:
+        body = make_json_body(size)
+        for name, fn in paths.items():
+            elapsed, peak = measure(fn, body, repeat)
+            print("{:>10} {:>12} {:>12.3f} {:>14.1f}".format(len(body), name, elapsed, peak))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare json parse and passthrough payloads")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 1024**2, 5 * 1024**2])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
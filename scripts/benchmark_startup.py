@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Runs in a fresh interpreter for each sample so every import is a cold start
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {api_dir!r})
+sys.path.insert(0, {scripts_dir!r})
+import app
+imported = time.perf_counter()
+if {stub}:
+    from benchmark_api import ServiceTime, StubRuntime
+    app.sm_runtime = StubRuntime(ServiceTime("constant", {mean_ms}))
+if {warmup}:
+    app.lambda_handler({{"warmup": True}}, None)
+warmed = time.perf_counter()
+event = {{"headers": {{"Content-Type": "text/csv"}}, "body": "12.5,1,3.2", "isBase64Encoded": False}}
+response = app.lambda_handler(event, None)
+invoked = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "module_import_ms": app.IMPORT_SECONDS * 1000,
+    "warmup_ms": (warmed - imported) * 1000,
+    "first_invoke_ms": (invoked - warmed) * 1000,
+    "status_code": response["statusCode"],
+}}))
+"""
+
+
+def run_child(args):
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    code = CHILD.format(
+        api_dir=os.path.join(scripts_dir, "..", "api"),
+        scripts_dir=scripts_dir,
+        stub=not args.live,
+        warmup=args.warmup,
+        mean_ms=args.mean_ms,
+    )
+    env = dict(os.environ)
+    if not args.live:
+        # Offline environment for the stub runtime, as in benchmark_api.py
+        env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        env.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+        env.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+        env.setdefault("ENDPOINT_NAME", "benchmark-endpoint")
+        env["WARMUP_CONNECTIONS"] = "0"
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, stdout=subprocess.PIPE
+    ).stdout.decode("utf-8")
+    # The api may write metric log lines, so take the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(count):
+    # Cumulative import time of the top level modules imported by the api
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env.setdefault("ENDPOINT_NAME", "benchmark-endpoint")
+    api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=api_dir,
+        env=env,
+        check=True,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    ).stderr.decode("utf-8")
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        # Top level imports of the app module are indented by three spaces
+        if name.startswith("   ") and not name.startswith("    "):
+            modules.append((int(parts[1]) / 1000.0, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main(args):
+    samples = [run_child(args) for _ in range(args.repeat)]
+    print("{:>20} {:>10} {:>10} {:>10}".format("", "median ms", "min ms", "max ms"))
+    for key in ["import_ms", "module_import_ms", "warmup_ms", "first_invoke_ms"]:
+        values = [s[key] for s in samples]
+        print(
+            "{:>20} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                key, statistics.median(values), min(values), max(values)
+            )
+        )
+    print("slowest imports of the app module:")
+    for ms, name in slowest_imports(args.top):
+        print("{:>10.1f} ms {}".format(ms, name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure api cold start import time and time to first invoke"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true", help="Send a warm-up event first")
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="Invoke the real ENDPOINT_NAME with the configured credentials instead of a stub",
+    )
+    parser.add_argument("--mean-ms", type=float, default=20.0, help="Stub endpoint latency")
+    parser.add_argument("--top", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import batching  # noqa: E402
+import validation  # noqa: E402
+
+# Features of the taxi baseline, with the total_amount label first
+CONSTRAINTS = {
+    "features": [
+        {"name": "total_amount", "inferred_type": "Fractional"},
+        {"name": "duration_minutes", "inferred_type": "Fractional"},
+        {"name": "passenger_count", "inferred_type": "Integral"},
+        {"name": "trip_distance", "inferred_type": "Fractional"},
+    ]
+}
+
+BAD_VALUES = ["abc", "nan", "inf", "1.2.3", ""]
+
+
+def make_rows(count, columns, invalid_fraction):
+    rows = []
+    for _ in range(count):
+        values = ["{:.2f}".format(random.uniform(0, 60)) for _ in range(columns)]
+        if random.random() < invalid_fraction:
+            bad = random.choice(BAD_VALUES)
+            if bad:
+                values[random.randrange(columns)] = bad
+            else:
+                values.pop()
+        rows.append(",".join(values))
+    return rows
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(args):
+    if args.constraints:
+        with open(args.constraints) as f:
+            constraints = json.load(f)
+    else:
+        constraints = CONSTRAINTS
+    schema = validation.CsvSchema.from_constraints(constraints, args.output_columns)
+    print("columns: {}".format(",".join(schema.names)))
+    print(
+        "{:>8} {:>10} {:>10} {:>12} {:>14}".format(
+            "rows", "invalid", "errors", "split ms", "validate ms"
+        )
+    )
+    for invalid_fraction in args.invalid_fractions:
+        rows = make_rows(args.rows, schema.column_count, invalid_fraction)
+        body = "\n".join(rows)
+        errors = validation.validate_csv_rows(rows, schema)
+        split_ms = timed(lambda: batching.split_rows(body), args.repeat)
+        validate_ms = timed(lambda: validation.validate_csv_rows(rows, schema), args.repeat)
+        print(
+            "{:>8} {:>10} {:>10} {:>12.3f} {:>14.3f}".format(
+                len(rows), invalid_fraction, len(errors), split_ms, validate_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure csv validation latency of the api")
+    parser.add_argument("--constraints", help="Path to a baseline constraints.json")
+    parser.add_argument("--output-columns", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--invalid-fractions", type=float, nargs="+", default=[0, 0.001, 0.1])
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
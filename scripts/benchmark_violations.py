@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "custom_resource"))
+
+import json_stream  # noqa: E402
+
+CHECK_TYPES = [
+    "baseline_drift_check",
+    "data_type_check",
+    "completeness_check",
+    "missing_column_check",
+]
+
+
+def write_violations(path, features, violations_per_feature):
+    """
+    Write a synthetic constraint_violations.json with violations of several types per feature.
+    """
+    violations = []
+    for i in range(features):
+        for check_type in random.sample(CHECK_TYPES, violations_per_feature):
+            violations.append(
+                {
+                    "feature_name": "feature_{}".format(i),
+                    "constraint_check_type": check_type,
+                    "description": "Baseline drift distance: {} exceeds threshold: 0.1".format(
+                        random.random()
+                    )
+                    + " " * random.randint(0, 200),
+                }
+            )
+    with open(path, "w") as f:
+        json.dump({"violations": violations}, f, indent=2)
+
+
+def parse_loads(path, chunk_bytes):
+    with open(path, "rb") as f:
+        violations = json.loads(f.read())["violations"]
+    return [
+        v["feature_name"]
+        for v in violations
+        if v["constraint_check_type"] == "baseline_drift_check"
+    ]
+
+
+def parse_stream(path, chunk_bytes):
+    with open(path, "rb") as f:
+        chunks = iter(lambda: f.read(chunk_bytes), b"")
+        violations = json_stream.iter_array_items(chunks, "violations")
+        return [
+            v["feature_name"]
+            for v in violations
+            if v["constraint_check_type"] == "baseline_drift_check"
+        ]
+
+
+PARSERS = {"loads": parse_loads, "stream": parse_stream}
+
+
+def measure(parser, path, chunk_bytes):
+    """
+    Parse the file in this process, printing the time and the peak rss above the interpreter's.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    features = PARSERS[parser](path, chunk_bytes)
+    ms = (time.perf_counter() - start) * 1000
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"ms": ms, "rss_kb": peak - before, "drifted": len(features)}))
+
+
+def run(parser, path, chunk_bytes):
+    # Each parse runs in a fresh interpreter so the peak rss is its own
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            __file__,
+            "--measure",
+            parser,
+            "--path",
+            path,
+            "--chunk-bytes",
+            str(chunk_bytes),
+        ]
+    )
+    return json.loads(output)
+
+
+def main(args):
+    if args.measure:
+        measure(args.measure, args.path, args.chunk_bytes)
+        return
+    random.seed(0)
+    print(
+        "{:>8} {:>10} {:>8} {:>10} {:>12} {:>10}".format(
+            "features", "file mb", "parser", "drifted", "parse ms", "peak mb"
+        )
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for features in args.features:
+            path = os.path.join(tmp, "constraint_violations_{}.json".format(features))
+            write_violations(path, features, args.violations_per_feature)
+            size_mb = os.path.getsize(path) / 1024.0 / 1024.0
+            for parser in PARSERS:
+                result = run(parser, path, args.chunk_bytes)
+                print(
+                    "{:>8} {:>10.1f} {:>8} {:>10} {:>12.1f} {:>10.1f}".format(
+                        features,
+                        size_mb,
+                        parser,
+                        result["drifted"],
+                        result["ms"],
+                        result["rss_kb"] / 1024.0,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare loading and streaming the violations of a monitoring job"
+    )
+    parser.add_argument("--features", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--violations-per-feature", type=int, default=3)
+    parser.add_argument("--chunk-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--measure", choices=sorted(PARSERS), help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,127 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# The lambda functions import their modules from the function directory
+sys.path.insert(0, os.path.join(BASE_DIR, "api"))
+sys.path.insert(0, os.path.join(BASE_DIR, "custom_resource"))
+# The benchmarks' endpoint stubs are shared with the tests
+sys.path.insert(0, os.path.join(BASE_DIR, "scripts"))
+
+# Clients are created on import, so they need a region and credentials but never call aws
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("ENDPOINT_NAME", "test-endpoint")
+
+
+def client_error(code, operation="Operation"):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size=None):
+        end = len(self.data) if size is None else self.offset + size
+        chunk = self.data[self.offset : end]
+        self.offset += len(chunk)
+        return chunk
+
+    def iter_lines(self):
+        for line in self.data.splitlines():
+            yield line
+
+    def iter_chunks(self, size):
+        while True:
+            chunk = self.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class FakeS3(object):
+    """
+    In memory stand-in for the s3 client calls the functions make.  Missing objects raise the
+    errors of a caller that may list the bucket, and errors can be injected by key.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.errors = {}
+
+    def _check(self, bucket, key, operation):
+        if (bucket, key) in self.errors:
+            raise client_error(self.errors[(bucket, key)], operation)
+        if (bucket, key) not in self.objects:
+            raise client_error("404" if operation == "HeadObject" else "NoSuchKey", operation)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": '"{}"'.format(len(self.objects))}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.put_object(bucket, key, fileobj.read())
+
+    def get_object(self, Bucket, Key):
+        self._check(Bucket, Key, "GetObject")
+        data = self.objects[(Bucket, Key)]
+        return {"Body": FakeBody(data), "ContentLength": len(data), "ETag": '"etag"'}
+
+    def head_object(self, Bucket, Key):
+        self._check(Bucket, Key, "HeadObject")
+        data = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(data), "ContentType": "application/json", "ETag": '"etag"'}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return "https://{Bucket}.s3.amazonaws.com/{Key}?signed".format(**Params)
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        return [{"Contents": [{"Key": key} for key in keys]}]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    The api module with a fresh cache and state, invoking a stub endpoint with no service time.
+    """
+    import app
+    import batching
+    import benchmark_api
+    import invocation
+    import prediction_cache
+
+    runtime = benchmark_api.StubRuntime(benchmark_api.ServiceTime("constant", 0), seed=0)
+    monkeypatch.setattr(app, "sm_runtime", runtime)
+    monkeypatch.setattr(app, "cache", prediction_cache.PredictionCache(max_entries=0))
+    monkeypatch.setattr(app, "row_separators", batching.RowSeparators())
+    # Calls are made on their own pool, as batch chunks wait on them from the app's pool
+    invoker = invocation.Invoker(ThreadPoolExecutor(max_workers=4), backoff_seconds=0)
+    monkeypatch.setattr(app, "invoker", invoker)
+    return app
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def fixture_path():
+    return lambda name: os.path.join(FIXTURES_DIR, name)
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import app
+import async_inference
+from conftest import client_error
+
+BUCKET = "sagemaker-bucket"
+
+
+class FakeRuntime(object):
+    def invoke_endpoint_async(self, EndpointName, InputLocation, InferenceId, **kwargs):
+        return {
+            "OutputLocation": "s3://{}/model/async/output/{}.out".format(BUCKET, InferenceId),
+            "FailureLocation": "s3://{}/model/async/failure/{}.out".format(BUCKET, InferenceId),
+        }
+
+
+@pytest.fixture
+def offload(s3, monkeypatch):
+    offload = async_inference.AsyncOffload(
+        s3, FakeRuntime(), "async-endpoint", "s3://{}/model/async/input".format(BUCKET)
+    )
+    monkeypatch.setattr(app, "async_offload", offload)
+    return offload
+
+
+def get_result(token):
+    event = {"httpMethod": "GET", "pathParameters": {"token": token}, "headers": {}}
+    return app.handle_request(event, None)
+
+
+def output_key(token):
+    return "model/async/output/{}.out".format(token)
+
+
+def test_submit_stages_the_body_and_marker(s3, offload):
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    assert s3.objects[(BUCKET, "model/async/input/{}/input".format(token))] == b"1,2,3"
+    marker = json.loads(s3.objects[(BUCKET, "model/async/input/{}/job.json".format(token))])
+    assert marker["OutputLocation"] == "s3://{}/{}".format(BUCKET, output_key(token))
+
+
+def test_poll_in_progress_job(offload):
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    response = get_result(token)
+    assert response["statusCode"] == 202
+    assert json.loads(response["body"]) == {"token": token, "status": "InProgress"}
+
+
+def test_poll_completed_job(s3, offload):
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    s3.put_object(Bucket=BUCKET, Key=output_key(token), Body='{"predictions": [1.5]}')
+    response = get_result(token)
+    assert response["statusCode"] == 200
+    assert response["body"] == '{"predictions": [1.5]}'
+
+
+def test_poll_failed_job(s3, offload):
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    s3.put_object(Bucket=BUCKET, Key="model/async/failure/{}.out".format(token), Body="bad input")
+    response = get_result(token)
+    assert response["statusCode"] == 500
+    assert response["message"] == "bad input"
+
+
+def test_poll_large_output_redirects(s3, offload, monkeypatch):
+    monkeypatch.setattr(app, "MAX_RESPONSE_BYTES", 10)
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    s3.put_object(Bucket=BUCKET, Key=output_key(token), Body='{"predictions": [1.5, 2.5]}')
+    response = get_result(token)
+    assert response["statusCode"] == 303
+    assert response["headers"]["Location"].endswith(output_key(token) + "?signed")
+
+
+def test_poll_unknown_token(offload):
+    assert get_result("missing")["statusCode"] == 404
+
+
+@pytest.mark.parametrize("code, status_code", [("AccessDenied", 500), ("SlowDown", 503)])
+def test_poll_s3_errors_map_to_status(s3, offload, code, status_code):
+    # Without list permission a missing output is access denied rather than not found
+    token = offload.submit(b"1,2,3", "text/csv", "")
+    s3.errors[(BUCKET, output_key(token))] = code
+    assert get_result(token)["statusCode"] == status_code
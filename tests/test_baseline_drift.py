@@ -0,0 +1,148 @@
+import json
+
+import pytest
+
+import baseline_drift
+import sagemaker_query_drift
+from conftest import FakeS3
+
+BUCKET = "sagemaker-bucket"
+BASELINE_PREFIX = "model/monitoring/baseline/model-pbl-123"
+RESULT_PREFIX = "model/monitoring/reports/model-prd-123/2026/09/21/12"
+JOB_NAME = "model-monitoring-job"
+
+
+@pytest.fixture
+def statistics(fixture_path):
+    def load(name):
+        with open(fixture_path("drift/" + name)) as f:
+            return json.load(f)
+
+    return load
+
+
+def by_feature(drift):
+    return dict((d["feature"], d) for d in drift)
+
+
+def test_compute_drift_of_every_feature(statistics):
+    drift = baseline_drift.compute_drift(
+        statistics("baseline-statistics.json"),
+        statistics("current-statistics.json"),
+        statistics("constraints.json"),
+    )
+
+    # Features are in baseline order, and those missing from the current statistics are skipped
+    assert [d["feature"] for d in drift] == ["age", "income", "state", "flag"]
+    drift = by_feature(drift)
+    # Buckets are interpolated, so the cdfs differ most at the bound of 5: 0.5 against 0.25
+    assert drift["age"]["drift"] == pytest.approx(0.25)
+    # Sketch items at level 1 count twice, so the current cdf is 0.5 up to 4 where the baseline's
+    # reaches 1
+    assert drift["income"]["drift"] == pytest.approx(0.5)
+    # Category frequencies differ most for WA, which the baseline doesn't have
+    assert drift["state"]["drift"] == pytest.approx(0.3)
+    # Zero width buckets are steps, of 0.9 against 0.85
+    assert drift["flag"]["drift"] == pytest.approx(0.05)
+    assert all(d["threshold"] == 0.2 for d in drift.values())
+    assert [name for name, d in drift.items() if d["exceeds"]] == ["age", "income", "state"]
+
+
+def test_default_threshold_without_constraints(statistics):
+    drift = baseline_drift.compute_drift(
+        statistics("baseline-statistics.json"), statistics("current-statistics.json")
+    )
+
+    assert all(d["threshold"] == baseline_drift.DEFAULT_COMPARISON_THRESHOLD for d in drift)
+    assert by_feature(drift)["age"]["exceeds"]
+
+
+def test_same_statistics_have_no_drift(statistics):
+    baseline = statistics("baseline-statistics.json")
+
+    drift = baseline_drift.compute_drift(baseline, baseline)
+
+    assert len(drift) == 5
+    assert all(d["drift"] == 0.0 and not d["exceeds"] for d in drift)
+
+
+def test_numerical_distances_are_computed_for_all_features_at_once():
+    # Histograms with different numbers of buckets are padded to the same shape
+    baselines = [([0.0], [10.0], [4.0]), ([0.0, 1.0, 2.0], [1.0, 2.0, 3.0], [1.0, 1.0, 2.0])]
+    currents = [([0.0, 5.0], [5.0, 10.0], [1.0, 3.0]), ([0.0], [3.0], [3.0])]
+
+    distances = baseline_drift.numerical_distances(baselines, currents)
+
+    assert distances == pytest.approx([0.25, 1.0 / 6])
+
+
+class FakeSageMaker(object):
+    def describe_processing_job(self, ProcessingJobName):
+        return {
+            "ProcessingJobName": ProcessingJobName,
+            "ProcessingJobStatus": "Completed",
+            "ExitMessage": "CompletedWithViolations: Job completed successfully with 1 violations.",
+            "Environment": {
+                "baseline_statistics": "/opt/ml/processing/baseline/stats/statistics.json",
+                "baseline_constraints": "/opt/ml/processing/baseline/constraints/constraints.json",
+            },
+            "ProcessingInputs": [
+                {
+                    "InputName": "baseline",
+                    "S3Input": {
+                        "S3Uri": "s3://{}/{}/statistics.json".format(BUCKET, BASELINE_PREFIX),
+                        "LocalPath": "/opt/ml/processing/baseline/stats",
+                    },
+                },
+                {
+                    "InputName": "constraints",
+                    "S3Input": {
+                        "S3Uri": "s3://{}/{}/constraints.json".format(BUCKET, BASELINE_PREFIX),
+                        "LocalPath": "/opt/ml/processing/baseline/constraints",
+                    },
+                },
+            ],
+            "ProcessingOutputConfig": {
+                "Outputs": [{"S3Output": {"S3Uri": "s3://{}/{}".format(BUCKET, RESULT_PREFIX)}}]
+            },
+        }
+
+
+@pytest.fixture
+def monitoring_run(fixture_path, monkeypatch):
+    s3 = FakeS3()
+    for prefix, name, fixture in [
+        (BASELINE_PREFIX, "statistics.json", "baseline-statistics.json"),
+        (BASELINE_PREFIX, "constraints.json", "constraints.json"),
+        (RESULT_PREFIX, "statistics.json", "current-statistics.json"),
+        (RESULT_PREFIX, "constraint_violations.json", "constraint_violations.json"),
+    ]:
+        with open(fixture_path("drift/" + fixture), "rb") as f:
+            s3.put_object(Bucket=BUCKET, Key="{}/{}".format(prefix, name), Body=f.read())
+    # The baseline files are the same for each test, but the errors injected are not
+    sagemaker_query_drift.get_s3_json.cache_clear()
+    monkeypatch.setattr(sagemaker_query_drift, "s3_client", s3)
+    monkeypatch.setattr(sagemaker_query_drift, "sm_client", FakeSageMaker())
+    yield s3
+    sagemaker_query_drift.get_s3_json.cache_clear()
+
+
+def test_query_processing_job_returns_the_drift_vector(monitoring_run):
+    result = sagemaker_query_drift.query_processing_job(JOB_NAME)
+
+    assert result["ProcessingJobStatus"] == "CompletedWithViolations"
+    # Only the features that violated the drift check, but the drift of them all
+    assert result["DriftViolations"] == ["age"]
+    drift = by_feature(result["BaselineDrift"])
+    assert sorted(drift) == ["age", "flag", "income", "state"]
+    assert drift["age"]["drift"] == pytest.approx(0.25)
+    assert drift["age"]["threshold"] == 0.2
+
+
+def test_violations_are_returned_when_drift_fails(monitoring_run):
+    monitoring_run.errors[(BUCKET, RESULT_PREFIX + "/statistics.json")] = "SlowDown"
+
+    result = sagemaker_query_drift.query_processing_job(JOB_NAME)
+
+    assert result["DriftViolations"] == ["age"]
+    assert result["BaselineDrift"] is None
@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+import pytest
+
+import baseline_drift
+import baseline_statistics
+from conftest import FakeS3
+
+BUCKET = "sagemaker-bucket"
+
+
+@pytest.fixture
+def baseline_fixture(fixture_path):
+    def load(name):
+        with open(fixture_path("baseline/" + name)) as f:
+            return f.read() if name.endswith(".csv") else json.load(f)
+
+    return load
+
+
+def compute(lines, chunk_rows=5):
+    baseline = baseline_statistics.BaselineStatistics(seed=0)
+    baseline_statistics.update_from_lines(baseline, lines, chunk_rows=chunk_rows)
+    return baseline
+
+
+def assert_matches(actual, expected, path="$"):
+    """
+    Assert the documents have the same keys and values, with floats within a tolerance and the
+    sketch data compared as the same multiset of values.
+    """
+    if isinstance(expected, dict):
+        assert sorted(actual) == sorted(expected), path
+        for key in expected:
+            if key == "data":
+                assert sorted(sum(actual[key], [])) == pytest.approx(sorted(sum(expected[key], [])))
+            else:
+                assert_matches(actual[key], expected[key], "{}.{}".format(path, key))
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected), path
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            assert_matches(a, e, "{}[{}]".format(path, i))
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected, rel=1e-9, abs=1e-9), path
+    else:
+        assert actual == expected, path
+
+
+def test_statistics_match_the_container(baseline_fixture):
+    baseline = compute(baseline_fixture("dataset.csv").splitlines())
+
+    assert_matches(baseline.statistics(), baseline_fixture("statistics.json"))
+
+
+def test_constraints_match_the_container(baseline_fixture):
+    baseline = compute(baseline_fixture("dataset.csv").splitlines())
+
+    assert_matches(baseline.constraints(), baseline_fixture("constraints.json"))
+
+
+def test_statistics_have_no_drift_from_the_container(baseline_fixture):
+    baseline = compute(baseline_fixture("dataset.csv").splitlines())
+
+    drift = baseline_drift.compute_drift(baseline.statistics(), baseline_fixture("statistics.json"))
+
+    assert [d["feature"] for d in drift] == ["label", "age", "income", "state"]
+    assert all(d["drift"] == pytest.approx(0.0) for d in drift)
+
+
+def test_merged_statistics_equal_a_single_pass(baseline_fixture):
+    header, *rows = baseline_fixture("dataset.csv").splitlines()
+    merged = compute([header] + rows[:10])
+    merged.merge(compute([header] + rows[10:]))
+
+    single = compute([header] + rows, chunk_rows=100)
+
+    assert_matches(merged.statistics(), single.statistics())
+    assert_matches(merged.constraints(), single.constraints())
+
+
+def test_sketch_quantiles_are_within_tolerance():
+    values = np.random.RandomState(0).lognormal(3.0, 1.0, 200000)
+    sketch = baseline_statistics.KllSketch(seed=0)
+    for chunk in np.array_split(values, 20):
+        sketch.update(chunk)
+
+    items, weights = sketch.items()
+    # The sketch keeps far fewer items than values, and their weights still count every value
+    assert len(items) < 10000
+    assert weights.sum() == len(values)
+    order = np.argsort(items)
+    ranks = np.cumsum(weights[order]) / weights.sum()
+    for q in [0.01, 0.1, 0.5, 0.9, 0.99]:
+        estimate = items[order][np.searchsorted(ranks, q)]
+        assert abs(np.mean(values <= estimate) - q) < 0.01
+
+
+def test_string_feature_with_many_values_has_no_domain(monkeypatch):
+    monkeypatch.setattr(baseline_statistics, "MAX_CATEGORIES", 3)
+    lines = ["state"] + ["CA", "NY", "TX", "WA"]
+
+    baseline = compute(lines)
+
+    (feature,) = baseline.statistics()["features"]
+    assert feature["string_statistics"] == {"common": {"num_present": 4, "num_missing": 0}}
+    (constraint,) = baseline.constraints()["features"]
+    assert "string_constraints" not in constraint
+
+
+def test_suggest_baseline_streams_every_object(baseline_fixture):
+    header, *rows = baseline_fixture("dataset.csv").splitlines()
+    s3 = FakeS3()
+    # Each file of the dataset has a header
+    for i, part in enumerate([rows[:12], rows[12:]]):
+        body = "\n".join([header] + part) + "\n"
+        s3.put_object(Bucket=BUCKET, Key="model/baseline/part-{}.csv".format(i), Body=body)
+
+    constraints_uri, statistics_uri = baseline_statistics.suggest_baseline(
+        s3, "s3://{}/model/baseline".format(BUCKET), "s3://{}/model/results/".format(BUCKET)
+    )
+
+    assert constraints_uri == "s3://{}/model/results/constraints.json".format(BUCKET)
+    assert statistics_uri == "s3://{}/model/results/statistics.json".format(BUCKET)
+    statistics = json.loads(s3.objects[(BUCKET, "model/results/statistics.json")])
+    assert_matches(statistics, baseline_fixture("statistics.json"))
+
+
+def test_suggest_baseline_without_a_dataset():
+    with pytest.raises(ValueError):
+        baseline_statistics.suggest_baseline(
+            FakeS3(), "s3://{}/model/baseline".format(BUCKET), "s3://{}/out".format(BUCKET)
+        )
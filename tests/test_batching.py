@@ -0,0 +1,92 @@
+import io
+
+import pytest
+
+import batching
+import prediction_cache
+from benchmark_api import LambdaContext
+
+
+def csv_event(rows):
+    return {
+        "headers": {"Content-Type": "text/csv"},
+        "body": "\n".join(rows),
+        "isBase64Encoded": False,
+    }
+
+
+def predict(api, rows):
+    response = api.lambda_handler(csv_event(rows), LambdaContext())
+    assert response["statusCode"] == 200
+    return response["body"]
+
+
+ROWS = ["1,2,3", "4,5,6", "7,8,9"]
+
+
+@pytest.fixture
+def cached_api(api, monkeypatch):
+    monkeypatch.setattr(api, "cache", prediction_cache.PredictionCache(max_entries=100))
+    return api
+
+
+@pytest.fixture
+def newline_runtime(api):
+    # Newer containers separate the predictions of several rows with newlines
+    invoke_endpoint = api.sm_runtime.invoke_endpoint
+
+    def invoke(**kwargs):
+        response = invoke_endpoint(**kwargs)
+        body = response["Body"].read().decode("utf-8")
+        response["Body"] = io.BytesIO(body.replace(",", "\n").encode("utf-8"))
+        return response
+
+    api.sm_runtime.invoke_endpoint = invoke
+    return api.sm_runtime
+
+
+def test_split_predictions():
+    assert batching.split_predictions("1.5,2.5") == ["1.5", "2.5"]
+    assert batching.split_predictions("1.5\n2.5\n") == ["1.5", "2.5"]
+    assert batching.split_predictions('{"predictions": [1.5, 2.5]}') == [1.5, 2.5]
+
+
+def test_row_separator():
+    assert batching.row_separator("1.5,2.5") == ","
+    assert batching.row_separator("1.5\n2.5\n") == "\n"
+    assert batching.row_separator("1.5") is None
+    assert batching.row_separator('{"predictions": [1.5, 2.5]}') is None
+
+
+def test_merge_results_keeps_the_chunk_separator():
+    results = [{"body": "1\n2"}, {"body": "3"}]
+    assert batching.merge_results(results) == "1\n2\n3"
+    assert batching.merge_results([{"body": "1"}, {"body": "2"}], "\n") == "1\n2"
+
+
+def test_cache_does_not_change_the_separator(api, monkeypatch):
+    uncached = predict(api, ROWS)
+    assert uncached == "10.0000,11.0000,12.0000"
+    monkeypatch.setattr(api, "cache", prediction_cache.PredictionCache(max_entries=100))
+    # Missing rows, fully cached rows and partially cached rows are all joined the same way
+    assert predict(api, ROWS) == uncached
+    assert predict(api, ROWS) == uncached
+    assert predict(api, ROWS + ["10,11,12"]).startswith(uncached + ",")
+
+
+def test_cached_single_rows_use_the_default_separator(cached_api):
+    for row in ROWS:
+        predict(cached_api, [row])
+    assert predict(cached_api, ROWS) == "10.0000,10.0000,10.0000"
+
+
+def test_cached_single_rows_use_the_learned_separator(cached_api, newline_runtime):
+    for row in ROWS:
+        predict(cached_api, [row])
+    assert predict(cached_api, ["10,11,12", "13,14,15"]) == "10.0000\n11.0000"
+    assert predict(cached_api, ROWS) == "10.0000\n10.0000\n10.0000"
+
+
+def test_chunked_rows_keep_the_separator(api, newline_runtime, monkeypatch):
+    monkeypatch.setattr(api, "BATCH_CHUNK_ROWS", 2)
+    assert predict(api, ROWS) == "10.0000\n11.0000\n10.0000"
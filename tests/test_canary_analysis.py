@@ -0,0 +1,176 @@
+import json
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+import canary_analysis
+import post_traffic_hook
+from benchmark_api import ServiceTime
+
+BASELINE_ENDPOINT = "model-prd-1"
+CANARY_ENDPOINT = "model-prd-2"
+START = datetime(2026, 9, 21, 12, 0, tzinfo=timezone.utc)
+END = datetime(2026, 9, 21, 12, 10, tzinfo=timezone.utc)
+
+
+def latencies(mean_ms, count, seed, digits=None):
+    service_time = ServiceTime("lognormal", mean_ms, mean_ms * 0.3, seed=seed)
+    values = [service_time.sample() * 1000.0 for _ in range(count)]
+    return values if digits is None else [round(value, digits) for value in values]
+
+
+@pytest.mark.parametrize("count", [8, 15])
+def test_exact_mann_whitney_matches_scipy(count):
+    stats = pytest.importorskip("scipy.stats")
+    x, y = latencies(50, count, seed=1), latencies(40, count, seed=2)
+
+    u, p = canary_analysis.mann_whitney_u(x, y)
+
+    expected = stats.mannwhitneyu(x, y, alternative="greater", method="exact")
+    assert u == expected.statistic
+    assert p == pytest.approx(expected.pvalue, rel=1e-9)
+
+
+@pytest.mark.parametrize("alternative", ["greater", "two-sided"])
+def test_asymptotic_mann_whitney_with_ties_matches_scipy(alternative):
+    stats = pytest.importorskip("scipy.stats")
+    # Rounded to whole milliseconds, as recorded latencies often are, so there are many ties
+    x, y = latencies(44, 200, seed=3, digits=0), latencies(40, 300, seed=4, digits=0)
+
+    u, p = canary_analysis.mann_whitney_u(x, y, alternative=alternative)
+
+    expected = stats.mannwhitneyu(x, y, alternative=alternative, method="asymptotic")
+    assert u == expected.statistic
+    assert p == pytest.approx(expected.pvalue, rel=1e-6)
+
+
+@pytest.mark.parametrize("alternative", ["greater", "two-sided"])
+def test_kolmogorov_smirnov_matches_scipy(alternative):
+    stats = pytest.importorskip("scipy.stats")
+    # A small shift, so the p-value is near the significance levels where the decision is made
+    x, y = latencies(42, 400, seed=5), latencies(40, 500, seed=6)
+
+    d, p = canary_analysis.ks_2samp(x, y, alternative=alternative)
+
+    # scipy's "greater" is of the cdf of its first sample, so x greater is its cdf being less
+    expected = stats.ks_2samp(
+        x, y, alternative="less" if alternative == "greater" else alternative, method="exact"
+    )
+    assert d == pytest.approx(expected.statistic)
+    # The asymptotic p-value is close to the exact one, not equal
+    assert p == pytest.approx(expected.pvalue, rel=0.1)
+
+
+def test_slower_canary_regresses():
+    baseline, canary = latencies(40, 200, seed=7), latencies(60, 200, seed=8)
+
+    result = canary_analysis.compare_latencies(canary, baseline)
+
+    assert result["Regressed"]
+    assert result["MannWhitneyP"] < 0.01 and result["KolmogorovSmirnovP"] < 0.01
+
+
+def test_same_latency_does_not_regress():
+    baseline, canary = latencies(40, 200, seed=9), latencies(40, 200, seed=10)
+
+    assert not canary_analysis.compare_latencies(canary, baseline)["Regressed"]
+
+
+def test_negligible_slowdown_does_not_regress():
+    # A 2% slowdown of tightly distributed latencies is significant, but under the minimum ratio
+    rng = random.Random(11)
+    baseline = [40.0 + rng.random() for _ in range(5000)]
+    canary = [value * 1.02 for value in baseline]
+
+    result = canary_analysis.compare_latencies(canary, baseline)
+
+    assert result["MannWhitneyP"] < 0.01
+    assert not result["Regressed"]
+
+
+def test_too_few_samples_are_skipped():
+    result = canary_analysis.compare_latencies([100.0] * 5, [10.0] * 5)
+
+    assert "Skipped" in result and not result["Regressed"]
+
+
+def test_error_rates():
+    assert canary_analysis.compare_errors(30, 1000, 5, 1000)["Regressed"]
+    assert not canary_analysis.compare_errors(6, 1000, 5, 1000)["Regressed"]
+    assert canary_analysis.compare_errors(0, 0, 5, 1000)["Skipped"] == "no samples"
+
+
+class FakeLogs(object):
+    """
+    Returns recorded log events of the api function from a single page.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.requests = []
+
+    def get_paginator(self, operation):
+        assert operation == "filter_log_events"
+        return self
+
+    def paginate(self, **kwargs):
+        self.requests.append(kwargs)
+        return [{"events": self.events}]
+
+
+@pytest.fixture
+def log_events(fixture_path):
+    with open(fixture_path("canary-log-events.json")) as f:
+        return json.load(f)["events"]
+
+
+@pytest.fixture
+def recorded_logs(log_events, monkeypatch):
+    logs = FakeLogs(log_events)
+    monkeypatch.setattr(post_traffic_hook, "logs", logs)
+    monkeypatch.setattr(post_traffic_hook, "API_LOG_GROUP", "/aws/lambda/model-api")
+    return logs
+
+
+def test_fetch_request_samples_splits_by_endpoint(recorded_logs):
+    samples = post_traffic_hook.fetch_request_samples("/aws/lambda/model-api", START, END, 1000)
+
+    assert sorted(samples) == [BASELINE_ENDPOINT, CANARY_ENDPOINT]
+    assert [len(s["Latencies"]) for s in samples.values()] == [30, 30]
+    assert recorded_logs.requests[0]["filterPattern"] == "{ $.Total = * }"
+
+
+def test_fetch_request_samples_stops_at_the_maximum(recorded_logs):
+    samples = post_traffic_hook.fetch_request_samples("/aws/lambda/model-api", START, END, 10)
+
+    assert sum(len(s["Latencies"]) for s in samples.values()) == 10
+
+
+def test_check_canary_fails_slower_endpoint(recorded_logs):
+    message = post_traffic_hook.check_canary(CANARY_ENDPOINT, START, END)
+
+    assert message.startswith("Canary latency median")
+
+
+def test_check_canary_passes_faster_endpoint(recorded_logs):
+    assert post_traffic_hook.check_canary(BASELINE_ENDPOINT, START, END) is None
+
+
+def test_check_canary_fails_on_errors(recorded_logs, log_events):
+    # Fail a third of the requests to the faster endpoint, so only its error rate regresses
+    for i, log_event in enumerate(log_events):
+        record = json.loads(log_event["message"])
+        if record["EndpointName"] == BASELINE_ENDPOINT and i % 3 == 0:
+            record["StatusCode"] = 500
+            log_event["message"] = json.dumps(record)
+
+    message = post_traffic_hook.check_canary(BASELINE_ENDPOINT, START, END)
+
+    assert message.startswith("Canary error rate")
+
+
+def test_check_canary_skips_first_deployment(recorded_logs, log_events):
+    recorded_logs.events = [e for e in log_events if CANARY_ENDPOINT in e["message"]]
+
+    assert post_traffic_hook.check_canary(CANARY_ENDPOINT, START, END) is None
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import sagemaker_drift_index
+import sagemaker_query_drift
+
+START = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=1)
+
+
+class FakeIndex(object):
+    def __init__(self, manifest=None):
+        self.manifest = dict(manifest or {})
+        self.runs = []
+
+    def load_manifest(self):
+        return dict(self.manifest)
+
+    def save_manifest(self, manifest):
+        self.manifest = manifest
+
+    def append(self, runs):
+        self.runs.extend(runs)
+        return len(runs)
+
+
+def execution(hour, status="Completed"):
+    return {
+        "ScheduledTime": START + timedelta(hours=hour),
+        "MonitoringExecutionStatus": status,
+        "ProcessingJobArn": "arn:aws:sagemaker:::processing-job/job-{}".format(hour),
+    }
+
+
+@pytest.fixture
+def schedule(monkeypatch):
+    executions = []
+    drift = {}
+    errors = set()
+    monkeypatch.setattr(
+        sagemaker_query_drift,
+        "list_schedule_executions",
+        lambda name, start_time, end_time: list(executions),
+    )
+
+    def query(job_names):
+        results = [
+            {
+                "ProcessingJobName": name,
+                "ProcessingJobStatus": "Completed",
+                "BaselineDrift": drift.get(name, [{"feature": "a", "drift": 0.1}]),
+            }
+            for name in job_names
+            if name not in errors
+        ]
+        return results, [{"ProcessingJobName": name, "Error": "error"} for name in errors]
+
+    monkeypatch.setattr(sagemaker_query_drift, "query_processing_jobs", query)
+    return executions, drift, errors
+
+
+def test_update_indexes_finished_runs(schedule):
+    executions, drift, errors = schedule
+    executions.extend([execution(1), execution(2), execution(3, "InProgress")])
+    index = FakeIndex({"LastScheduledTime": START.isoformat()})
+    result = sagemaker_drift_index.update_index(index, "schedule")
+    assert result["Indexed"] == 2
+    assert index.manifest["LastScheduledTime"] == (START + timedelta(hours=2)).isoformat()
+
+
+@pytest.mark.parametrize("missing", ["error", "no drift"])
+def test_update_stops_at_runs_to_retry(schedule, missing):
+    executions, drift, errors = schedule
+    executions.extend([execution(1), execution(2), execution(3)])
+    if missing == "error":
+        errors.add("job-2")
+    else:
+        drift["job-2"] = None
+    index = FakeIndex({"LastScheduledTime": START.isoformat()})
+    sagemaker_drift_index.update_index(index, "schedule")
+    assert index.manifest["LastScheduledTime"] == (START + timedelta(hours=1)).isoformat()
+
+
+def test_update_pages_through_a_backlog(schedule, monkeypatch):
+    executions, drift, errors = schedule
+    monkeypatch.setattr(sagemaker_query_drift, "MAX_JOBS", 2)
+    executions.extend(execution(hour) for hour in range(1, 6))
+    index = FakeIndex()
+    assert sagemaker_drift_index.update_index(index, "schedule")["Indexed"] == 2
+    assert index.manifest["LastScheduledTime"] == (START + timedelta(hours=2)).isoformat()
@@ -0,0 +1,125 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+import flat_trees
+import local_model
+from conftest import FakeS3
+
+BUCKET = "sagemaker-bucket"
+KEY = "model/model-123/output/flat-trees/flat-trees.npz"
+
+
+@pytest.fixture
+def model_dump(fixture_path):
+    with open(fixture_path("xgboost-trees.json")) as f:
+        return json.load(f)
+
+
+def build(model_dump, objective="reg:linear"):
+    return flat_trees.FlatTrees.from_json_trees(
+        model_dump["trees"], model_dump["base_score"], objective, model_dump["feature_names"]
+    )
+
+
+def reference_margin(model_dump, row):
+    """
+    Walk each tree of the json dump node by node, adding the leaves in float32 as XGBoost does.
+    """
+    feature_index = dict((name, i) for i, name in enumerate(model_dump["feature_names"]))
+    margin = np.float32(model_dump["base_score"])
+    for tree in model_dump["trees"]:
+        node = tree
+        while "leaf" not in node:
+            value = np.float32(row[feature_index[node["split"]]])
+            if math.isnan(value):
+                nodeid = node["missing"]
+            elif value < np.float32(node["split_condition"]):
+                nodeid = node["yes"]
+            else:
+                nodeid = node["no"]
+            node = next(child for child in node["children"] if child["nodeid"] == nodeid)
+        margin += np.float32(node["leaf"])
+    return margin
+
+
+def sample_rows(count=2000):
+    random = np.random.RandomState(0)
+    rows = np.column_stack(
+        [
+            random.uniform(18, 80, count),
+            random.uniform(10000, 90000, count),
+            random.uniform(0, 5, count),
+        ]
+    )
+    # Values on the split thresholds go to the "no" branch, and NaN to the missing branch
+    rows[:10] = [35.5, 52000.0, 2.25]
+    rows[10:20, 0] = 60.0
+    rows[20:30, 1] = 31000.5
+    rows[random.uniform(size=rows.shape) < 0.05] = np.nan
+    return rows
+
+
+def test_predictions_match_reference_walk(model_dump):
+    trees = build(model_dump)
+    rows = sample_rows()
+    expected = np.array([reference_margin(model_dump, row) for row in rows], dtype=np.float32)
+
+    # Squared-error predictions are the margin, so they match the booster bit for bit
+    np.testing.assert_array_equal(trees.predict(rows), expected)
+
+
+def test_bytes_round_trip(model_dump):
+    trees = build(model_dump)
+    rows = sample_rows(100)
+
+    loaded = flat_trees.FlatTrees.from_bytes(trees.to_bytes())
+
+    assert (loaded.base_score, loaded.objective) == (0.5, "reg:linear")
+    np.testing.assert_array_equal(loaded.predict(rows), trees.predict(rows))
+
+
+def local(trees, model_version="123"):
+    s3 = FakeS3()
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=trees.to_bytes())
+    return local_model.LocalModel(s3, "s3://{}/{}".format(BUCKET, KEY), model_version)
+
+
+def test_local_model_scores_squared_error_rows(model_dump):
+    model = local(build(model_dump))
+    rows = ["40,60000,3", "20,,1"]
+
+    predictions = model.predict(rows, "model-prd-123", separator="\n").split("\n")
+
+    expected = [reference_margin(model_dump, row) for row in local_model.parse_csv_rows(rows)]
+    assert [np.float32(p) for p in predictions] == expected
+    assert model.counters["LocalPredictions"] == 2
+
+
+def test_local_model_refuses_logistic_objective(model_dump):
+    model = local(build(model_dump, objective="binary:logistic"))
+
+    with pytest.raises(local_model.UnsupportedObjective):
+        model.predict(["40,60000,3"], "model-prd-123")
+    assert model.trees is None
+
+
+@pytest.mark.parametrize(
+    "endpoint_name, matches",
+    [
+        ("model-prd-123", True),
+        ("model-prd-0123", False),
+        ("model-prd-1234", False),
+        ("model-prd", False),
+    ],
+)
+def test_check_version_matches_whole_job_id(endpoint_name, matches, model_dump):
+    model = local(build(model_dump))
+
+    if matches:
+        model.check_version(endpoint_name)
+    else:
+        with pytest.raises(local_model.ModelVersionMismatch):
+            model.check_version(endpoint_name)
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import invocation
+from benchmark_api import LambdaContext, ServiceTime, StubRuntime
+
+
+def csv_event():
+    return {"headers": {"Content-Type": "text/csv"}, "body": "1,2,3", "isBase64Encoded": False}
+
+
+def run(api, requests):
+    return [api.lambda_handler(csv_event(), LambdaContext())["statusCode"] for _ in range(requests)]
+
+
+@pytest.fixture
+def faulty_api(api, monkeypatch):
+    def configure(fault_rate, retry_ratio=1.0, min_calls=1000):
+        runtime = StubRuntime(ServiceTime("constant", 0), fault_rate=fault_rate, seed=0)
+        invoker = invocation.Invoker(
+            ThreadPoolExecutor(max_workers=4),
+            backoff_seconds=0,
+            retry_budget=invocation.RetryBudget(ratio=retry_ratio, min_per_second=0, capacity=10),
+            breaker=invocation.CircuitBreaker(
+                min_calls=min_calls, window=min_calls, open_seconds=60
+            ),
+        )
+        monkeypatch.setattr(api, "sm_runtime", runtime)
+        monkeypatch.setattr(api, "invoker", invoker)
+        return runtime, invoker
+
+    return configure
+
+
+def test_retries_recover_throttled_calls(api, faulty_api):
+    runtime, invoker = faulty_api(fault_rate=0.2)
+    statuses = run(api, 100)
+    assert statuses.count(200) >= 98
+    # Every fault is retried except the last of a request that ran out of attempts
+    assert invoker.stats()["Retries"] == runtime.faults - (len(statuses) - statuses.count(200))
+
+
+def test_retry_budget_bounds_retries(api, faulty_api):
+    runtime, invoker = faulty_api(fault_rate=1.0, retry_ratio=0.1)
+    run(api, 50)
+    stats = invoker.stats()
+    # The initial capacity and a tenth of a token for each request
+    assert stats["Retries"] <= 10 + 0.1 * 50
+    assert stats["RetryBudgetExhausted"] > 0
+
+
+def test_breaker_opens_and_sheds(api, faulty_api):
+    runtime, invoker = faulty_api(fault_rate=1.0, min_calls=10)
+    statuses = run(api, 50)
+    stats = invoker.stats()
+    assert stats["BreakerOpened"] == 1
+    assert statuses[-1] == 503
+    assert stats["Shed"] == statuses.count(503)
+
+
+def test_counters_are_not_lost_across_threads():
+    invoker = invocation.Invoker(ThreadPoolExecutor(max_workers=1))
+    breaker = invoker.breaker_for("target")
+
+    def count():
+        for _ in range(200):
+            invoker.count("Shed")
+            with breaker._lock:
+                breaker._transition(breaker.OPEN)
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = invoker.stats()
+    assert stats["Shed"] == 1600
+    assert stats["BreakerOpened"] == 1600
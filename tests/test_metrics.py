@@ -0,0 +1,97 @@
+import io
+import json
+import time
+
+import pytest
+
+import metrics
+from benchmark_api import LambdaContext
+
+STAGES = ["ParseHeaders", "Validate", "Invoke", "ReadBody", "BuildResponse"]
+
+
+def records(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def metric_names(record):
+    return [d["Name"] for d in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+
+
+@pytest.fixture
+def stream(api, monkeypatch):
+    stream = io.StringIO()
+    logger = metrics.MetricsLogger("Test", sample_rate=1.0, stream=stream)
+    monkeypatch.setattr(api, "metrics_logger", logger)
+    return stream
+
+
+def test_request_stages_are_emitted(api, stream):
+    event = {"headers": {"Content-Type": "text/csv"}, "body": "1,2,3", "isBase64Encoded": False}
+
+    response = api.lambda_handler(event, LambdaContext())
+
+    assert response["statusCode"] == 200
+    (record,) = [r for r in records(stream) if "Total" in r]
+    assert record["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["EndpointName", "ContentType"]]
+    assert (record["EndpointName"], record["ContentType"]) == ("test-endpoint", "text/csv")
+    assert record["StatusCode"] == 200
+    assert set(STAGES + ["Total"]) <= set(metric_names(record))
+    assert all(record[stage] >= 0 for stage in STAGES)
+    assert sum(record[stage] for stage in STAGES) <= record["Total"]
+
+
+def test_samples_are_written_under_high_resolution_names():
+    stream = io.StringIO()
+    logger = metrics.MetricsLogger("Test", sample_rate=1.0, stream=stream)
+    timer = metrics.StageTimer()
+    for _ in range(3):
+        timer.reset()
+        timer.dimensions = {"EndpointName": "test-endpoint"}
+        timer.mark("Invoke")
+        logger.record(timer)
+
+    logger.flush()
+
+    per_request, samples = records(stream)[:3], records(stream)[3]
+    # Every request is written once with standard resolution, and the samples separately
+    assert all("StorageResolution" not in str(r["_aws"]) for r in per_request)
+    assert sorted(metric_names(samples)) == ["InvokeHighRes", "TotalHighRes"]
+    assert all(
+        d["StorageResolution"] == 1 for d in samples["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+    )
+    assert samples["TotalHighRes"] == [r["Total"] for r in per_request]
+    assert "Total" not in samples
+
+
+def test_samples_are_flushed_at_the_metric_value_limit():
+    stream = io.StringIO()
+    logger = metrics.MetricsLogger("Test", sample_rate=1.0, flush_seconds=3600, stream=stream)
+    timer = metrics.StageTimer()
+    timer.dimensions = {"EndpointName": "test-endpoint"}
+
+    for _ in range(logger.MAX_VALUES):
+        logger.record(timer)
+
+    samples = [r for r in records(stream) if "TotalHighRes" in r]
+    assert [len(r["TotalHighRes"]) for r in samples] == [logger.MAX_VALUES]
+
+
+def test_instrumentation_adds_well_under_a_millisecond():
+    logger = metrics.MetricsLogger("Test", sample_rate=1.0, stream=io.StringIO())
+    timer = metrics.StageTimer()
+    requests = 2000
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        timer.reset()
+        timer.dimensions = {"EndpointName": "test-endpoint", "ContentType": "text/csv"}
+        timer.mark("ParseHeaders")
+        timer.mark("Validate")
+        timer.add("Invoke", 0.01)
+        timer.add("ReadBody", 0.001)
+        timer.add("BuildResponse", 0.0001)
+        logger.record(timer, {"StatusCode": 200})
+    per_request = (time.perf_counter() - start) / requests
+
+    assert per_request < 0.0005
@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import invocation
+import routing
+from benchmark_api import LambdaContext, ServiceTime, StubRuntime
+from conftest import client_error
+
+
+class TargetRuntime(StubRuntime):
+    """
+    Stub endpoint that throttles every call to the failing endpoints.
+    """
+
+    def __init__(self, failing=(), service_ms=0):
+        super(TargetRuntime, self).__init__(ServiceTime("constant", service_ms), seed=0)
+        self.failing = set(failing)
+        self.calls = {}
+
+    def invoke_endpoint(self, EndpointName, **kwargs):
+        with self.lock:
+            self.calls[EndpointName] = self.calls.get(EndpointName, 0) + 1
+        if EndpointName in self.failing:
+            raise client_error("ThrottlingException", "InvokeEndpoint")
+        return super(TargetRuntime, self).invoke_endpoint(EndpointName=EndpointName, **kwargs)
+
+
+def csv_event():
+    return {"headers": {"Content-Type": "text/csv"}, "body": "1,2,3", "isBase64Encoded": False}
+
+
+@pytest.fixture
+def routed_api(api, monkeypatch):
+    breaker = invocation.CircuitBreaker(min_calls=5, window=10, open_seconds=60)
+    invoker = invocation.Invoker(ThreadPoolExecutor(max_workers=4), max_attempts=1, breaker=breaker)
+    monkeypatch.setattr(api, "invoker", invoker)
+    router = routing.Router([routing.Target("good"), routing.Target("bad")])
+    router.random.seed(0)
+    monkeypatch.setattr(api, "router", router)
+    return api
+
+
+def test_failing_target_does_not_shed_the_healthy_target(routed_api, monkeypatch):
+    runtime = TargetRuntime(failing=["bad"])
+    monkeypatch.setattr(routed_api, "sm_runtime", runtime)
+    statuses = [
+        routed_api.lambda_handler(csv_event(), LambdaContext())["statusCode"] for _ in range(200)
+    ]
+    assert routed_api.invoker.breaker_for("bad").state == invocation.CircuitBreaker.OPEN
+    assert routed_api.invoker.breaker_for("good").state == invocation.CircuitBreaker.CLOSED
+    # Once the failing target's circuit opens every request goes to the healthy target
+    assert statuses[-50:] == [200] * 50
+    assert runtime.calls["bad"] == 5
+
+
+def test_requests_are_shed_when_every_target_is_open(routed_api, monkeypatch):
+    monkeypatch.setattr(routed_api, "sm_runtime", TargetRuntime(failing=["good", "bad"]))
+    statuses = [
+        routed_api.lambda_handler(csv_event(), LambdaContext())["statusCode"] for _ in range(50)
+    ]
+    assert statuses[-1] == 503
+    assert routed_api.invoker.breaker_state() == invocation.CircuitBreaker.OPEN
+
+
+def test_hedged_call_is_recorded_once(api, monkeypatch):
+    monkeypatch.setattr(api, "sm_runtime", TargetRuntime(service_ms=20))
+    invoker = invocation.Invoker(
+        ThreadPoolExecutor(max_workers=4), hedge_percentile=50, hedge_min_delay_seconds=0.001
+    )
+    for _ in range(20):
+        invoker.latency.record(0.001)
+    monkeypatch.setattr(api, "invoker", invoker)
+    records = []
+    monkeypatch.setattr(api.router, "record", lambda *args, **kwargs: records.append(args))
+    assert api.lambda_handler(csv_event(), LambdaContext())["statusCode"] == 200
+    time.sleep(0.05)
+    assert invoker.counters["HedgesFired"] == 1
+    assert len(records) == 1
@@ -0,0 +1,55 @@
+import json
+import logging
+import time
+
+import shadow
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def flushed_records(caplog):
+    records = []
+    for message in caplog.messages:
+        if message.startswith("shadow records: "):
+            records.append(json.loads(message[len("shadow records: ") :])["records"])
+    return records
+
+
+def test_prediction_deltas():
+    assert shadow.prediction_deltas("1,2", "1.5,1") == {
+        "rows": 2,
+        "mean_abs_delta": 0.75,
+        "max_abs_delta": 1.0,
+    }
+    assert "error" in shadow.prediction_deltas("1,2", "1")
+
+
+def test_records_are_flushed_in_batches(caplog):
+    caplog.set_level(logging.INFO, logger="shadow")
+    mirror = shadow.ShadowMirror(lambda *args: "1.5", 1.0, batch_size=2, flush_seconds=60)
+    for _ in range(3):
+        assert mirror.offer("1,2,3", "text/csv", "", "1.0")
+    assert wait_for(lambda: mirror.counters["ShadowMirrored"] == 3 and len(mirror._records) == 1)
+    assert [len(records) for records in flushed_records(caplog)] == [2]
+    # The handler flushes the rest once the flush period has passed
+    mirror.flush_seconds = 0
+    mirror.flush_if_due()
+    assert [len(records) for records in flushed_records(caplog)] == [2, 1]
+
+
+def test_errors_are_recorded(caplog):
+    caplog.set_level(logging.INFO, logger="shadow")
+
+    def invoke(*args):
+        raise ValueError("shadow down")
+
+    mirror = shadow.ShadowMirror(invoke, 1.0, batch_size=1)
+    mirror.offer("1,2,3", "text/csv", "", "1.0")
+    assert wait_for(lambda: flushed_records(caplog))
+    assert flushed_records(caplog)[0][0]["error"] == "shadow down"
+    assert mirror.counters["ShadowErrors"] == 1